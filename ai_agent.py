@@ -1,16 +1,36 @@
+import asyncio
 import os
 from typing import TypedDict, Annotated, Sequence, Dict, Any, List, Optional
-from langgraph.graph import StateGraph, END
+from langgraph.graph import StateGraph, START, END
 from langgraph.graph.message import add_messages
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage, ToolMessage
-from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain_groq import ChatGroq
+from pydantic import BaseModel, Field
 import json
 import logging
+import re
+import threading
+import time
 from datetime import date
+from llm_providers import make_llm
+from llm_cache import build_default_cache, make_cache_key
+from llm_scheduler import LLMOverloadedError, llm_scheduler
+from tracing import current_span, detach_trace, log_payload, record_llm_usage, span, traced_node
+from chat_sessions import ChatSessionStore, SessionExpiredError, open_checkpointer
+from fast_extractor import FAST_PATH_CONFIDENCE_THRESHOLD, FAST_PATH_ENABLED, extract_fast, fast_path_stats
+from context_window import (build_context_window, context_stats, count_tokens, format_messages, messages_to_fold,
+                            record_prompt)
 
 # --- Environment Variables & Configuration ---
 GROQ_API_KEY = os.getenv("GROQ_API_KEY", "YOUR_GROQ_API_KEY_PLACEHOLDER") # Replace with your actual key or set env var
+# When the rolling summary (getContext) is updated: "background", "parallel", "serial" or "off"; see build_workflow
+CONTEXT_SUMMARY_MODE = os.getenv("CONTEXT_SUMMARY_MODE", "background")
+# Build the LLM clients and compile the graph during app startup (see warm_up) instead of on the first chat turn
+AGENT_WARM_UP = os.getenv("AGENT_WARM_UP", "true").lower() == "true"
+# Look up the most similar past interactions with the same HCP or products before extraction (similarInteractions
+# node), give them to the extraction model as reference and return them with the reply
+AGENT_SIMILAR_CONTEXT = os.getenv("AGENT_SIMILAR_CONTEXT", "false").lower() == "true"
+SIMILAR_CONTEXT_TOP_K = int(os.getenv("SIMILAR_CONTEXT_TOP_K", "3"))
+SIMILAR_CONTEXT_MAX_CHARS = 300 # Of each past interaction's key points / follow-ups in the prompt
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO)
@@ -28,71 +48,231 @@ class ExtractedInteraction(BaseModel):
     unclear_details: Optional[str] = Field(None, description="Any details that are unclear from the conversation and require clarification from the user.")
 
 
+# Batch jobs pack several short, independent transcripts into one extraction prompt (see extract_packed)
+PACKED_TRANSCRIPT_HEADER = "Transcript {number}:"
+
+class PackedTranscriptExtraction(ExtractedInteraction):
+    transcript: int = Field(..., description="Number of the transcript these details were extracted from.")
+
+class PackedExtraction(BaseModel):
+    interactions: List[PackedTranscriptExtraction] = Field(..., description="Exactly one entry per transcript.")
+
+    @classmethod
+    def stub_response(cls, structured_output: Dict[str, Any], prompt: str) -> "PackedExtraction":
+        # llm_providers.StubChatModel: the canned extraction once per transcript in the prompt
+        numbers = re.findall(r"^\s*" + PACKED_TRANSCRIPT_HEADER.format(number=r"(\d+)"), prompt, re.MULTILINE)
+        return cls(interactions=[{**structured_output, "transcript": int(number)} for number in numbers])
+
+
 # --- LangGraph State ---
 class InteractionState(TypedDict):
     messages: Annotated[Sequence[BaseMessage], add_messages]
     extracted_data: Optional[ExtractedInteraction]
     user_input: str # current user input
-    context_summary: Optional[str] # Summary from Llama3 for context if needed
+    context_summary: Optional[str] # Rolling summary (Llama3) of the turns that have left the verbatim window
+    summarized_count: int # Number of leading messages already folded into context_summary
+    similar_interactions: Optional[List[Dict[str, Any]]] # Past interactions like this turn's note (similarInteractions)
 
 
 # --- LLM Initialization ---
-# Gemma2 for primary conversational processing and extraction
-gemma_llm = ChatGroq(
-    temperature=0,
-    model="gemma2-9b-it", # Using gemma2 for extraction and chat
-    api_key=GROQ_API_KEY
-)
-
-# Llama3 for context summarization or deeper understanding if complex queries arise
-llama_llm = ChatGroq(
-    temperature=0.2,
-    model="llama3-70b-8192", # Corrected Llama3 model name based on typical Groq offerings (check specific availability)
-    # Note: Groq has models like 'llama3-70b-8192' or 'llama-3.1-70b-versatile'. I'll use 'llama3-70b-8192' as a common high-context one.
-    # If 'llama-3.3-70b-versatile' is specifically available and preferred, use that.
-    api_key=GROQ_API_KEY
-)
-
-# --- Tool for Gemma to use for extraction ---
-gemma_structured_llm = gemma_llm.with_structured_output(ExtractedInteraction)
+# Both come from the LLM_PROVIDER backend ("groq", or "stub" for offline runs); see configure_llms to inject others.
+# Created on first use (get_llms) or by warm_up(), not at import: building the provider clients is most of
+# this module's import time, which every worker start and every script importing main would otherwise pay.
+class AgentLLMs:
+    def __init__(self, gemma, llama):
+        # Gemma2 for primary conversational processing and extraction
+        self.gemma = gemma
+        # Llama3 for context summarization or deeper understanding if complex queries arise
+        self.llama = llama
+        # --- Tool for Gemma to use for extraction ---
+        self.gemma_structured = gemma.with_structured_output(ExtractedInteraction)
+        self.gemma_packed = gemma.with_structured_output(PackedExtraction)
+
+def make_default_llms() -> AgentLLMs:
+    return AgentLLMs(
+        gemma=make_llm("gemma2-9b-it", temperature=0), # Using gemma2 for extraction and chat
+        llama=make_llm(
+            "llama3-70b-8192", temperature=0.2, # Corrected Llama3 model name based on typical Groq offerings (check specific availability)
+            # Note: Groq has models like 'llama3-70b-8192' or 'llama-3.1-70b-versatile'. I'll use 'llama3-70b-8192' as a common high-context one.
+            # If 'llama-3.3-70b-versatile' is specifically available and preferred, use that.
+        ),
+    )
+
+_llms: Optional[AgentLLMs] = None
+# Lazy initialization may race between threads (warm_up runs in a worker thread while requests
+# may already need the agent); the lock makes sure the clients and the graph are built once.
+_init_lock = threading.RLock()
+
+def get_llms() -> AgentLLMs:
+    global _llms
+    if _llms is None:
+        with _init_lock:
+            if _llms is None:
+                _llms = make_default_llms()
+    return _llms
+
+def configure_llms(gemma=None, llama=None):
+    """Swap in other chat models (e.g. llm_providers.StubChatModel) for tests and benchmarks."""
+    global _llms
+    with _init_lock:
+        current = get_llms() if gemma is None or llama is None else None
+        _llms = AgentLLMs(gemma=gemma or current.gemma, llama=llama or current.llama)
+
+# --- LLM Response Cache ---
+# Retries and double-submits resend the same prompt; deterministic (temperature 0) calls are served from cache.
+llm_cache = build_default_cache()
+
+def usage_of(prompt: str, result) -> tuple:
+    # Provider-reported token counts when the result is a message; structured outputs carry none, so estimate
+    usage = getattr(result, "usage_metadata", None)
+    if usage:
+        return usage["input_tokens"], usage["output_tokens"]
+    output = result.model_dump_json() if isinstance(result, BaseModel) else getattr(result, "content", "")
+    return count_tokens(prompt), count_tokens(output)
+
+async def scheduled_ainvoke(runnable, prompt: str, lane: str, key: str):
+    # Concurrency cap, rate limit and 429 back-off per model; identical in-flight prompts share one call
+    async def call():
+        result = await runnable.ainvoke(prompt)
+        record_llm_usage(lane, *usage_of(prompt, result)) # Once per provider call, not per coalesced caller
+        return result
+    with span("llm", lane):
+        return await llm_scheduler.run(lane, call, key=key)
+
+async def cached_ainvoke(runnable, prompt: str, model: str, temperature: float, serialize, deserialize, lane: str):
+    key = make_cache_key(prompt, model, temperature)
+    if llm_cache is None or temperature != 0: # Sampled outputs are not reproducible, never cache them
+        return await scheduled_ainvoke(runnable, prompt, lane, key)
+    cached = await llm_cache.aget(key)
+    if cached is not None:
+        logger.info(f"LLM cache hit for {model}")
+        current_span().set(llm_cache_hit=True)
+        return deserialize(cached)
+    result = await scheduled_ainvoke(runnable, prompt, lane, key)
+    if result is not None:
+        await llm_cache.aset(key, serialize(result))
+    return result
 
 # --- Agent Nodes ---
 
 async def get_context_summary(state: InteractionState):
     logger.info("---SUMMARIZING CONVERSATION FOR CONTEXT (LLAMA3)---")
     history = state["messages"]
-    if len(history) < 3: # Not enough history to summarize meaningfully
-        return {"context_summary": "No extensive prior context."}
+    summarized_count = state.get("summarized_count") or 0
+    previous_summary = state.get("context_summary")
+    # Only turns that just left the verbatim window are summarized, on top of the previous summary,
+    # so each update costs the size of the new turns rather than the whole session.
+    to_fold = messages_to_fold(history, summarized_count)
+    if not to_fold: # Everything still fits in the recent-turns window
+        return {}
 
     try:
         prompt = f"""
-        Based on the following conversation history with a healthcare sales representative who is logging an interaction:
-        {history}
+        You maintain a running summary of a conversation with a healthcare sales representative who is logging an interaction.
+
+        Current summary:
+        {previous_summary or "No summary yet."}
+
+        Older conversation turns to fold into the summary:
+        {format_messages(to_fold)}
 
-        Summarize the key information already gathered about the current interaction being logged.
+        Update the summary with the key information from these turns.
         This summary will be used as context for the primary AI assistant.
         Focus on entities like HCP name, date, products, and main topics.
-        If crucial information is still missing, note that.
+        If crucial information is still missing, note that. Keep it brief.
         """
-        response = await llama_llm.ainvoke(prompt)
+        llama_llm = get_llms().llama
+        response = await scheduled_ainvoke(
+            llama_llm, prompt, lane=llama_llm.model_name,
+            key=make_cache_key(prompt, llama_llm.model_name, llama_llm.temperature),
+        )
         summary = response.content
-        logger.info(f"Context summary: {summary}")
-        return {"context_summary": summary}
+        context_stats.summary_updates += 1
+        logger.info(f"Context summary updated with {len(to_fold)} messages ({count_tokens(summary)} tokens)")
+        return {"context_summary": summary, "summarized_count": summarized_count + len(to_fold)}
     except Exception as e:
+        # Keep the previous summary; the same turns are retried on the next update
         logger.error(f"Error during context summarization: {e}")
-        return {"context_summary": "Error in generating context summary."}
+        return {}
+
+
+# --- Similar past interactions ---
+# Supplied by main, where the similarity index and the interactions table live:
+# async (text, hcp_name, products, k) -> interactions as dicts, most similar first
+_similar_interactions_lookup = None
+
+def configure_similar_interactions(lookup):
+    """Set the lookup used by the similarInteractions node (main wires in its similarity index)."""
+    global _similar_interactions_lookup
+    _similar_interactions_lookup = lookup
+
+async def find_similar_interactions(state: InteractionState):
+    user_input = state["user_input"]
+    if _similar_interactions_lookup is None:
+        return {"similar_interactions": []}
+    # Only the HCP and product names are needed here, and the fast-path rules resolve them against the known names
+    fields = extract_fast(user_input).fields
+    try:
+        similar = await _similar_interactions_lookup(user_input, fields.get("hcpName"), fields.get("productsDiscussed") or [],
+                                                     SIMILAR_CONTEXT_TOP_K)
+    except Exception as e:
+        logger.error(f"Similar interaction lookup failed: {e}")
+        similar = []
+    current_span().set(similar=len(similar))
+    return {"similar_interactions": similar}
+
+def render_similar_interactions(similar: List[Dict[str, Any]]) -> str:
+    lines = []
+    for item in similar:
+        notes = " / ".join(part for part in (item.get("keyDiscussionPoints"), item.get("followUpActions")) if part)
+        lines.append(f"- {item.get('interactionDate')}, {item.get('hcpName')} ({item.get('productsDiscussed') or 'no products'}): "
+                     f"{notes[:SIMILAR_CONTEXT_MAX_CHARS]}")
+    return "\n    ".join(lines) # Indented like the rest of the extraction prompt
+
+
+def has_earlier_turns(state: Dict[str, Any]) -> bool:
+    """Whether the session had turns before this one, still verbatim or folded into the summary."""
+    return bool(state.get("messages") or state.get("context_summary"))
+
+def fast_path_applies(fast, state: Dict[str, Any]) -> bool:
+    """
+    Whether the rule-based extraction replaces the LLM for a turn. The rules only read the current
+    message, so they are trusted for a session's first turn only: a follow-up ("also ProductB",
+    "actually it was Dr. Lee") is extracted by the LLM together with the earlier turns.
+    """
+    return FAST_PATH_ENABLED and fast.confidence >= FAST_PATH_CONFIDENCE_THRESHOLD and not has_earlier_turns(state)
 
 
 async def extract_interaction_details(state: InteractionState):
     logger.info("---ATTEMPTING TO EXTRACT INTERACTION DETAILS (GEMMA2)---")
     user_input = state["user_input"]
-    conversation_history = "\n".join([f"{msg.type}: {msg.content}" for msg in state["messages"]])
-    context_summary = state.get("context_summary", "No prior summary.")
+
+    # Fast path: formulaic notes are parsed locally (rules + known HCP/product names), skipping the LLM
+    if FAST_PATH_ENABLED:
+        start = time.perf_counter()
+        fast = extract_fast(user_input)
+        if fast_path_applies(fast, state):
+            fast_path_stats.record(True, (time.perf_counter() - start) * 1000)
+            extracted_info = ExtractedInteraction(**fast.fields)
+            logger.info(f"Fast-path extraction (confidence {fast.confidence:.2f}, fields {fast.field_confidence})")
+            log_payload(logger, "Fast-path extracted data", extracted_info.model_dump_json)
+            current_span().set(fast_path=True)
+            return {"extracted_data": extracted_info}
+        if has_earlier_turns(state):
+            logger.info("Follow-up turn in a session, using the LLM with the session history")
+        else:
+            logger.info(f"Fast-path confidence {fast.confidence:.2f} below {FAST_PATH_CONFIDENCE_THRESHOLD}, using the LLM")
 
     # Get today's date for default interactionDate
     today_date_str = date.today().isoformat()
-
-    prompt = f"""
+    similar = state.get("similar_interactions")
+    similar_section = f"""
+    Similar past interactions with this HCP or these products, for reference only (never copy their details into this one):
+    {render_similar_interactions(similar)}
+""" if similar else ""
+
+    def render_prompt(conversation_history: str, context_summary: str) -> str:
+        return f"""
     You are an AI assistant helping a healthcare sales representative log an interaction with a Healthcare Professional (HCP).
     Your goal is to extract structured information from the user's conversational input.
     If a field is not mentioned, do not invent data.
@@ -105,33 +285,53 @@ async def extract_interaction_details(state: InteractionState):
 
     And the overall context summary (if available):
     {context_summary}
-
+{similar_section}
     Based *only* on the user's current input and the provided history/context, extract the following details.
     If some details are present in history but contradicted or updated by the current user input, prioritize the current input.
     If the user's input is a question or not providing loggable information, you can respond conversationally,
     but still try to extract if any partial information is present.
     If crucial details are missing or ambiguous, list them in 'unclear_details'.
     """
+
+    # Recent turns verbatim plus the rolling summary, capped by the prompt token budget
+    window = build_context_window(
+        state["messages"], state.get("context_summary"), state.get("summarized_count") or 0,
+        reserved_tokens=count_tokens(render_prompt("", "")),
+    )
+    prompt = render_prompt(window.history_text, window.summary_text or "No prior summary.")
+    record_prompt("extractDetails", prompt, window)
     try:
         # Using the LLM with structured output
-        extracted_info: ExtractedInteraction = await gemma_structured_llm.ainvoke(prompt)
-        logger.info(f"Extracted data: {extracted_info.model_dump_json(indent=2)}")
+        start = time.perf_counter()
+        llms = get_llms()
+        gemma_llm = llms.gemma
+        extracted_info: ExtractedInteraction = await cached_ainvoke(
+            llms.gemma_structured, prompt,
+            model=f"{gemma_llm.model_name}:{ExtractedInteraction.__name__}", temperature=gemma_llm.temperature,
+            serialize=lambda result: result.model_dump_json(),
+            deserialize=ExtractedInteraction.model_validate_json,
+            lane=gemma_llm.model_name,
+        )
+        fast_path_stats.record(False, (time.perf_counter() - start) * 1000)
+        log_payload(logger, "Extracted data", extracted_info.model_dump_json)
         return {"extracted_data": extracted_info}
+    except LLMOverloadedError:
+        raise # The request fails fast with a 503 rather than a reply that asks to rephrase
     except Exception as e:
         logger.error(f"Error during extraction: {e}")
         ai_response = AIMessage(content=f"I had trouble processing that. Could you please rephrase or provide more details? Error: {e}")
         return {"messages": [ai_response], "extracted_data": None}
 
 
-async def conversational_agent_node(state: InteractionState):
-    logger.info("---AI CONVERSATIONAL RESPONSE (GEMMA2)---")
-    user_input = state["user_input"]
-    extracted_data = state.get("extracted_data")
-    messages_history = list(state["messages"]) # Make a mutable copy
+def names_only(text: str, names: List[str]) -> bool:
+    """Whether text is nothing but some of names ("re ProductA" leaves ProductA as the topic, not key points)."""
+    for name in sorted(names, key=len, reverse=True):
+        text = re.sub(re.escape(name), " ", text, flags=re.IGNORECASE)
+    return not re.sub(r"\b(?:and|&)\b|[\s,/+]", "", text, flags=re.IGNORECASE)
 
-    # Add user's latest message to history for context
-    messages_history.append(HumanMessage(content=user_input))
 
+def templated_reply(extracted_data: Optional[ExtractedInteraction]) -> Optional[str]:
+    """Confirmation reply for extracted fields without an LLM call; None when nothing was extracted."""
     response_parts = []
     if extracted_data:
         if extracted_data.hcpName:
@@ -140,7 +340,8 @@ async def conversational_agent_node(state: InteractionState):
             response_parts.append(f"Date: {extracted_data.interactionDate}.")
         if extracted_data.productsDiscussed:
             response_parts.append(f"Products: {', '.join(extracted_data.productsDiscussed)}.")
-        if extracted_data.keyDiscussionPoints:
+        if extracted_data.keyDiscussionPoints and not names_only(extracted_data.keyDiscussionPoints,
+                                                                extracted_data.productsDiscussed or []):
             response_parts.append("Got the key points.")
         if extracted_data.followUpActions:
             response_parts.append("And the follow-up actions.")
@@ -151,52 +352,167 @@ async def conversational_agent_node(state: InteractionState):
              response_parts.append("I've received your message.")
         else:
             response_parts.append("What else can I help you log about this interaction?")
+    return " ".join(response_parts) if response_parts else None
 
-    if not response_parts: # No data extracted, general conversation
+
+async def conversational_agent_node(state: InteractionState):
+    logger.info("---AI CONVERSATIONAL RESPONSE (GEMMA2)---")
+    user_input = state["user_input"]
+    ai_response_content = templated_reply(state.get("extracted_data"))
+
+    if ai_response_content is None: # No data extracted, general conversation
         # Basic conversational prompt if no extraction occurred or extraction yielded nothing
-        prompt = f"""You are a helpful AI assistant for a healthcare sales representative.
+        # History is rendered as plain "type: content" lines (message reprs carry per-message ids and defeat the cache)
+        def render_prompt(conversation_history: str, context_summary: str) -> str:
+            return f"""You are a helpful AI assistant for a healthcare sales representative.
         The user is trying to log an interaction.
         User's current message: "{user_input}"
+        Summary of earlier conversation:
+        {context_summary}
         Previous conversation:
-        {state['messages']}
+        {conversation_history}
 
         Respond naturally and helpfully. If the user's input seems like a command or data for logging,
         acknowledge it. If it's a question, answer it.
         If you have extracted data (passed to you implicitly), you can confirm parts of it.
         Keep your responses concise and focused on completing the interaction log.
         """
+
+        window = build_context_window(
+            state["messages"], state.get("context_summary"), state.get("summarized_count") or 0,
+            reserved_tokens=count_tokens(render_prompt("", "")),
+        )
+        prompt = render_prompt(window.history_text, window.summary_text or "None.")
+        record_prompt("conversationalAgent", prompt, window)
         try:
-            ai_response_content = (await gemma_llm.ainvoke(prompt)).content
+            gemma_llm = get_llms().gemma
+            ai_response_content = (await cached_ainvoke(
+                gemma_llm, prompt, model=gemma_llm.model_name, temperature=gemma_llm.temperature,
+                serialize=lambda result: result.content,
+                deserialize=lambda content: AIMessage(content=content),
+                lane=gemma_llm.model_name,
+            )).content
+        except LLMOverloadedError:
+            raise
         except Exception as e:
             logger.error(f"Error during conversational LLM call: {e}")
             ai_response_content = "I encountered an issue. Please try again."
-    else:
-        ai_response_content = " ".join(response_parts)
-
 
     ai_message = AIMessage(content=ai_response_content)
-    logger.info(f"AI Response: {ai_response_content}")
-    return {"messages": [ai_message]}
+    log_payload(logger, "AI Response", lambda: ai_response_content)
+    # Record both sides of the turn so the session checkpoint holds the full transcript
+    return {"messages": [HumanMessage(content=user_input), ai_message]}
 
 
 # --- Graph Definition ---
-workflow = StateGraph(InteractionState)
-
-# Add nodes
-workflow.add_node("getContext", get_context_summary) # Optional: for deeper context
-workflow.add_node("extractDetails", extract_interaction_details)
-workflow.add_node("conversationalAgent", conversational_agent_node)
+def build_workflow(context_mode: str = CONTEXT_SUMMARY_MODE, similar_context: bool = AGENT_SIMILAR_CONTEXT) -> StateGraph:
+    """
+    getContext only calls the LLM when turns leave the recent-turns window, so most turns pass straight
+    through; the summary it keeps lives in the session checkpoint and is reused by every later turn.
+      background: not in the graph. After the reply is sent, schedule_context_summary() folds the
+                  turns that left the window, so the next turn finds the summary ready.
+      parallel:   getContext and extractDetails run side by side and conversationalAgent waits for both.
+      serial:     getContext, then extractDetails. A folding turn pays for both LLM calls back to back.
+      off:        no summary; turns beyond the prompt budget are dropped.
+    In background and parallel modes a turn may run before its summary is updated: it then sees the
+    previous summary plus the unfolded turns verbatim (as far as the token budget allows).
+    With similar_context, similarInteractions (a local index lookup, no LLM call) runs right before extractDetails.
+    """
+    graph = StateGraph(InteractionState)
+    graph.add_node("extractDetails", traced_node("extractDetails", extract_interaction_details))
+    graph.add_node("conversationalAgent", traced_node("conversationalAgent", conversational_agent_node))
+    extraction_entry = "extractDetails"
+    if similar_context:
+        graph.add_node("similarInteractions", traced_node("similarInteractions", find_similar_interactions))
+        graph.add_edge("similarInteractions", "extractDetails")
+        extraction_entry = "similarInteractions"
+    if context_mode in ("off", "background"):
+        graph.add_edge(START, extraction_entry)
+        graph.add_edge("extractDetails", "conversationalAgent")
+    else:
+        graph.add_node("getContext", traced_node("getContext", get_context_summary))
+        if context_mode == "serial":
+            graph.add_edge(START, "getContext")
+            graph.add_edge("getContext", extraction_entry)
+            graph.add_edge("extractDetails", "conversationalAgent")
+        else:
+            graph.add_edge(START, "getContext")
+            graph.add_edge(START, extraction_entry)
+            graph.add_edge(["getContext", "extractDetails"], "conversationalAgent")
+    graph.add_edge("conversationalAgent", END) # For now, simple flow. Could loop or go to human validation.
+    return graph
+
+_summary_tasks: Dict[str, asyncio.Task] = {} # session_id -> background summary update in flight
+
+def schedule_context_summary(session_id: str):
+    """In background mode, fold this session's old turns into its summary off the request path."""
+    if CONTEXT_SUMMARY_MODE != "background" or session_id in _summary_tasks:
+        return # One update per session at a time; a later turn picks up whatever is left
+    task = asyncio.create_task(update_context_summary(session_id))
+    _summary_tasks[session_id] = task
+    task.add_done_callback(lambda _: _summary_tasks.pop(session_id, None))
+
+async def update_context_summary(session_id: str):
+    detach_trace() # Runs after the request that scheduled it has finished
+    config = session_store.config_for(session_id)
+    try:
+        graph = get_app_graph()
+        snapshot = await graph.aget_state(config)
+        if not snapshot.values.get("messages"):
+            return # Evicted (or never checkpointed) since the turn that scheduled this
+        with span("node", "getContext", background=True):
+            update = await get_context_summary(snapshot.values)
+        if update:
+            # Written as if by the last node, so the session's next turn starts from the new summary
+            await graph.aupdate_state(config, update, as_node="conversationalAgent")
+    except Exception as e:
+        logger.error(f"Background context summary for session {session_id} failed: {e}")
 
-# Define edges
-# workflow.set_entry_point("getContext") # If using context summarization first
-# workflow.add_edge("getContext", "extractDetails")
-workflow.set_entry_point("extractDetails") # Start directly with extraction for simpler flow
-workflow.add_edge("extractDetails", "conversationalAgent")
-workflow.add_edge("conversationalAgent", END) # For now, simple flow. Could loop or go to human validation.
+async def wait_for_context_summaries():
+    """Let in-flight background summaries finish (e.g. before the session store closes)."""
+    if _summary_tasks:
+        await asyncio.gather(*_summary_tasks.values(), return_exceptions=True)
 
 
 # Compile the graph
-app_graph = workflow.compile()
+# The checkpointer persists each session's state between turns, keyed by thread_id (= session_id)
+# (in-memory until setup_chat_sessions() opens the configured backend)
+session_store = ChatSessionStore()
+app_graph = None # Compiled on first use (get_app_graph) or by warm_up()
+stateless_graph = None # Without a checkpointer, for one-off turns that keep no session (get_stateless_graph)
+
+def get_app_graph():
+    global app_graph
+    if app_graph is None:
+        with _init_lock:
+            if app_graph is None:
+                app_graph = build_workflow().compile(checkpointer=session_store.checkpointer)
+    return app_graph
+
+def get_stateless_graph():
+    global stateless_graph
+    if stateless_graph is None:
+        with _init_lock:
+            if stateless_graph is None:
+                stateless_graph = build_workflow().compile()
+    return stateless_graph
+
+async def setup_chat_sessions():
+    """Open the configured session backend (memory or SQLite); the graph is recompiled against it on next use."""
+    global app_graph
+    session_store.checkpointer = await open_checkpointer()
+    await session_store.load_persisted_sessions()
+    app_graph = None
+
+def warm_up():
+    """
+    Build the LLM clients and compile the graph now, so the first chat turn does not pay for it.
+    Thread-safe; main runs it in a worker thread during startup (AGENT_WARM_UP).
+    """
+    start = time.perf_counter()
+    get_llms()
+    get_app_graph()
+    logger.info(f"Chat agent warmed up in {(time.perf_counter() - start) * 1000:.0f} ms")
 
 
 # --- FastAPI Integration (Example) ---
@@ -205,18 +521,38 @@ app_graph = workflow.compile()
 
 class ChatRequest(BaseModel):
     message: str
-    history: Optional[List[Dict[str, Any]]] = [] # e.g., [{'type': 'human', 'content': 'Hi'}, {'type': 'ai', 'content': 'Hello!'}]
+    session_id: Optional[str] = None # Returned by the first turn; send it back so only the new message is needed
+    history: Optional[List[Dict[str, Any]]] = [] # Full transcript, only used to seed a new (or expired) session
 
-async def process_chat_message(request: ChatRequest):
+async def check_chat_session(request: ChatRequest) -> bool:
     """
-    Processes a chat message using the LangGraph agent.
-    This function would be called by your FastAPI endpoint for /api/chat_interaction
+    Whether request.session_id names a live session (its checkpoint holds the conversation).
+    Raises SessionExpiredError when it names one that was evicted or lost in a restart and the
+    request has no history to seed it again, so it never silently continues as an empty conversation.
     """
-    logger.info(f"Processing chat message: {request.message}")
-
-    # Convert history to BaseMessage objects
+    if not request.session_id:
+        return False
+    if await session_store.has_checkpoint(request.session_id):
+        return True
+    if not request.history:
+        raise SessionExpiredError(request.session_id)
+    return False
+
+
+async def prepare_chat_turn(request: ChatRequest, persist_session: bool = True):
+    """Resolve the session for this turn (None when it keeps none) and build the graph input."""
+    session_id = None
+    seed_history = request.history or []
+    if persist_session:
+        # Continue an existing session from its checkpoint, or start (or re-seed) one
+        if await check_chat_session(request):
+            seed_history = []
+        session_id = request.session_id or session_store.new_session_id()
+        await session_store.touch(session_id)
+
+    # Convert history to BaseMessage objects (only to seed a new or expired session)
     langchain_history = []
-    for msg in request.history:
+    for msg in seed_history:
         if msg.get("sender") == "user" or msg.get("type") == "human": # Adapt based on frontend message format
             langchain_history.append(HumanMessage(content=msg.get("text") or msg.get("content")))
         elif msg.get("sender") == "ai" or msg.get("type") == "ai":
@@ -226,49 +562,165 @@ async def process_chat_message(request: ChatRequest):
         "messages": langchain_history,
         "user_input": request.message,
         "extracted_data": None,
-        "context_summary": None,
+        # context_summary / summarized_count are not reset: they carry over from the session checkpoint
     }
+    return session_id, initial_state
+
+
+def build_chat_result(ai_reply_content: Optional[str], extracted_data: Optional[ExtractedInteraction], session_id: Optional[str],
+                      similar_interactions: Optional[List[Dict[str, Any]]] = None):
+    # The AI's reply for the chat interface
+    if not ai_reply_content:
+        ai_reply_content = "Sorry, I couldn't generate a response."
+
+    # Extracted data to potentially pre-fill form or save directly
+    extracted_json = None
+    if extracted_data:
+        # Convert Pydantic model to dict, handling potential list for productsDiscussed
+        extracted_dict = extracted_data.model_dump()
+        if extracted_dict.get("productsDiscussed") and isinstance(extracted_dict["productsDiscussed"], list):
+            extracted_dict["productsDiscussed"] = ", ".join(extracted_dict["productsDiscussed"])
+        extracted_json = extracted_dict
+
+    log_payload(logger, "Final AI reply", lambda: f"{ai_reply_content}, Extracted data: {extracted_json}")
+    result = {"reply": ai_reply_content, "extracted_data": extracted_json, "session_id": session_id}
+    if similar_interactions is not None: # AGENT_SIMILAR_CONTEXT
+        result["similar_interactions"] = similar_interactions
+    return result
+
+
+async def process_chat_message(request: ChatRequest, persist_session: bool = True):
+    """
+    Processes a chat message using the LangGraph agent.
+    This function would be called by your FastAPI endpoint for /api/chat_interaction
+    With persist_session=False the turn is stateless (e.g. batch transcripts): no session is created
+    or touched (so none is evicted), nothing is checkpointed and no summary is scheduled.
+    """
+    log_payload(logger, "Processing chat message", lambda: request.message)
+    session_id, initial_state = await prepare_chat_turn(request, persist_session)
+    if persist_session:
+        graph, config = get_app_graph(), session_store.config_for(session_id)
+    else:
+        graph, config = get_stateless_graph(), None
 
     # Invoke the graph. Stream or full response depends on your preference.
     # For a chat, you often want the final AI message and any extracted data.
     final_state = None
-    async for event_output in app_graph.astream(initial_state):
+    similar_interactions = None
+    async for event_output in graph.astream(initial_state, config=config):
         # astream returns all node outputs. We are interested in the final state or specific node outputs.
         # logger.info(f"Graph event: {event_output}")
         for key, value in event_output.items(): # `key` is the node name
-            logger.info(f"Output from node '{key}': {value}")
+            log_payload(logger, f"Output from node '{key}'", lambda: value)
+            if key == "similarInteractions":
+                similar_interactions = value.get("similar_interactions")
             if key == "extractDetails":
                 initial_state["extracted_data"] = value.get("extracted_data")
             if key == "conversationalAgent": # This is the last node in this simple setup
-                final_state = value # Contains the AI's response message
-                # We might also want to update overall state with this message
-                if "messages" in value and value["messages"]:
-                    # Assuming value["messages"] is a list of new messages from this node
-                    new_ai_message_obj = value["messages"][-1] # Get the last AI message from the node
-                    initial_state["messages"].append(HumanMessage(content=request.message)) # User's trigger message
-                    initial_state["messages"].append(new_ai_message_obj) # AI's response
-
+                final_state = value # Contains the AI's response message (the checkpointer keeps the transcript)
 
-    # The AI's reply for the chat interface
-    ai_reply_content = "Sorry, I couldn't generate a response."
+    ai_reply_content = None
     if final_state and "messages" in final_state and final_state["messages"]:
         # Assuming the last message from 'conversationalAgent' node is the one to send back
         ai_reply_content = final_state["messages"][-1].content
 
+    if persist_session:
+        schedule_context_summary(session_id)
+    return build_chat_result(ai_reply_content, initial_state["extracted_data"], session_id, similar_interactions)
 
-    # Extracted data to potentially pre-fill form or save directly
-    extracted_json = None
-    if initial_state["extracted_data"]:
-        # Convert Pydantic model to dict, handling potential list for productsDiscussed
-        extracted_dict = initial_state["extracted_data"].model_dump()
-        if extracted_dict.get("productsDiscussed") and isinstance(extracted_dict["productsDiscussed"], list):
-            extracted_dict["productsDiscussed"] = ", ".join(extracted_dict["productsDiscussed"])
-        extracted_json = extracted_dict
 
+async def stream_chat_message(request: ChatRequest):
+    """
+    Same turn as process_chat_message, but yields (event, data) pairs while the graph runs:
+    "start" right away, "node" as each node finishes, "similar" with the similar past interactions
+    (AGENT_SIMILAR_CONTEXT), "extracted" with the fields found so far, "token" for each reply delta
+    from the conversational model, and finally "result" (the same dict process_chat_message returns).
+    """
+    log_payload(logger, "Streaming chat message", lambda: request.message)
+    session_id, initial_state = await prepare_chat_turn(request)
+    yield "start", {"session_id": session_id}
+
+    extracted_data = None
+    similar_interactions = None
+    ai_reply_content = None
+    streamed_reply = False
+    config = session_store.config_for(session_id)
+    async for event in get_app_graph().astream_events(initial_state, config=config, version="v2"):
+        kind = event["event"]
+        node = event.get("metadata", {}).get("langgraph_node")
+        if kind == "on_chat_model_stream" and node == "conversationalAgent":
+            delta = event["data"]["chunk"].content
+            if delta:
+                streamed_reply = True
+                yield "token", {"delta": delta}
+        elif kind == "on_chain_end" and event["name"] == node and not node.startswith("__"):
+            # A graph node itself finished (not one of its sub-runnables, nor the internal __start__ step)
+            output = event["data"].get("output") or {}
+            yield "node", {"node": node}
+            if node == "similarInteractions":
+                similar_interactions = output.get("similar_interactions") or []
+                yield "similar", {"items": similar_interactions}
+            elif node == "extractDetails" and output.get("extracted_data"):
+                extracted_data = output["extracted_data"]
+                yield "extracted", extracted_data.model_dump(exclude_none=True)
+            elif node == "conversationalAgent" and output.get("messages"):
+                ai_reply_content = output["messages"][-1].content
+                if not streamed_reply: # Templated or cached reply: no model tokens, send it in one piece
+                    yield "token", {"delta": ai_reply_content}
+
+    schedule_context_summary(session_id)
+    yield "result", build_chat_result(ai_reply_content, extracted_data, session_id, similar_interactions)
+
+
+# --- Batch extraction (packed prompts) ---
+def is_packable(message: str, max_tokens: int) -> bool:
+    """Short transcripts the fast path cannot handle on its own are worth sharing an extraction prompt."""
+    if count_tokens(message) > max_tokens:
+        return False
+    # A batch transcript runs as a one-turn session with no earlier turns (see ChatBatchRunner)
+    return not (FAST_PATH_ENABLED and fast_path_applies(extract_fast(message), {}))
+
+
+async def extract_packed(messages: List[str]) -> List[Optional[ExtractedInteraction]]:
+    """
+    Extract several independent one-message transcripts with one structured LLM call.
+    Entries come back in input order; None where the model returned nothing for a transcript,
+    so the caller can retry those on their own.
+    """
+    today_date_str = date.today().isoformat()
+    transcripts = "\n\n".join(f"{PACKED_TRANSCRIPT_HEADER.format(number=number)}\n\"{message}\""
+                               for number, message in enumerate(messages, start=1))
+    prompt = f"""
+    You are an AI assistant helping a healthcare sales representative log interactions with Healthcare Professionals (HCPs).
+    Below are {len(messages)} separate transcripts of dictated notes. Each one describes its own interaction:
+    extract each transcript independently and never carry details from one transcript into another.
+    If a field is not mentioned, do not invent data.
+    If the interaction date is not specified, assume it is today: {today_date_str}.
+    If crucial details are missing or ambiguous, list them in 'unclear_details'.
+    Return exactly one entry per transcript, with 'transcript' set to its number.
+
+    {transcripts}
+    """
+    llms = get_llms()
+    gemma_llm = llms.gemma
+    packed: PackedExtraction = await cached_ainvoke(
+        llms.gemma_packed, prompt,
+        model=f"{gemma_llm.model_name}:{PackedExtraction.__name__}", temperature=gemma_llm.temperature,
+        serialize=lambda result: result.model_dump_json(),
+        deserialize=PackedExtraction.model_validate_json,
+        lane=gemma_llm.model_name,
+    )
+    by_number = {entry.transcript: entry for entry in packed.interactions}
+    extracted = []
+    for number in range(1, len(messages) + 1):
+        entry = by_number.get(number)
+        extracted.append(ExtractedInteraction(**entry.model_dump(exclude={"transcript"})) if entry else None)
+    return extracted
 
-    logger.info(f"Final AI reply: {ai_reply_content}, Extracted data: {extracted_json}")
 
-    return {"reply": ai_reply_content, "extracted_data": extracted_json}
+def packed_chat_result(extracted_data: ExtractedInteraction):
+    """process_chat_message's result for a transcript extracted in a pack (no session: it was never a chat)."""
+    return build_chat_result(templated_reply(extracted_data), extracted_data, session_id=None)
 
 
 # Example usage (for testing this file directly):
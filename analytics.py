@@ -0,0 +1,184 @@
+import logging
+from collections import Counter
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import Column, Index, Integer, MetaData, String, Table, delete, func, select
+from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+logger = logging.getLogger(__name__)
+
+# --- Rollup table ---
+# One narrow table for every dashboard series: (metric, key, period) -> interaction count.
+#   hcp        key = HCP name         period = month (YYYY-MM)
+#   product    key = product name     period = month
+#   sentiment  key = sentiment label  period = month
+#   week       key = source           period = Monday of the week (YYYY-MM-DD)
+# Maintained in the same transaction as every interaction insert, so it never drifts from the raw
+# rows; rebuild_rollups() recomputes it from scratch and check_rollups() compares the two.
+rollup_metadata = MetaData()
+analytics_rollups = Table(
+    "analytics_rollups",
+    rollup_metadata,
+    Column("metric", String, primary_key=True),
+    Column("key", String, primary_key=True),
+    Column("period", String, primary_key=True),
+    Column("interactions", Integer, nullable=False),
+    # Dashboards read a period range of one metric
+    Index("ix_analytics_rollups_metric_period", "metric", "period"),
+)
+
+ROLLUP_METRICS = ["hcp", "product", "sentiment", "week"]
+UNKNOWN_SENTIMENT = "unknown"
+
+# The same rollups as one GROUP BY each over the raw tables; the SQL counterpart of rollup_increments().
+# {month} and {week} are the dialect's PERIOD_SQL over "interactionDate" (quoted: PostgreSQL folds bare names to lower case)
+ROLLUP_SOURCE_SQL = {
+    # A blank name is no HCP, as in rollup_increments() and the hcps dimension
+    "hcp": 'SELECT "hcpName", {month}, count(*) FROM interactions WHERE "hcpName" IS NOT NULL AND "hcpName" <> \'\' GROUP BY 1, 2',
+    "product": "SELECT products.name, {month}, count(*) "
+               "FROM interaction_products JOIN products ON products.id = interaction_products.product_id GROUP BY 1, 2",
+    "sentiment": "SELECT coalesce(sentiment, '" + UNKNOWN_SENTIMENT + "'), {month}, count(*) FROM interactions GROUP BY 1, 2",
+    "week": "SELECT CAST(source AS TEXT), {week}, count(*) FROM interactions GROUP BY 1, 2",
+}
+PERIOD_SQL = {
+    # '-6 days' then 'weekday 1' lands on the Monday on or before the date
+    "sqlite": {"month": """strftime('%Y-%m', "interactionDate")""", "week": """date("interactionDate", '-6 days', 'weekday 1')"""},
+    "postgresql": {"month": """to_char("interactionDate", 'YYYY-MM')""",
+                   "week": """to_char(date_trunc('week', "interactionDate"), 'YYYY-MM-DD')"""},
+}
+UPSERT_INSERT = {"sqlite": sqlite_insert, "postgresql": postgresql_insert}
+
+
+def month_of(day: date) -> str:
+    return day.strftime("%Y-%m")
+
+
+def week_of(day: date) -> str:
+    return (day - timedelta(days=day.weekday())).isoformat()
+
+
+def create_rollup_tables(sync_conn) -> bool:
+    """Create the rollup table if missing; returns True when it is new and needs a rebuild."""
+    existed = sync_conn.dialect.has_table(sync_conn, analytics_rollups.name)
+    rollup_metadata.create_all(sync_conn)
+    return not existed
+
+
+# --- Incremental maintenance ---
+def rollup_increments(rows: Sequence[Dict[str, Any]], row_products: Sequence[List[str]]) -> Counter:
+    """(metric, key, period) -> count to add for newly inserted interaction rows."""
+    increments = Counter()
+    for row, products in zip(rows, row_products):
+        day = row["interactionDate"]
+        if isinstance(day, str):
+            day = date.fromisoformat(day)
+        month = month_of(day)
+        if row.get("hcpName"):
+            increments[("hcp", row["hcpName"], month)] += 1
+        for product in products:
+            increments[("product", product, month)] += 1
+        increments[("sentiment", row.get("sentiment") or UNKNOWN_SENTIMENT, month)] += 1
+        source = row.get("source")
+        increments[("week", getattr(source, "name", source), week_of(day))] += 1
+    return increments
+
+
+def rollup_upsert(dialect_name: str, increments: Counter) -> Tuple[Any, List[Dict[str, Any]]]:
+    """INSERT ... ON CONFLICT DO UPDATE adding increments to the rollups, and its executemany parameters."""
+    stmt = UPSERT_INSERT[dialect_name](analytics_rollups)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["metric", "key", "period"],
+        set_={"interactions": analytics_rollups.c.interactions + stmt.excluded.interactions},
+    )
+    return stmt, [{"metric": metric, "key": key, "period": period, "interactions": count}
+                  for (metric, key, period), count in increments.items()]
+
+
+async def apply_rollup_increments(db, increments: Counter):
+    """Upsert increments in the caller's transaction: one executemany INSERT ... ON CONFLICT DO UPDATE."""
+    if not increments:
+        return
+    await db.execute(*rollup_upsert(db.get_bind().dialect.name, increments))
+
+
+# --- Rebuild and consistency check ---
+def rollup_source_sql(sync_conn, metric: str) -> str:
+    return ROLLUP_SOURCE_SQL[metric].format(**PERIOD_SQL[sync_conn.dialect.name])
+
+
+def _source_counts(sync_conn, metric: str) -> Dict[Tuple[str, str], int]:
+    return {(key, period): count for key, period, count in sync_conn.exec_driver_sql(rollup_source_sql(sync_conn, metric))}
+
+
+def rebuild_rollups(sync_conn) -> int:
+    """Recompute every rollup from the raw tables; returns the number of rollup rows written."""
+    sync_conn.execute(delete(analytics_rollups))
+    written = 0
+    for metric in ROLLUP_METRICS:
+        sql = rollup_source_sql(sync_conn, metric)
+        sync_conn.exec_driver_sql(
+            f"INSERT INTO {analytics_rollups.name} (metric, key, period, interactions) SELECT '{metric}', * FROM ({sql}) AS counts")
+        written += sync_conn.execute(
+            select(func.count()).select_from(analytics_rollups).where(analytics_rollups.c.metric == metric)).scalar()
+    return written
+
+
+def check_rollups(sync_conn, max_mismatches: int = 100) -> Dict[str, Any]:
+    """Compare every rollup row with a fresh aggregation of the raw tables."""
+    mismatches = []
+    checked = 0
+    for metric in ROLLUP_METRICS:
+        expected = _source_counts(sync_conn, metric)
+        stored = {(key, period): count for key, period, count in sync_conn.execute(
+            select(analytics_rollups.c.key, analytics_rollups.c.period, analytics_rollups.c.interactions)
+            .where(analytics_rollups.c.metric == metric))}
+        checked += len(expected.keys() | stored.keys())
+        for key, period in sorted(expected.keys() | stored.keys()):
+            if expected.get((key, period), 0) != stored.get((key, period), 0):
+                mismatches.append({"metric": metric, "key": key, "period": period,
+                                   "rollup": stored.get((key, period), 0), "actual": expected.get((key, period), 0)})
+    return {"consistent": not mismatches, "checked": checked, "mismatched": len(mismatches),
+            "mismatches": mismatches[:max_mismatches]}
+
+
+# --- Reads (dashboards) ---
+def top_keys_stmt(metric: str, period_from: Optional[str], period_to: Optional[str], limit: int):
+    """Total interactions per key over a period range, largest first."""
+    total = func.sum(analytics_rollups.c.interactions).label("interactions")
+    stmt = _period_range(select(analytics_rollups.c.key, total).where(analytics_rollups.c.metric == metric),
+                         period_from, period_to)
+    return stmt.group_by(analytics_rollups.c.key).order_by(total.desc(), analytics_rollups.c.key).limit(limit)
+
+
+def series_stmt(metric: str, period_from: Optional[str], period_to: Optional[str]):
+    """Every (period, key, interactions) of a metric over a period range, oldest first."""
+    stmt = select(analytics_rollups.c.period, analytics_rollups.c.key, analytics_rollups.c.interactions).where(
+        analytics_rollups.c.metric == metric)
+    return _period_range(stmt, period_from, period_to).order_by(analytics_rollups.c.period, analytics_rollups.c.key)
+
+
+def _period_range(stmt, period_from: Optional[str], period_to: Optional[str]):
+    if period_from:
+        stmt = stmt.where(analytics_rollups.c.period >= period_from)
+    if period_to:
+        stmt = stmt.where(analytics_rollups.c.period <= period_to)
+    return stmt
+
+
+if __name__ == "__main__":
+    # Maintenance from the command line: python analytics.py rebuild | check
+    import json
+    import sys
+
+    from database import begin_write
+    from main import engine
+
+    command = sys.argv[1] if len(sys.argv) > 1 else "check"
+    with begin_write(engine) as conn: # Rebuild writes; check must not see an insert land between its two reads
+        create_rollup_tables(conn)
+        if command == "rebuild":
+            print(f"Rebuilt analytics rollups: {rebuild_rollups(conn)} rows")
+        else:
+            print(json.dumps(check_rollups(conn), indent=2))
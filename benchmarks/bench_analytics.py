@@ -0,0 +1,138 @@
+"""
+Dashboard queries: precomputed rollups (GET /api/analytics/*) vs ad-hoc aggregation over interactions.
+
+Seeds a throwaway SQLite file with --rows interactions, lets startup migrate them and build the
+rollups (timed), then for each dashboard query compares the rollup endpoint (through the FastAPI
+app) with the equivalent GROUP BY over the raw tables. Also reports the cost the rollups add to
+writes (POST /api/interactions p50, which now upserts 4 rollup rows) and a consistency check.
+
+Usage:
+    python benchmarks/bench_analytics.py --rows 1000000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import httpx
+from sqlalchemy import create_engine, insert
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from main import Interaction, InteractionSourceEnum  # noqa: E402
+
+PRODUCTS = [f"Product{chr(ord('A') + i)}" for i in range(20)]
+SENTIMENTS = ["positive", "neutral", "negative", None]
+
+# (label, rollup endpoint + params, ad-hoc SQL over the raw tables for the same numbers)
+QUERIES = [
+    ("top HCPs, 1 year", "/api/analytics/hcps", {"month_from": "2023-01", "month_to": "2023-12", "limit": 20},
+     "SELECT hcpName, count(*) FROM interactions WHERE interactionDate BETWEEN '2023-01-01' AND '2023-12-31' "
+     "GROUP BY hcpName ORDER BY 2 DESC LIMIT 20"),
+    ("products/month", "/api/analytics/products/monthly", {},
+     "SELECT products.name, strftime('%Y-%m', interactions.interactionDate), count(*) FROM interactions "
+     "JOIN interaction_products ON interaction_products.interaction_id = interactions.id "
+     "JOIN products ON products.id = interaction_products.product_id GROUP BY 1, 2"),
+    ("weekly volume", "/api/analytics/weekly", {"week_from": "2023-01-02", "week_to": "2023-12-25"},
+     "SELECT source, date(interactionDate, '-6 days', 'weekday 1'), count(*) FROM interactions "
+     "WHERE interactionDate BETWEEN '2023-01-02' AND '2023-12-31' GROUP BY 1, 2"),
+    ("sentiment mix", "/api/analytics/sentiment", {},
+     "SELECT coalesce(sentiment, 'unknown'), strftime('%Y-%m', interactionDate), count(*) FROM interactions GROUP BY 1, 2"),
+]
+
+
+def seed(db_path, rows):
+    engine = create_engine(f"sqlite:///{db_path}")
+    Interaction.__table__.create(engine)
+    rng = random.Random(14)
+    start_date = date(2020, 1, 1)
+    with engine.begin() as conn:
+        batch = []
+        for _ in range(rows):
+            batch.append({
+                "hcpName": f"Dr. HCP {rng.randrange(5000)}",
+                "interactionDate": start_date + timedelta(days=rng.randrange(2000)),
+                "interactionType": "detail",
+                "productsDiscussed": ", ".join(rng.sample(PRODUCTS, rng.randint(1, 2))),
+                "source": rng.choice(list(InteractionSourceEnum)),
+                "sentiment": rng.choice(SENTIMENTS),
+            })
+            if len(batch) == 10000:
+                conn.execute(insert(Interaction), batch)
+                batch.clear()
+        if batch:
+            conn.execute(insert(Interaction), batch)
+    engine.dispose()
+
+
+def p50_ms(samples):
+    return statistics.median(samples) * 1000
+
+
+async def run(args, db_path):
+    main.configure_database(f"sqlite+aiosqlite:///{db_path}")
+    start = time.perf_counter()
+    await main.create_db_and_tables()
+    print(f"Startup migration + rollup build: {time.perf_counter() - start:.1f}s")
+    await main.load_gazetteer()
+
+    sync_engine = create_engine(f"sqlite:///{db_path}")
+    print(f"{'query':<18} {'rollup p50 ms':>14} {'ad-hoc p50 ms':>14}")
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for label, path, params, sql in QUERIES:
+            rollup, ad_hoc = [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                (await client.get(path, params=params)).raise_for_status()
+                rollup.append(time.perf_counter() - start)
+            with sync_engine.connect() as conn:
+                for _ in range(max(1, args.repeat // 4)):
+                    start = time.perf_counter()
+                    conn.exec_driver_sql(sql).fetchall()
+                    ad_hoc.append(time.perf_counter() - start)
+            print(f"{label:<18} {p50_ms(rollup):>14.2f} {p50_ms(ad_hoc):>14.1f}")
+
+        writes = []
+        for i in range(args.writes):
+            body = {"hcpName": f"Dr. HCP {i % 50}", "interactionDate": "2024-06-03", "interactionType": "detail",
+                    "productsDiscussed": "ProductA, ProductB", "sentiment": "positive"}
+            start = time.perf_counter()
+            (await client.post("/api/interactions", json=body)).raise_for_status()
+            writes.append(time.perf_counter() - start)
+        print(f"POST /api/interactions p50 with rollup upserts: {p50_ms(writes):.2f} ms")
+
+        start = time.perf_counter()
+        report = (await client.get("/api/analytics/consistency")).json()
+        print(f"Consistency check: consistent={report['consistent']} over {report['checked']} rollup rows "
+              f"in {time.perf_counter() - start:.1f}s")
+    sync_engine.dispose()
+    await main.async_engine.dispose()
+    await main.read_engine.dispose()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--writes", type=int, default=200)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "analytics.db")
+        start = time.perf_counter()
+        seed(db_path, args.rows)
+        print(f"Seeded {args.rows} rows in {time.perf_counter() - start:.1f}s")
+        asyncio.run(run(args, db_path))
+
+
+if __name__ == "__main__":
+    main_bench()
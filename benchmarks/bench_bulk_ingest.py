@@ -0,0 +1,94 @@
+"""
+Ingestion throughput: one POST /api/interactions per row vs. POST /api/interactions/bulk.
+
+Runs the FastAPI app in-process against a throwaway SQLite file and reports rows/sec for
+  - single:      --single-rows sequential single-row POSTs (one commit each)
+  - bulk-json:   --rows records in one JSON array upload
+  - bulk-ndjson: --rows records streamed as NDJSON
+
+Usage:
+    python benchmarks/bench_bulk_ingest.py --rows 20000 --single-rows 500
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+import httpx
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from main import Base  # noqa: E402
+
+
+def make_record(i):
+    return {
+        "hcpName": f"Dr. Bulk {i % 300}",
+        "interactionDate": "2024-12-01",
+        "interactionType": "detail",
+        "productsDiscussed": "ProductX, ProductY",
+        "keyDiscussionPoints": f"Offline note #{i}",
+        "followUpActions": "Send brochure",
+    }
+
+
+async def run(args, db_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    session_factory = async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    async def override_get_async_db():
+        async with session_factory() as db:
+            yield db
+
+    main.app.dependency_overrides[main.get_async_db] = override_get_async_db
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        for i in range(args.single_rows):
+            (await client.post("/api/interactions", json=make_record(i))).raise_for_status()
+        single_rate = args.single_rows / (time.perf_counter() - start)
+
+        records = [make_record(i) for i in range(args.rows)]
+        start = time.perf_counter()
+        response = await client.post("/api/interactions/bulk", json=records)
+        response.raise_for_status()
+        assert response.json()["inserted"] == args.rows
+        json_rate = args.rows / (time.perf_counter() - start)
+
+        ndjson_body = "\n".join(json.dumps(record) for record in records).encode()
+        start = time.perf_counter()
+        response = await client.post("/api/interactions/bulk", content=ndjson_body,
+                                     headers={"Content-Type": "application/x-ndjson"})
+        response.raise_for_status()
+        assert response.json()["inserted"] == args.rows
+        ndjson_rate = args.rows / (time.perf_counter() - start)
+
+    main.app.dependency_overrides.clear()
+    await engine.dispose()
+
+    print(f"{'path':<12} {'rows/sec':>10} {'speedup':>8}")
+    for label, rate in (("single", single_rate), ("bulk-json", json_rate), ("bulk-ndjson", ndjson_rate)):
+        print(f"{label:<12} {rate:>10.0f} {rate / single_rate:>7.1f}x")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--single-rows", type=int, default=500)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args, os.path.join(tmp, "bulk.db")))
+
+
+if __name__ == "__main__":
+    main_bench()
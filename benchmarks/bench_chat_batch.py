@@ -0,0 +1,116 @@
+"""
+Transcript throughput: one-at-a-time /api/chat_interaction vs the batch job API, with and without packing.
+
+Runs --transcripts distinct short dictated notes through the FastAPI app in-process against a
+throwaway SQLite file. The extraction model is llm_providers.StubChatModel with --latency-ms per
+call plus --token-ms per output token, behind the LLM scheduler with --rpm requests per minute
+(30 is the Groq free tier and the scheduler default; 0 disables the limit). The fast path is off,
+so every transcript needs the model.
+  one-at-a-time  POST /api/chat_interaction for each transcript, waiting for each reply
+  batch          POST /api/chat_interaction/batch, read the NDJSON results until the job ends
+                 (pack size 1 = concurrency only; --pack-size = packed extraction prompts)
+
+Usage:
+    python benchmarks/bench_chat_batch.py --transcripts 40 --rpm 30
+    python benchmarks/bench_chat_batch.py --transcripts 200 --rpm 0
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("LLM_PROVIDER", "stub") # No Groq client or network needed
+os.environ.setdefault("CHAT_WRITE_BEHIND_ENABLED", "false")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import ai_agent  # noqa: E402
+import main  # noqa: E402
+from llm_providers import StubChatModel  # noqa: E402
+from llm_scheduler import LLM_MODEL_LIMITS, llm_scheduler  # noqa: E402
+
+NOTES = [
+    "Caught up with Dr. {name} after clinic, she asked about ProductA dosing for elderly patients #{i}",
+    "Quick hallway chat with Dr. {name}: interested in ProductB samples, follow up next week #{i}",
+    "Dr. {name} raised concerns about ProductC side effects, wants the latest safety data #{i}",
+]
+NAMES = ["Rivera", "Chen", "Okafor", "Schmidt", "Patel", "Novak", "Haddad", "Silva"]
+
+
+def transcripts(count):
+    return [NOTES[i % len(NOTES)].format(name=NAMES[i % len(NAMES)], i=i) for i in range(count)]
+
+
+async def one_at_a_time(client, messages):
+    for message in messages:
+        (await client.post("/api/chat_interaction", json={"message": message})).raise_for_status()
+    return len(messages), 0
+
+
+async def batch(client, messages):
+    job = (await client.post("/api/chat_interaction/batch", json={"transcripts": messages})).json()
+    ok = failed = 0
+    async with client.stream("GET", f"/api/chat_interaction/batch/{job['job_id']}/results") as response:
+        async for line in response.aiter_lines():
+            if line:
+                if json.loads(line)["status"] == "ok":
+                    ok += 1
+                else:
+                    failed += 1
+    status = (await client.get(f"/api/chat_interaction/batch/{job['job_id']}")).json()
+    return ok, failed, status["packs"]
+
+
+async def run(args, db_path):
+    main.configure_database(f"sqlite+aiosqlite:///{db_path}")
+    await main.create_db_and_tables()
+    await main.load_gazetteer()
+    ai_agent.llm_cache = None
+    ai_agent.FAST_PATH_ENABLED = False # Every transcript goes through the extraction model
+    gemma = StubChatModel(model_name="stub-gemma", latency_s=args.latency_ms / 1000, jitter_s=0,
+                          token_latency_s=args.token_ms / 1000)
+    ai_agent.configure_llms(gemma=gemma)
+    LLM_MODEL_LIMITS[gemma.model_name] = {"rpm": args.rpm}
+    messages = transcripts(args.transcripts)
+
+    print(f"{args.transcripts} transcripts, {args.latency_ms:.0f} ms + {args.token_ms:.1f} ms/token per call, "
+          f"rate limit {f'{args.rpm:g} rpm' if args.rpm else 'off'}")
+    print(f"{'mode':<22} {'elapsed s':>10} {'transcripts/min':>16} {'LLM calls':>10} {'failed':>7}")
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for label, pack_size in [("one-at-a-time", None), ("batch, no packing", 1), (f"batch, packs of {args.pack_size}", args.pack_size)]:
+            llm_scheduler.lanes.clear() # Fresh rate-limit bucket per mode
+            start = time.perf_counter()
+            if pack_size is None:
+                ok, failed = await one_at_a_time(client, messages)
+            else:
+                main.chat_batch_runner.pack_size = pack_size
+                ok, failed, _ = await batch(client, messages)
+            elapsed = time.perf_counter() - start
+            calls = llm_scheduler.lanes[gemma.model_name].calls
+            print(f"{label:<22} {elapsed:>10.1f} {ok / elapsed * 60:>16.0f} {calls:>10} {failed:>7}")
+    await main.async_engine.dispose()
+    await main.read_engine.dispose()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--transcripts", type=int, default=40)
+    parser.add_argument("--rpm", type=float, default=30.0)
+    parser.add_argument("--latency-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=2.0)
+    parser.add_argument("--pack-size", type=int, default=8)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args, os.path.join(tmp, "batch.db")))
+
+
+if __name__ == "__main__":
+    main_bench()
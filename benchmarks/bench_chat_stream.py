@@ -0,0 +1,108 @@
+"""
+Time-to-first-byte for chat turns: POST /api/chat_interaction vs. the SSE endpoint
+POST /api/chat_interaction/stream.
+
+Serves the app with uvicorn on a local port (httpx's in-process ASGI transport buffers whole
+responses, which would hide streaming) and swaps the Groq models for llm_providers.StubChatModel:
+  - extraction: returns a canned ExtractedInteraction after --extract-ms
+  - chat:       after --extract-ms, streams a --reply-tokens word reply, one token every --token-ms
+
+Scenarios:
+  extract:  extraction finds fields, reply is templated (no chat-model call)
+  converse: extraction finds nothing usable, so the reply comes from the (streamed) chat model
+
+Usage:
+    python benchmarks/bench_chat_stream.py --turns 20 --extract-ms 300 --token-ms 15
+"""
+import argparse
+import asyncio
+import logging
+import os
+import socket
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+import uvicorn
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("LLM_PROVIDER", "stub") # No Groq client or network needed
+
+import ai_agent  # noqa: E402
+import main  # noqa: E402
+from llm_providers import STUB_EXTRACTION, StubChatModel  # noqa: E402
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def time_blocking(client) -> float:
+    start = time.perf_counter()
+    response = await client.post("/api/chat_interaction", json={"message": "Met Dr. Stub about ProductA"})
+    response.raise_for_status()
+    return (time.perf_counter() - start) * 1000
+
+
+async def time_stream(client):
+    start = time.perf_counter()
+    first_byte = first_token = None
+    async with client.stream("POST", "/api/chat_interaction/stream", json={"message": "Met Dr. Stub about ProductA"}) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            now = (time.perf_counter() - start) * 1000
+            if first_byte is None and line:
+                first_byte = now
+            if first_token is None and line == "event: token":
+                first_token = now
+    return first_byte, first_token, (time.perf_counter() - start) * 1000
+
+
+async def run_scenario(client, label, turns):
+    blocking = [await time_blocking(client) for _ in range(turns)]
+    streamed = [await time_stream(client) for _ in range(turns)]
+    print(f"\n[{label}] median over {turns} turns (ms)")
+    print(f"  /api/chat_interaction         ttfb {statistics.median(blocking):8.1f}  total {statistics.median(blocking):8.1f}")
+    print(f"  /api/chat_interaction/stream  ttfb {statistics.median(s[0] for s in streamed):8.1f}"
+          f"  total {statistics.median(s[2] for s in streamed):8.1f}"
+          f"  first token {statistics.median(s[1] for s in streamed):8.1f}")
+
+
+async def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20)
+    parser.add_argument("--extract-ms", type=float, default=300.0)
+    parser.add_argument("--token-ms", type=float, default=15.0)
+    parser.add_argument("--reply-tokens", type=int, default=40)
+    args = parser.parse_args()
+    logging.disable(logging.ERROR) # The "converse" stub fails extraction on purpose; skip its error logs too
+
+    ai_agent.llm_cache = None # Identical benchmark prompts would otherwise be served from cache
+    ai_agent.FAST_PATH_ENABLED = False # Measure the model path, not the local extractor
+
+    with tempfile.TemporaryDirectory() as tmp:
+        main.configure_database(f"sqlite+aiosqlite:///{os.path.join(tmp, 'stream.db')}")
+        port = free_port()
+        server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning"))
+        server_task = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.05)
+
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=None) as client:
+            for label, finds_fields in (("extract", True), ("converse", False)):
+                ai_agent.configure_llms(gemma=StubChatModel(
+                    latency_s=args.extract_ms / 1000, jitter_s=0, token_latency_s=args.token_ms / 1000,
+                    reply_tokens=args.reply_tokens, structured_output=STUB_EXTRACTION if finds_fields else None,
+                ))
+                await run_scenario(client, label, args.turns)
+
+        server.should_exit = True
+        await server_task
+
+
+if __name__ == "__main__":
+    asyncio.run(main_bench())
@@ -0,0 +1,127 @@
+"""
+Cold start: `import main` time, app startup time and the first chat turn, each in a fresh interpreter.
+Exits with status 1 when a budget is exceeded, so it can gate CI against cold-start regressions.
+
+  import       `python -X importtime -c "import main"`: total for main and self time of ai_agent
+               (the agent module must not build LLM clients or compile the graph at import), and
+               no module from --forbid (provider clients) may be imported by it
+  startup      import + the app's startup handlers, in a fresh working directory: "first boot"
+               creates the schema, "reboot" finds it up to date
+  first turn   one chat turn right after startup (stub LLM, no latency), with AGENT_WARM_UP on/off
+
+Medians over --runs fresh processes.
+
+Usage:
+    python benchmarks/bench_cold_start.py --runs 5
+    python benchmarks/bench_cold_start.py --import-budget-ms 1500 --startup-budget-ms 2500
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STARTUP_SCRIPT = """
+import time
+start = time.perf_counter()
+import asyncio, json
+import main
+imported = time.perf_counter()
+
+async def boot():
+    await main.app.router.startup()
+    started = time.perf_counter()
+    await main.process_chat_message(main.ChatRequest(message="Quick hello before the first meeting"))
+    turned = time.perf_counter()
+    await main.app.router.shutdown()
+    return started, turned
+
+started, turned = asyncio.run(boot())
+print(json.dumps({"import_ms": (imported - start) * 1000, "startup_ms": (started - imported) * 1000,
+                  "first_turn_ms": (turned - started) * 1000}))
+"""
+
+
+def child_env(**overrides):
+    env = dict(os.environ, PYTHONPATH=ROOT, PYTHONWARNINGS="ignore")
+    env.setdefault("GROQ_API_KEY", "cold-start-benchmark") # Clients are built, never called
+    env.update(overrides)
+    return env
+
+
+def measure_import(forbid):
+    check = f"import main, sys, json; print(json.dumps([m for m in {forbid!r} if m in sys.modules]))"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", check], capture_output=True, text=True,
+                            cwd=ROOT, env=child_env(), check=True)
+    self_us, cumulative_us = {}, {}
+    for line in result.stderr.splitlines():
+        if line.startswith("import time:") and "|" in line:
+            own, total, name = line[len("import time:"):].split("|")
+            if own.strip().isdigit():
+                self_us[name.strip()], cumulative_us[name.strip()] = int(own), int(total)
+    return cumulative_us["main"] / 1000, self_us.get("ai_agent", 0) / 1000, json.loads(result.stdout.splitlines()[-1])
+
+
+def measure_startup(workdir, warm_up):
+    result = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], capture_output=True, text=True, cwd=workdir,
+                            env=child_env(LLM_PROVIDER="stub", STUB_LLM_LATENCY_MS="0", STUB_LLM_JITTER_MS="0",
+                                          AGENT_WARM_UP="true" if warm_up else "false"))
+    if result.returncode != 0:
+        sys.exit(f"Startup run failed:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--import-budget-ms", type=float, default=float(os.getenv("COLD_START_IMPORT_BUDGET_MS", "2500")))
+    parser.add_argument("--agent-self-budget-ms", type=float, default=float(os.getenv("COLD_START_AGENT_SELF_BUDGET_MS", "50")))
+    parser.add_argument("--startup-budget-ms", type=float, default=float(os.getenv("COLD_START_STARTUP_BUDGET_MS", "4000")))
+    parser.add_argument("--forbid", nargs="*", default=["langchain_groq", "groq"],
+                        help="Modules that `import main` must not import")
+    args = parser.parse_args()
+
+    imports = [measure_import(args.forbid) for _ in range(args.runs)]
+    import_ms = statistics.median(total for total, _, _ in imports)
+    agent_self_ms = statistics.median(own for _, own, _ in imports)
+    forbidden = sorted({name for _, _, names in imports for name in names})
+    print(f"import main        {import_ms:8.0f} ms   (ai_agent self {agent_self_ms:.1f} ms)")
+
+    rows = {}
+    for warm_up in (True, False):
+        for _ in range(args.runs):
+            with tempfile.TemporaryDirectory() as workdir: # Fresh ./sql_app.db for every run
+                for boot in ("first boot", "reboot"):
+                    sample = measure_startup(workdir, warm_up)
+                    rows.setdefault((boot, warm_up), []).append(sample)
+    print(f"{'startup':<24} {'import ms':>10} {'startup ms':>11} {'first turn ms':>14}")
+    for (boot, warm_up), samples in rows.items():
+        label = f"{boot}, warm-up {'on' if warm_up else 'off'}"
+        print(f"{label:<24} {statistics.median(s['import_ms'] for s in samples):>10.0f} "
+              f"{statistics.median(s['startup_ms'] for s in samples):>11.0f} "
+              f"{statistics.median(s['first_turn_ms'] for s in samples):>14.1f}")
+
+    failures = []
+    if import_ms > args.import_budget_ms:
+        failures.append(f"import main took {import_ms:.0f} ms (budget {args.import_budget_ms:.0f} ms)")
+    if agent_self_ms > args.agent_self_budget_ms:
+        failures.append(f"ai_agent module body took {agent_self_ms:.1f} ms (budget {args.agent_self_budget_ms:.0f} ms): "
+                        "is something built at import again?")
+    if forbidden:
+        failures.append(f"import main imported {', '.join(forbidden)}")
+    reboot = statistics.median(s["import_ms"] + s["startup_ms"] for s in rows[("reboot", True)])
+    if reboot > args.startup_budget_ms:
+        failures.append(f"import + startup took {reboot:.0f} ms (budget {args.startup_budget_ms:.0f} ms)")
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("Cold start within budget.")
+
+
+if __name__ == "__main__":
+    main_bench()
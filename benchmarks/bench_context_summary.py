@@ -0,0 +1,86 @@
+"""
+Chat-turn latency with the rolling context summary off, serial, parallel to extraction, or in the background.
+
+Runs --sessions concurrent multi-turn chat sessions of --turns turns each through the LangGraph
+agent in-process, with llm_providers.StubChatModel for both models (extraction --extract-ms,
+summary --summary-ms). CONTEXT_RECENT_TURNS is lowered to 2 so the summary is folded often.
+"Folding turns" are the ones where getContext called the summary model inside the turn; in
+background mode that happens after the reply, during the --think-ms pause before the next message.
+
+Usage:
+    python benchmarks/bench_context_summary.py --sessions 8 --turns 12 --extract-ms 300 --summary-ms 400 --think-ms 500
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault("LLM_PROVIDER", "stub") # No Groq client or network needed
+os.environ.setdefault("CONTEXT_RECENT_TURNS", "2")
+os.environ.setdefault("LLM_RATE_LIMIT_RPM", "0") # Measure the graph, not the scheduler's rate limit
+os.environ.setdefault("LLM_MAX_CONCURRENCY", "256")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langgraph.checkpoint.memory import MemorySaver  # noqa: E402
+
+import ai_agent  # noqa: E402
+from llm_providers import StubChatModel  # noqa: E402
+
+MODES = ["off", "serial", "parallel", "background"]
+
+
+async def run_session(session_index: int, turns: int, think_s: float, samples, folding):
+    session_id = None
+    for turn in range(turns):
+        summaries_before = ai_agent.context_stats.summary_updates
+        request = ai_agent.ChatRequest(message=f"Session {session_index} note {turn}: met Dr. Stub", session_id=session_id)
+        start = time.perf_counter()
+        result = await ai_agent.process_chat_message(request)
+        elapsed = (time.perf_counter() - start) * 1000
+        session_id = result["session_id"]
+        samples.append(elapsed)
+        if ai_agent.context_stats.summary_updates > summaries_before:
+            folding.append(elapsed)
+        await asyncio.sleep(think_s) # The user reading the reply and typing the next message
+
+
+async def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=8)
+    parser.add_argument("--turns", type=int, default=12)
+    parser.add_argument("--extract-ms", type=float, default=300.0)
+    parser.add_argument("--summary-ms", type=float, default=400.0)
+    parser.add_argument("--think-ms", type=float, default=500.0)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    ai_agent.llm_cache = None
+    ai_agent.FAST_PATH_ENABLED = False # Every turn goes through the extraction model
+    ai_agent.configure_llms(
+        gemma=StubChatModel(model_name="stub-gemma", latency_s=args.extract_ms / 1000, jitter_s=0),
+        llama=StubChatModel(model_name="stub-llama", temperature=0.2, latency_s=args.summary_ms / 1000, jitter_s=0),
+    )
+
+    print(f"{args.sessions} sessions x {args.turns} turns, extraction {args.extract_ms:.0f} ms, "
+          f"summary {args.summary_ms:.0f} ms")
+    print(f"{'mode':<11} {'turn p50':>9} {'turn p95':>9} {'mean':>8} {'summaries':>10} {'folding turns':>14} {'their p50':>10}")
+    for mode in MODES:
+        ai_agent.CONTEXT_SUMMARY_MODE = mode
+        ai_agent.app_graph = ai_agent.build_workflow(mode).compile(checkpointer=MemorySaver())
+        samples, folding = [], []
+        summaries_before = ai_agent.context_stats.summary_updates
+        await asyncio.gather(*(run_session(i, args.turns, args.think_ms / 1000, samples, folding)
+                               for i in range(args.sessions)))
+        await ai_agent.wait_for_context_summaries()
+        summaries = ai_agent.context_stats.summary_updates - summaries_before
+        samples.sort()
+        print(f"{mode:<11} {statistics.median(samples):>9.1f} {samples[int(len(samples) * 0.95) - 1]:>9.1f} "
+              f"{statistics.mean(samples):>8.1f} {summaries:>10} {len(folding):>14} "
+              f"{statistics.median(folding) if folding else 0.0:>10.1f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main_bench())
@@ -0,0 +1,244 @@
+"""
+Mixed read/write/chat concurrency benchmark for the interaction endpoints.
+
+Runs the FastAPI app in-process (httpx ASGI transport, single event loop) against a
+throwaway SQLite file and reports p50/p95/p99 latency per request kind for:
+  - "blocking": the previous handlers, which used the synchronous Session inside async def
+  - "async":    the current handlers backed by AsyncSession/aiosqlite
+Both modes get a database set up by main.configure_database / create_db_and_tables and do the
+same work per write: the interaction row, its HCP id, product links and analytics rollup counts.
+
+The Groq round-trip in /api/chat_interaction is replaced by an asyncio.sleep so the
+numbers only reflect how DB work interacts with the event loop. Event-loop lag (how late a
+10 ms timer fires) shows how long DB calls hold up every other in-flight request. In async mode
+writes still queue for the single writer connection (db_write_lock), so their latency reflects
+that queue rather than the loop.
+
+Usage:
+    python benchmarks/bench_db_concurrency.py --requests 600 --concurrency 32 --llm-latency-ms 80
+    python benchmarks/bench_db_concurrency.py --profile legacy --dir /var/tmp
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.orm import sessionmaker, Session
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import database  # noqa: E402
+import main  # noqa: E402
+from main import Interaction, InteractionCreate  # noqa: E402
+from ai_agent import ChatRequest  # noqa: E402
+from analytics import rollup_increments, rollup_upsert  # noqa: E402
+from loop_monitor import EventLoopLagMonitor  # noqa: E402
+
+
+def make_stub_chat(latency_s):
+    async def stub_process_chat_message(request):
+        await asyncio.sleep(latency_s)  # Simulated Groq round-trip
+        return {
+            "reply": "Okay, I've noted HCP: Dr. Bench.",
+            "extracted_data": {"hcpName": "Dr. Bench", "interactionDate": date.today().isoformat(), "productsDiscussed": "ProductA"},
+        }
+    return stub_process_chat_message
+
+
+def build_blocking_app(session_factory, stub_chat):
+    """
+    The pre-async handlers: sync Session calls made directly on the event loop. They do the same
+    database work as the current handlers (see blocking_write_interaction), so only the driver differs.
+    """
+    app = FastAPI()
+    name_ids = {main.HCP: {}, main.Product: {}} # Like main's NameIdCache: known names resolve without a query
+
+    def get_db():
+        db = session_factory()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    def resolve_ids(db, model, names):
+        ids = name_ids[model]
+        missing = [name for name in set(names) if name and name not in ids]
+        if missing:
+            found = dict(db.execute(select(model.name, model.id).where(model.name.in_(missing))).all())
+            new_names = [name for name in missing if name not in found]
+            if new_names:
+                found.update(db.execute(insert(model).returning(model.name, model.id), [{"name": name} for name in new_names]).all())
+            ids = {**ids, **found} # Cached once committed
+        return ids
+
+    def blocking_write_interaction(db: Session, row):
+        """main.write_interactions for one row: HCP id, the row, its product links and rollup counts in one commit."""
+        products = main.split_products(row.get("productsDiscussed"))
+        hcp_ids = resolve_ids(db, main.HCP, [row["hcpName"]])
+        product_ids = resolve_ids(db, main.Product, products)
+        new_id = db.execute(insert(Interaction).returning(Interaction.id), {**row, "hcp_id": hcp_ids.get(row["hcpName"])}).scalar_one()
+        if products:
+            db.execute(insert(main.interaction_products), [
+                {"interaction_id": new_id, "product_id": product_ids[product], "interactionDate": row["interactionDate"]}
+                for product in products])
+        db.execute(*rollup_upsert(db.get_bind().dialect.name, rollup_increments([row], [products])))
+        db.commit()
+        name_ids[main.HCP].update(hcp_ids)
+        name_ids[main.Product].update(product_ids)
+        main.remember_names(row["hcpName"], row.get("productsDiscussed"))
+        return new_id
+
+    @app.post("/api/interactions", status_code=201)
+    async def create_interaction(interaction: InteractionCreate, db: Session = Depends(get_db)):
+        row = interaction.model_dump()
+        return {"id": blocking_write_interaction(db, row), **row}
+
+    @app.get("/api/v2/interactions", response_model=main.InteractionPage)
+    async def get_interactions(limit: int = 100, db: Session = Depends(get_db)):
+        stmt = select(Interaction).order_by(Interaction.interactionDate.desc(), Interaction.id.desc()).limit(limit + 1)
+        interactions = db.execute(stmt).scalars().all()
+        next_cursor = None
+        if len(interactions) > limit:
+            interactions = interactions[:limit]
+            next_cursor = main.encode_cursor(interactions[-1].interactionDate, interactions[-1].id)
+        return {"items": interactions, "next_cursor": next_cursor}
+
+    @app.post("/api/chat_interaction")
+    async def chat(request: ChatRequest, db: Session = Depends(get_db)):
+        agent_response = await stub_chat(request)
+        row = main.chat_interaction_row(agent_response["extracted_data"])
+        agent_response["saved_interaction_id"] = blocking_write_interaction(db, row)
+        return agent_response
+
+    return app
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def drive(app, total_requests, concurrency):
+    payload = {
+        "hcpName": "Dr. Load",
+        "interactionDate": date.today().isoformat(),
+        "interactionType": "detail",
+        "productsDiscussed": "ProductA, ProductB",
+        "keyDiscussionPoints": "Benchmark row",
+    }
+    kinds = ["read", "write", "chat"]
+    latencies = {kind: [] for kind in kinds}
+    queue = asyncio.Queue()
+    for _ in range(total_requests):
+        queue.put_nowait(random.choice(kinds))
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def worker():
+            while not queue.empty():
+                kind = queue.get_nowait()
+                start = time.perf_counter()
+                if kind == "read":
+                    response = await client.get("/api/v2/interactions", params={"limit": 50})
+                elif kind == "write":
+                    response = await client.post("/api/interactions", json=payload)
+                else:
+                    response = await client.post("/api/chat_interaction", json={"message": "Met Dr. Bench", "history": []})
+                response.raise_for_status()
+                latencies[kind].append((time.perf_counter() - start) * 1000)
+
+        monitor = EventLoopLagMonitor(interval_ms=10)
+        monitor.start()
+        wall_start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - wall_start
+        await monitor.stop()
+    return latencies, wall, monitor.stats()
+
+
+def report(label, latencies, wall, loop_lag):
+    total = sum(len(v) for v in latencies.values())
+    print(f"\n[{label}] {total} requests in {wall:.2f}s ({total / wall:.1f} req/s)")
+    print(f"  event loop lag: p50 {loop_lag['p50_lag_ms']:.1f} ms, p99 {loop_lag['p99_lag_ms']:.1f} ms, "
+          f"max {loop_lag['max_lag_ms']:.1f} ms")
+    print(f"  {'kind':<6} {'n':>5} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for kind, values in latencies.items():
+        if values:
+            print(f"  {kind:<6} {len(values):>5} {statistics.median(values):>9.1f} "
+                  f"{percentile(values, 95):>9.1f} {percentile(values, 99):>9.1f}")
+
+
+async def setup_database(db_path):
+    # Both modes start from the schema the app creates (interactions, dimensions, links, rollups, search index)
+    main.configure_database(f"sqlite+aiosqlite:///{db_path}")
+    await main.create_db_and_tables()
+
+
+async def dispose_engines():
+    await main.async_engine.dispose()
+    await main.read_engine.dispose()
+
+
+async def run_async_mode(db_path, args, stub_chat):
+    # The app's own engines: the single writer connection and the read pool, with the SQLite storage profile.
+    # The app's startup is not run, so chat saves are written inline (no write-behind queue), as in blocking mode.
+    await setup_database(db_path)
+    original_process_chat_message = main.process_chat_message
+    main.process_chat_message = stub_chat
+    try:
+        return await drive(main.app, args.requests, args.concurrency)
+    finally:
+        main.process_chat_message = original_process_chat_message
+        await dispose_engines()
+
+
+async def run_blocking_mode(db_path, args, stub_chat):
+    await setup_database(db_path)
+    await dispose_engines()
+    # Same storage profile (WAL) as the app's engines. Pool sized to the concurrency: a blocking checkout on the
+    # event loop can never be released otherwise. Deferred transactions: with BEGIN IMMEDIATE a read would hold
+    # the write lock until its session is closed, which the blocked event loop never gets to do
+    engine = create_engine(f"sqlite:///{db_path}", connect_args={"check_same_thread": False}, pool_size=args.concurrency)
+    database.apply_sqlite_profile(engine, read_only=False)
+    app = build_blocking_app(sessionmaker(autocommit=False, autoflush=False, bind=engine), stub_chat)
+    try:
+        return await drive(app, args.requests, args.concurrency)
+    finally:
+        engine.dispose()
+
+
+async def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=600)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--llm-latency-ms", type=float, default=80.0)
+    parser.add_argument("--mode", choices=["both", "blocking", "async"], default="both")
+    parser.add_argument("--profile", choices=["tuned", "legacy"], default=database.SQLITE_PROFILE,
+                        help="SQLite storage profile of both modes (legacy: an fsync on every commit)")
+    parser.add_argument("--dir", default=None, help="Where the database files go; fsync cost depends on the disk")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)  # Per-request INFO logs would dominate the measurement
+    database.SQLITE_PROFILE = args.profile # Read when the engines are created
+
+    stub_chat = make_stub_chat(args.llm_latency_ms / 1000)
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        if args.mode in ("both", "blocking"):
+            random.seed(42)
+            report("blocking sync Session", *await run_blocking_mode(os.path.join(tmp, "blocking.db"), args, stub_chat))
+        if args.mode in ("both", "async"):
+            random.seed(42)
+            report("AsyncSession + aiosqlite", *await run_async_mode(os.path.join(tmp, "async.db"), args, stub_chat))
+
+
+if __name__ == "__main__":
+    asyncio.run(main_bench())
@@ -0,0 +1,108 @@
+"""
+HCP/product dimensions: one-time migration cost, and "interactions per product per month" before and after.
+
+Seeds a throwaway SQLite file with --rows interactions in the pre-dimension shape (free-text
+hcpName / productsDiscussed only), runs the startup migration (timed), then compares:
+  LIKE scan     GROUP BY month over interactions WHERE productsDiscussed LIKE '%ProductC%'
+  indexed join  the same counts from interaction_products via ix_interaction_products_product_date
+The LIKE scan also over-counts: '%ProductA%' matches "ProductAB".
+
+Usage:
+    python benchmarks/bench_dimensions.py --rows 1000000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, insert, select, func
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from main import Interaction, InteractionSourceEnum, Product, interaction_products  # noqa: E402
+
+PRODUCTS = [f"Product{chr(ord('A') + i)}" for i in range(20)]
+
+
+def seed(db_path, rows):
+    engine = create_engine(f"sqlite:///{db_path}")
+    Interaction.__table__.create(engine) # Legacy shape: no dimension tables yet
+    rng = random.Random(13)
+    start_date = date(2020, 1, 1)
+    with engine.begin() as conn:
+        batch = []
+        for _ in range(rows):
+            batch.append({
+                "hcpName": f"Dr. HCP {rng.randrange(5000)}",
+                "interactionDate": start_date + timedelta(days=rng.randrange(2000)),
+                "interactionType": "detail",
+                "productsDiscussed": ", ".join(rng.sample(PRODUCTS, rng.randint(1, 2))),
+                "source": InteractionSourceEnum.STRUCTURED,
+            })
+            if len(batch) == 10000:
+                conn.execute(insert(Interaction), batch)
+                batch.clear()
+        if batch:
+            conn.execute(insert(Interaction), batch)
+    engine.dispose()
+
+
+def timed(conn, stmt, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = conn.execute(stmt).all()
+        samples.append((time.perf_counter() - start) * 1000)
+    return min(samples), sum(count for _, count in rows)
+
+
+async def migrate(db_path):
+    main.configure_database(f"sqlite+aiosqlite:///{db_path}")
+    start = time.perf_counter()
+    await main.create_db_and_tables()
+    print(f"Startup with migration (and first search-index build): {time.perf_counter() - start:.1f}s")
+    start = time.perf_counter()
+    await main.create_db_and_tables()
+    print(f"Startup, already migrated: {(time.perf_counter() - start) * 1000:.0f} ms")
+    await main.async_engine.dispose()
+    await main.read_engine.dispose()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--product", default="ProductC")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "dimensions.db")
+        start = time.perf_counter()
+        seed(db_path, args.rows)
+        print(f"Seeded {args.rows} rows in {time.perf_counter() - start:.1f}s")
+        asyncio.run(migrate(db_path))
+
+        month = func.strftime("%Y-%m", Interaction.interactionDate)
+        like_scan = (select(month, func.count()).where(Interaction.productsDiscussed.like(f"%{args.product}%"))
+                     .group_by(month))
+        link_month = func.strftime("%Y-%m", interaction_products.c.interactionDate)
+        product_id = select(Product.id).where(Product.name == args.product).scalar_subquery()
+        indexed = select(link_month, func.count()).where(interaction_products.c.product_id == product_id).group_by(link_month)
+
+        engine = create_engine(f"sqlite:///{db_path}")
+        with engine.connect() as conn:
+            for label, stmt in [("LIKE scan", like_scan), ("indexed join", indexed)]:
+                elapsed_ms, total = timed(conn, stmt, args.repeat)
+                print(f"{label:<13} {elapsed_ms:8.1f} ms  ({total} interactions)")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,135 @@
+"""
+Page latency vs. page depth: OFFSET/LIMIT against keyset (cursor) pagination.
+
+Seeds a throwaway SQLite file with --rows interactions, then for each depth times
+  - offset: SELECT ... ORDER BY interactionDate DESC, id DESC OFFSET <depth> LIMIT <page-size>
+  - keyset: GET /api/v2/interactions?cursor=<cursor for that depth>  (through the FastAPI app)
+  - keyset+hcpName: the same with an hcpName filter (served by ix_interactions_hcp_date_id)
+
+Keyset latency should stay flat as depth grows; offset grows linearly.
+
+Usage:
+    python benchmarks/bench_pagination.py --rows 1000000 --page-size 50
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import httpx
+from sqlalchemy import create_engine, insert, select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from main import Base, Interaction, InteractionSourceEnum, encode_cursor  # noqa: E402
+
+HCP_NAMES = [f"Dr. Synthetic {i}" for i in range(500)]
+INTERACTION_TYPES = ["detail", "meeting", "follow-up", "chat_derived"]
+
+
+def seed(db_path, rows):
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(bind=engine)
+    start_date = date(2020, 1, 1)
+    rng = random.Random(7)
+    with engine.begin() as conn:
+        batch = []
+        for _ in range(rows):
+            batch.append({
+                "hcpName": rng.choice(HCP_NAMES),
+                "interactionDate": start_date + timedelta(days=rng.randrange(2000)),
+                "interactionType": rng.choice(INTERACTION_TYPES),
+                "keyDiscussionPoints": "Synthetic benchmark interaction",
+                "source": rng.choice(list(InteractionSourceEnum)),
+            })
+            if len(batch) == 10000:
+                conn.execute(insert(Interaction), batch)
+                batch.clear()
+        if batch:
+            conn.execute(insert(Interaction), batch)
+    engine.dispose()
+
+
+def time_ms(samples):
+    return statistics.median(samples), max(samples)
+
+
+async def run(args, db_path):
+    engine = create_async_engine(f"sqlite+aiosqlite:///{db_path}")
+    session_factory = async_sessionmaker(bind=engine, expire_on_commit=False)
+
+    async def override_get_async_db():
+        async with session_factory() as db:
+            yield db
+
+    main.app.dependency_overrides[main.get_async_db] = override_get_async_db
+    main.app.dependency_overrides[main.get_read_db] = override_get_async_db
+    ordered = select(Interaction.interactionDate, Interaction.id).order_by(
+        Interaction.interactionDate.desc(), Interaction.id.desc())
+    hcp_name = HCP_NAMES[0]
+
+    print(f"{'depth':>9} {'offset p50':>11} {'keyset p50':>11} {'keyset+hcp p50':>15}   (ms)")
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client, session_factory() as db:
+        for depth in args.depths:
+            if depth >= args.rows:
+                continue
+            # Cursor for the row just before `depth` (what a client would hold after walking that far)
+            boundary = (await db.execute(ordered.offset(max(depth - 1, 0)).limit(1))).one()
+            cursor = encode_cursor(*boundary)
+            hcp_boundary = (await db.execute(ordered.where(Interaction.hcpName == hcp_name)
+                                             .offset(max(depth // len(HCP_NAMES) - 1, 0)).limit(1))).one()
+            hcp_cursor = encode_cursor(*hcp_boundary)
+
+            offset_samples, keyset_samples, hcp_samples = [], [], []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                await db.execute(select(Interaction).order_by(Interaction.interactionDate.desc(), Interaction.id.desc())
+                                 .offset(depth).limit(args.page_size))
+                offset_samples.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                response = await client.get("/api/v2/interactions", params={"limit": args.page_size, "cursor": cursor})
+                response.raise_for_status()
+                keyset_samples.append((time.perf_counter() - start) * 1000)
+
+                start = time.perf_counter()
+                response = await client.get("/api/v2/interactions", params={"limit": args.page_size, "cursor": hcp_cursor,
+                                                                        "hcpName": hcp_name})
+                response.raise_for_status()
+                hcp_samples.append((time.perf_counter() - start) * 1000)
+
+            print(f"{depth:>9} {time_ms(offset_samples)[0]:>11.2f} {time_ms(keyset_samples)[0]:>11.2f} "
+                  f"{time_ms(hcp_samples)[0]:>15.2f}")
+
+    main.app.dependency_overrides.clear()
+    await engine.dispose()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000)
+    parser.add_argument("--page-size", type=int, default=50)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--depths", type=int, nargs="+", default=[0, 1000, 10000, 100000, 500000, 900000])
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "pagination.db")
+        start = time.perf_counter()
+        seed(db_path, args.rows)
+        print(f"Seeded {args.rows} rows in {time.perf_counter() - start:.1f}s")
+        asyncio.run(run(args, db_path))
+
+
+if __name__ == "__main__":
+    main_bench()
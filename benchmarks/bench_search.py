@@ -0,0 +1,141 @@
+"""
+Latency of GET /api/interactions/search (SQLite FTS5 + BM25, fuzzy HCP names) on a large table.
+
+Seeds a throwaway SQLite file with --rows interactions whose key points / follow-ups are drawn
+from a Zipf-like vocabulary, builds the full-text index with a rebuild (timed), then times
+queries of increasing selectivity through the FastAPI app:
+  rare word        a word in ~0.01% of rows
+  product + word   "ProductA dosage"
+  common product   a product in ~7% of rows: only the newest SEARCH_MAX_CANDIDATES matches are scored,
+                   but BM25's document-frequency pass still walks the whole doclist
+  prefix           "ProductA dos*" (explicit prefix search)
+  filtered         common product + interactionType + source + one-year date range
+  fuzzy hcp        hcp=<misspelled name>, newest first
+  fuzzy hcp + q    hcp=<misspelled name>&q=<word>
+
+Usage:
+    python benchmarks/bench_search.py --rows 1000000 --repeat 20
+    python benchmarks/bench_search.py --db /tmp/search-1m.db   # seed once, reuse on later runs
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+import httpx
+from sqlalchemy import create_engine, insert
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+from main import Base, Interaction, InteractionSourceEnum  # noqa: E402
+from interaction_search import create_search_index, rebuild_search_index  # noqa: E402
+
+SURNAMES = ["Smith", "Johnson", "Williams", "Brown", "Jones", "Garcia", "Miller", "Davis", "Rodriguez", "Martinez",
+            "Hernandez", "Lopez", "Gonzalez", "Wilson", "Anderson", "Thomas", "Taylor", "Moore", "Jackson", "Martin"]
+FIRST_NAMES = ["Ana", "Ben", "Chen", "Dara", "Eli", "Fatima", "Gus", "Hana", "Ivan", "Jia", "Kofi", "Lena", "Mei",
+               "Nia", "Omar", "Priya", "Quinn", "Rosa", "Sam", "Tariq", "Uma", "Vera", "Wes", "Yara", "Zane"]
+PRODUCTS = [f"Product{chr(ord('A') + i)}" for i in range(20)]
+TOPICS = ["dosage", "efficacy", "safety", "pricing", "formulary", "samples", "trial", "side", "effects", "adherence",
+          "renal", "hepatic", "pediatric", "elderly", "titration", "contraindications", "interactions", "insurance"]
+FILLER = [f"term{i}" for i in range(2000)]
+INTERACTION_TYPES = ["detail", "meeting", "follow-up", "chat_derived"]
+
+
+def seed(db_path, rows):
+    engine = create_engine(f"sqlite:///{db_path}")
+    Base.metadata.create_all(bind=engine)
+    rng = random.Random(11)
+    hcp_names = [f"Dr. {first} {last}" for first in FIRST_NAMES for last in SURNAMES]
+    filler_weights = [1 / (rank + 1) for rank in range(len(FILLER))] # Zipf-like: a few common words, a long tail
+    start_date = date(2020, 1, 1)
+    with engine.begin() as conn:
+        batch = []
+        for _ in range(rows):
+            products = rng.sample(PRODUCTS, rng.randint(1, 2))
+            words = rng.choices(FILLER, weights=filler_weights, k=8) + rng.sample(TOPICS, 2) + products[:1]
+            rng.shuffle(words)
+            batch.append({
+                "hcpName": rng.choice(hcp_names),
+                "interactionDate": start_date + timedelta(days=rng.randrange(2000)),
+                "interactionType": rng.choice(INTERACTION_TYPES),
+                "productsDiscussed": ", ".join(products),
+                "keyDiscussionPoints": " ".join(words),
+                "followUpActions": f"Send {rng.choice(TOPICS)} material for {products[0]}",
+                "source": rng.choice(list(InteractionSourceEnum)),
+            })
+            if len(batch) == 10000:
+                conn.execute(insert(Interaction), batch)
+                batch.clear()
+        if batch:
+            conn.execute(insert(Interaction), batch)
+
+    start = time.perf_counter()
+    with engine.begin() as conn:
+        create_search_index(conn)
+        rebuild_search_index(conn)
+    print(f"FTS5 index rebuild: {time.perf_counter() - start:.1f}s")
+    engine.dispose()
+
+
+QUERIES = [
+    ("rare word", {"q": "term1999"}),
+    ("product + word", {"q": "ProductA dosage"}),
+    ("common product", {"q": "ProductC"}),
+    ("prefix", {"q": "ProductA dos*"}),
+    ("filtered", {"q": "ProductC", "interactionType": "meeting", "source": "structured", "dateFrom": "2023-01-01",
+                  "dateTo": "2023-12-31"}),
+    ("fuzzy hcp", {"hcp": "Dr. Priya Jonson"}),
+    ("fuzzy hcp + q", {"hcp": "Dr. Priya Jonson", "q": "renal"}),
+]
+
+
+async def run(args, db_path):
+    main.configure_database(f"sqlite+aiosqlite:///{db_path}")
+    await main.create_db_and_tables() # Fills the HCP/product tables the fuzzy HCP index is loaded from
+    await main.load_gazetteer() # Seeds the fuzzy HCP index, as on startup
+
+    print(f"{'query':<16} {'hits':>5} {'p50 ms':>8} {'p95 ms':>8}")
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for label, params in QUERIES:
+            params = {"limit": args.limit, **params}
+            samples = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                response = await client.get("/api/interactions/search", params=params)
+                response.raise_for_status()
+                samples.append((time.perf_counter() - start) * 1000)
+            samples.sort()
+            hits = len(response.json()["items"])
+            print(f"{label:<16} {hits:>5} {statistics.median(samples):>8.2f} {samples[int(len(samples) * 0.95) - 1]:>8.2f}")
+    await main.async_engine.dispose()
+    await main.read_engine.dispose()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--db", help="Database file to seed (if missing) and keep, instead of a throwaway one")
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = args.db or os.path.join(tmp, "search.db")
+        if not os.path.exists(db_path):
+            start = time.perf_counter()
+            seed(db_path, args.rows)
+            print(f"Seeded {args.rows} rows in {time.perf_counter() - start:.1f}s")
+        asyncio.run(run(args, db_path))
+
+
+if __name__ == "__main__":
+    main_bench()
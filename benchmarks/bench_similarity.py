@@ -0,0 +1,165 @@
+"""
+Similar-interaction lookups at scale: query latency and recall of the vector index at --vectors rows.
+
+Builds a similarity_index.VectorIndex in memory, without a database: --notes distinct dictated-style
+notes are embedded with the hashing embedder (embedding throughput is the per-insert cost), and
+--vectors index rows are noisy copies of those embeddings (revisits of the same topics), each tagged
+with one of --hcps HCPs and one or two of --products products. Then, over --queries query notes:
+  exact            scan of every vector (what the index does below SIMILARITY_IVF_MIN_VECTORS)
+  ivf, N probes    after clustering: only the rows of the N nearest centroids; recall@k against exact
+  same HCP         filter on one HCP's rows (exact over a few dozen rows)
+  same product     filter on one product's rows (tens of thousands: IVF probes intersected with the filter)
+  memory-mapped    the same IVF query on the index saved and loaded back (np.load mmap_mode="r", warm page cache)
+
+Usage:
+    python benchmarks/bench_similarity.py --vectors 1000000
+    python benchmarks/bench_similarity.py --vectors 100000 --probes 8 16 32 --dim 384
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np  # noqa: E402
+
+from similarity_index import HashingEmbedder, VectorIndex, filter_keys, normalize  # noqa: E402
+
+TOPICS = ["dosing in elderly patients", "renal impairment", "drug interactions with statins", "formulary status",
+          "prior authorization delays", "injection site reactions", "pediatric use", "pregnancy safety data",
+          "switching from a competitor", "missed doses", "storage and refrigeration", "patient assistance program",
+          "clinical trial results", "weight gain side effects", "hepatic monitoring", "samples for new patients"]
+ASKS = ["asked about", "raised concerns about", "wants more data on", "was positive about", "is skeptical of"]
+FOLLOW_UPS = ["send the latest safety data", "drop off samples", "schedule a lunch and learn", "share the dosing card",
+              "connect with the medical science liaison", "follow up next week", "send the formulary update"]
+
+
+def generate_notes(count, products, rng):
+    """(note, product it is about) pairs."""
+    notes = []
+    for _ in range(count):
+        product = rng.choice(products)
+        topics = rng.sample(TOPICS, 2)
+        notes.append((f"{rng.choice(ASKS).capitalize()} {product} {topics[0]} and {topics[1]}; "
+                      f"{rng.choice(FOLLOW_UPS)} about {topics[0]}", product))
+    return notes
+
+
+def percentiles(samples_ms):
+    ordered = sorted(samples_ms)
+    return statistics.median(ordered), ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+def timed_queries(index, queries, k, **search_args):
+    samples, results = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append(index.search(query, k, **search_args))
+        samples.append((time.perf_counter() - start) * 1000)
+    return samples, results
+
+
+def recall(approximate, exact):
+    found = [len({i for i, _ in a} & {i for i, _ in e}) / max(1, len(e)) for a, e in zip(approximate, exact)]
+    return sum(found) / len(found)
+
+
+def print_row(label, samples, recall_at_k=None):
+    p50, p95 = percentiles(samples)
+    print(f"{label:<28} {p50:>9.2f} {p95:>9.2f} {'' if recall_at_k is None else f'{recall_at_k:.3f}':>10}")
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--vectors", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=256)
+    parser.add_argument("--notes", type=int, default=20000, help="Distinct notes the vectors are variations of")
+    parser.add_argument("--hcps", type=int, default=20000)
+    parser.add_argument("--products", type=int, default=30)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--exact-queries", type=int, default=50, help="Exact scans are slow at 1M; fewer of them")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--probes", type=int, nargs="*", default=[4, 16, 64])
+    parser.add_argument("--noise", type=float, default=0.5, help="Norm of the noise added to each copy")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    rng, np_rng = random.Random(args.seed), np.random.default_rng(args.seed)
+    products = [f"Product{i}" for i in range(args.products)]
+
+    embedder = HashingEmbedder(args.dim)
+    notes = generate_notes(args.notes, products, rng)
+    start = time.perf_counter()
+    note_vectors = np.concatenate([embedder.embed([note for note, _ in notes[i:i + 1000]]) for i in range(0, len(notes), 1000)])
+    embed_s = time.perf_counter() - start
+    start = time.perf_counter()
+    for note, _ in notes[:500]:
+        embedder.embed([note])
+    single_ms = (time.perf_counter() - start) / 500 * 1000
+    print(f"hashing embedder ({args.dim} dims): {len(notes) / embed_s:,.0f} notes/s in batches of 1000, "
+          f"{single_ms:.3f} ms for one note")
+
+    index = VectorIndex(args.dim)
+    start = time.perf_counter()
+    batch = 10000
+    for first in range(0, args.vectors, batch):
+        count = min(batch, args.vectors - first)
+        sources = np_rng.integers(0, len(notes), count)
+        noise = np_rng.standard_normal((count, args.dim), dtype=np.float32) * (args.noise / np.sqrt(args.dim))
+        keys = [filter_keys(f"Dr. Bench {rng.randrange(args.hcps)}",
+                            [notes[source][1]] + ([rng.choice(products)] if rng.random() < 0.3 else []))
+                for source in sources]
+        index.add(list(range(first + 1, first + count + 1)), normalize(note_vectors[sources] + noise), keys)
+    add_s = time.perf_counter() - start
+    print(f"{len(index):,} vectors added in {add_s:.1f}s ({len(index) / add_s:,.0f}/s); "
+          f"{len(index) * args.dim * 4 / 2**20:,.0f} MB of float32")
+
+    query_notes = generate_notes(args.queries, products, rng)
+    queries = embedder.embed([note for note, _ in query_notes])
+
+    print(f"{'query (k=' + str(args.k) + ')':<28} {'p50 ms':>9} {'p95 ms':>9} {'recall@k':>10}")
+    exact_samples, _ = timed_queries(index, queries[:args.exact_queries], args.k)
+    print_row("exact scan", exact_samples)
+    # Ground truth for every query (not timed), then the filtered lookups before clustering
+    exact = [index.search(query, args.k) for query in queries]
+    hcp_samples, _ = timed_queries(index, queries, args.k, keys=filter_keys(f"Dr. Bench {rng.randrange(args.hcps)}"))
+    print_row("same HCP (exact)", hcp_samples)
+    product_keys = [filter_keys(None, [product]) for _, product in query_notes]
+    product_exact = [index.search(query, args.k, keys=keys) for query, keys in zip(queries, product_keys)]
+
+    start = time.perf_counter()
+    clusters = index.cluster(len(index), seed=args.seed)
+    index.use_clusters(*clusters)
+    print(f"clustered into {len(clusters[0])} lists in {time.perf_counter() - start:.1f}s")
+    for probes in args.probes:
+        samples, results = timed_queries(index, queries, args.k, probes=probes)
+        print_row(f"ivf, {probes} probes", samples, recall(results, exact))
+    for probes in args.probes:
+        samples, results = [], []
+        for query, keys in zip(queries, product_keys):
+            start = time.perf_counter()
+            results.append(index.search(query, args.k, keys=keys, probes=probes))
+            samples.append((time.perf_counter() - start) * 1000)
+        print_row(f"same product, {probes} probes", samples, recall(results, product_exact))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "index")
+        start = time.perf_counter()
+        index.save(path, index.snapshot(), {"embedder": embedder.name})
+        save_s = time.perf_counter() - start
+        start = time.perf_counter()
+        loaded, _ = VectorIndex.load(path)
+        load_s = time.perf_counter() - start
+        print(f"saved in {save_s:.1f}s, loaded (memory-mapped) in {load_s:.2f}s")
+        probes = args.probes[len(args.probes) // 2]
+        timed_queries(loaded, queries, args.k, probes=probes) # Fault the probed pages in
+        samples, results = timed_queries(loaded, queries, args.k, probes=probes)
+        print_row(f"memory-mapped, {probes} probes", samples, recall(results, exact))
+        del loaded
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,99 @@
+"""
+Per-request cost of tracing and payload logging.
+
+Runs --requests POST /api/interactions and stub-LLM chat turns through the FastAPI app in-process
+against a throwaway SQLite file, with:
+  tracing off          TRACING_ENABLED=false, payload logging off
+  tracing on           spans, /metrics histograms and Server-Timing; payload logging off (the default)
+  tracing + payloads   as above with PAYLOAD_LOG_SAMPLE_RATE=1 (every body serialized and logged)
+Log output goes to /dev/null but is still formatted, so the payload rows include that cost.
+
+Usage:
+    python benchmarks/bench_tracing.py --requests 2000
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+os.environ.setdefault("LLM_PROVIDER", "stub") # No Groq client or network needed
+os.environ.setdefault("LLM_RATE_LIMIT_RPM", "0")
+os.environ.setdefault("CHAT_WRITE_BEHIND_ENABLED", "false")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import httpx  # noqa: E402
+
+import ai_agent  # noqa: E402
+import main  # noqa: E402
+import tracing  # noqa: E402
+from llm_providers import StubChatModel  # noqa: E402
+
+MODES = [("tracing off", False, 0.0), ("tracing on", True, 0.0), ("tracing + payloads", True, 1.0)]
+
+
+async def timed_requests(client, count, make_request, samples):
+    for i in range(count):
+        start = time.perf_counter()
+        (await make_request(client, i)).raise_for_status()
+        samples.append((time.perf_counter() - start) * 1000)
+
+
+def post_interaction(client, i):
+    return client.post("/api/interactions", json={
+        "hcpName": f"Dr. Trace {i % 100}", "interactionDate": "2024-06-03", "interactionType": "detail",
+        "productsDiscussed": "ProductA, ProductB", "keyDiscussionPoints": "Dosage questions " * 20})
+
+
+def post_chat(client, i):
+    return client.post("/api/chat_interaction", json={"message": f"Note {i}: discussed samples with the team"})
+
+
+async def run(args, db_path):
+    main.configure_database(f"sqlite+aiosqlite:///{db_path}")
+    await main.create_db_and_tables()
+    await main.load_gazetteer()
+    ai_agent.llm_cache = None
+    ai_agent.configure_llms(gemma=StubChatModel(model_name="stub-gemma", latency_s=0, jitter_s=0),
+                            llama=StubChatModel(model_name="stub-llama", temperature=0.2, latency_s=0, jitter_s=0))
+
+    print(f"{'mode':<20} {'POST p50 ms':>12} {'POST mean':>10} {'chat p50 ms':>12} {'chat mean':>10}")
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        await timed_requests(client, 50, post_interaction, []) # Warm-up
+        posts = {label: [] for label, _, _ in MODES}
+        chats = {label: [] for label, _, _ in MODES}
+        # Modes take turns in small rounds, so the growing database and warm-up affect them alike
+        per_round = max(1, args.requests // args.rounds)
+        for round_index in range(args.rounds):
+            shift = round_index % len(MODES) # Rotate which mode goes first
+            for label, enabled, sample_rate in MODES[shift:] + MODES[:shift]:
+                tracing.TRACING_ENABLED, tracing.PAYLOAD_LOG_SAMPLE_RATE = enabled, sample_rate
+                await timed_requests(client, per_round, post_interaction, posts[label])
+                await timed_requests(client, max(1, per_round // 4), post_chat, chats[label])
+        for label, _, _ in MODES:
+            print(f"{label:<20} {statistics.median(posts[label]):>12.3f} {statistics.mean(posts[label]):>10.3f} "
+                  f"{statistics.median(chats[label]):>12.3f} {statistics.mean(chats[label]):>10.3f}")
+    await main.async_engine.dispose()
+    await main.read_engine.dispose()
+
+
+def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--rounds", type=int, default=20)
+    args = parser.parse_args()
+    root = logging.getLogger()
+    for handler in root.handlers:
+        handler.setStream(open(os.devnull, "w"))
+    tracing.TRACE_SLOW_REQUEST_MS = float("inf")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(args, os.path.join(tmp, "tracing.db")))
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,166 @@
+"""
+End-to-end load test, runnable with no network: starts the API in a uvicorn subprocess with the
+stub LLM provider (LLM_PROVIDER=stub) and a throwaway database, then drives each endpoint at
+rising concurrency. For every stage it reports throughput, p50/p95/p99 latency, errors, and the
+server's event-loop lag (from /api/event_loop/stats, reset between stages).
+
+Endpoints:
+  chat:     POST /api/chat_interaction (LangGraph turn, stub extraction + DB save)
+  create:   POST /api/interactions
+  list:     GET  /api/v2/interactions?limit=50
+
+The LLM cache and the fast-path extractor are off by default so every chat turn goes through the
+(stub) model; pass --llm-cache / --fast-path to measure them instead. The LLM scheduler's rate limit
+is off unless --llm-rpm is given; --llm-429-rate makes the stub answer that share of calls with a 429.
+Chat saves go through the write-behind queue; --sync-saves commits them inline before replying instead.
+
+Usage:
+    python benchmarks/load_test.py --levels 1,4,16,64 --duration 10 --llm-latency-ms 300 --llm-jitter-ms 50
+"""
+import argparse
+import asyncio
+import itertools
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Dict, List
+
+import httpx
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from loop_monitor import percentile  # noqa: E402
+
+CHAT_MESSAGE = "Met Dr. Stub this morning about ProductA, she was interested. Follow up next week."
+INTERACTION = {"hcpName": "Dr. Load", "interactionType": "Meeting", "interactionDate": "2026-01-15",
+               "productsDiscussed": "ProductA", "keyDiscussionPoints": "Load test", "source": "structured"}
+
+# Each chat message is unique, so the scheduler's single-flight never merges concurrent turns into one LLM call
+chat_counter = itertools.count()
+
+SCENARIOS = {
+    "chat": lambda client: client.post("/api/chat_interaction", json={"message": f"{CHAT_MESSAGE} (note {next(chat_counter)})"}),
+    "create": lambda client: client.post("/api/interactions", json=INTERACTION),
+    "list": lambda client: client.get("/api/v2/interactions", params={"limit": 50}),
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, workdir: str, args) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "PYTHONPATH": REPO_ROOT,
+        "LLM_PROVIDER": "stub",
+        "STUB_LLM_LATENCY_MS": str(args.llm_latency_ms),
+        "STUB_LLM_JITTER_MS": str(args.llm_jitter_ms),
+        "LLM_CACHE_ENABLED": "true" if args.llm_cache else "false",
+        "FAST_PATH_ENABLED": "true" if args.fast_path else "false",
+        "LLM_RATE_LIMIT_RPM": str(args.llm_rpm),
+        "LLM_MAX_CONCURRENCY": str(args.llm_concurrency),
+        "STUB_LLM_RATE_LIMIT_RATE": str(args.llm_429_rate),
+        "CHAT_WRITE_BEHIND_ENABLED": "false" if args.sync_saves else "true",
+    }
+    # The database URL is relative (./sql_app.db), so running from a temp dir gives a fresh database
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+        cwd=workdir, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, timeout_s: float = 60.0):
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        try:
+            if (await client.get("/api/event_loop/stats")).status_code == 200:
+                return
+        except httpx.TransportError:
+            pass
+        await asyncio.sleep(0.2)
+    raise RuntimeError("server did not start")
+
+
+async def run_stage(client: httpx.AsyncClient, scenario: str, concurrency: int, duration_s: float) -> Dict[str, float]:
+    send = SCENARIOS[scenario]
+    latencies: List[float] = []
+    errors = 0
+    deadline = time.perf_counter() + duration_s
+
+    async def worker():
+        nonlocal errors
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                response = await send(client)
+                if response.status_code >= 400:
+                    errors += 1
+            except httpx.HTTPError:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    await client.post("/api/event_loop/stats/reset")
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    lag = (await client.get("/api/event_loop/stats")).json()
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "rps": len(latencies) / elapsed,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "lag_p99": lag["p99_lag_ms"],
+        "lag_max": lag["max_lag_ms"],
+    }
+
+
+async def main_bench():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--levels", default="1,4,16,64", help="Comma-separated concurrency levels")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per stage")
+    parser.add_argument("--scenarios", default="chat,create,list", help=f"Comma-separated subset of {sorted(SCENARIOS)}")
+    parser.add_argument("--llm-latency-ms", type=float, default=300.0)
+    parser.add_argument("--llm-jitter-ms", type=float, default=50.0)
+    parser.add_argument("--llm-rpm", type=float, default=0.0, help="Scheduler rate limit per model, 0 = off")
+    parser.add_argument("--llm-concurrency", type=int, default=64, help="Scheduler in-flight cap per model")
+    parser.add_argument("--llm-429-rate", type=float, default=0.0)
+    parser.add_argument("--llm-cache", action="store_true")
+    parser.add_argument("--fast-path", action="store_true")
+    parser.add_argument("--sync-saves", action="store_true", help="Commit chat saves inline instead of write-behind")
+    args = parser.parse_args()
+    levels = [int(level) for level in args.levels.split(",")]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        port = free_port()
+        server = start_server(port, workdir, args)
+        limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+        try:
+            async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", timeout=60.0, limits=limits) as client:
+                await wait_until_ready(client)
+                print(f"stub LLM latency {args.llm_latency_ms:.0f} +/- {args.llm_jitter_ms:.0f} ms, "
+                      f"{args.duration:.0f}s per stage")
+                print(f"{'scenario':<8} {'conc':>5} {'reqs':>7} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} "
+                      f"{'p99 ms':>8} {'lag p99':>8} {'lag max':>8}")
+                for scenario in args.scenarios.split(","):
+                    for concurrency in levels:
+                        r = await run_stage(client, scenario, concurrency, args.duration)
+                        print(f"{scenario:<8} {concurrency:>5} {r['requests']:>7} {r['errors']:>5} {r['rps']:>8.1f} "
+                              f"{r['p50']:>8.1f} {r['p95']:>8.1f} {r['p99']:>8.1f} {r['lag_p99']:>8.1f} {r['lag_max']:>8.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main_bench())
@@ -0,0 +1,219 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from ai_agent import ChatRequest, extract_packed, is_packable, packed_chat_result, process_chat_message
+from llm_scheduler import queue_limits_apply
+from tracing import detach_trace, span
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+BATCH_CHAT_CONCURRENCY = int(os.getenv("BATCH_CHAT_CONCURRENCY", "4")) # Packs / single transcripts in flight per job
+BATCH_CHAT_MAX_TRANSCRIPTS = int(os.getenv("BATCH_CHAT_MAX_TRANSCRIPTS", "500")) # Per job
+BATCH_PACK_SIZE = int(os.getenv("BATCH_PACK_SIZE", "8")) # Transcripts per packed extraction prompt (1 disables packing)
+BATCH_PACK_MAX_TOKENS = int(os.getenv("BATCH_PACK_MAX_TOKENS", "300")) # Longer transcripts get a prompt of their own
+BATCH_JOBS_KEPT = 100 # Finished jobs (and their results) remembered, oldest dropped first
+
+RUNNING, DONE, CANCELLED, FAILED = "running", "done", "cancelled", "failed"
+
+
+class ChatBatchJob:
+    """
+    Results of one batch, in completion order. follow() yields them as they arrive, starting from
+    the first, so a client can (re)attach to the result stream at any time.
+    """
+
+    def __init__(self, total: int, save: bool):
+        self.job_id = uuid.uuid4().hex
+        self.total = total
+        self.save = save
+        self.state = RUNNING
+        self.results: List[Dict[str, Any]] = []
+        self.failed = 0
+        self.packed = 0 # Transcripts extracted as part of a pack
+        self.packs = 0 # Packed extraction calls made
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.task: Optional[asyncio.Task] = None
+        self._updated = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.state != RUNNING
+
+    def add(self, result: Dict[str, Any]):
+        self.results.append(result)
+        if result["status"] == "error":
+            self.failed += 1
+        self._notify()
+
+    def finish(self, state: str = DONE):
+        self.state = state
+        self.finished_at = time.time()
+        self._notify()
+
+    def _notify(self):
+        # Wake every follower; the next wait starts on a fresh event
+        updated, self._updated = self._updated, asyncio.Event()
+        updated.set()
+
+    async def follow(self) -> AsyncIterator[Dict[str, Any]]:
+        sent = 0
+        while True:
+            if sent < len(self.results):
+                yield self.results[sent]
+                sent += 1
+            elif self.finished:
+                return
+            else:
+                await self._updated.wait()
+
+    def status(self) -> Dict[str, Any]:
+        elapsed = (self.finished_at or time.time()) - self.created_at
+        return {
+            "job_id": self.job_id,
+            "state": self.state,
+            "total": self.total,
+            "completed": len(self.results),
+            "failed": self.failed,
+            "packed": self.packed,
+            "packs": self.packs,
+            "elapsed_s": elapsed,
+            "transcripts_per_minute": len(self.results) / elapsed * 60 if elapsed > 0 else 0.0,
+        }
+
+
+class ChatBatchRunner:
+    """
+    Runs each transcript of a batch as its own stateless one-turn chat (process_chat_message with
+    persist_session=False: no chat session is created, so live ones are never evicted), at most
+    `concurrency` packs / transcripts at a time. Short transcripts the fast path cannot handle are
+    packed `pack_size` to an extraction prompt (extract_packed); any a pack fails to return are
+    retried on their own. `on_result` (e.g. saving the interaction) runs for each result of a job
+    submitted with save=True, before the result is published.
+    """
+
+    def __init__(self, on_result: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+                 concurrency: int = BATCH_CHAT_CONCURRENCY, pack_size: int = BATCH_PACK_SIZE,
+                 pack_max_tokens: int = BATCH_PACK_MAX_TOKENS):
+        self.on_result = on_result
+        self.concurrency = concurrency
+        self.pack_size = pack_size
+        self.pack_max_tokens = pack_max_tokens
+        self.jobs: "OrderedDict[str, ChatBatchJob]" = OrderedDict()
+
+    def submit(self, transcripts: List[str], save: bool = True) -> ChatBatchJob:
+        job = ChatBatchJob(total=len(transcripts), save=save)
+        self.jobs[job.job_id] = job
+        while len(self.jobs) > BATCH_JOBS_KEPT:
+            oldest = next(iter(self.jobs.values()))
+            if not oldest.finished:
+                break # Never forget a running job
+            self.jobs.popitem(last=False)
+        job.task = asyncio.create_task(self._run(job, transcripts))
+        logger.info(f"Batch chat job {job.job_id} started with {len(transcripts)} transcripts")
+        return job
+
+    def get(self, job_id: str) -> Optional[ChatBatchJob]:
+        return self.jobs.get(job_id)
+
+    def plan(self, transcripts: List[str]) -> List[List[Tuple[int, str]]]:
+        """Split a batch into units of work: packs of short transcripts and single transcripts, in input order."""
+        units, pack = [], []
+        for index, message in enumerate(transcripts):
+            if self.pack_size > 1 and is_packable(message, self.pack_max_tokens):
+                pack.append((index, message))
+                if len(pack) == self.pack_size:
+                    units.append(pack)
+                    pack = []
+            else:
+                units.append([(index, message)])
+        if pack:
+            units.append(pack) # A leftover pack of one runs as a single
+        return units
+
+    async def _run(self, job: ChatBatchJob, transcripts: List[str]):
+        detach_trace() # Outlives the request that submitted it
+        queue_limits_apply.set(False) # A backlog waits its turn for the LLM rather than failing as overloaded
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def run_unit(unit: List[Tuple[int, str]]):
+            async with semaphore:
+                try:
+                    if len(unit) > 1:
+                        await self._process_pack(job, unit)
+                    else:
+                        await self._process_single(job, *unit[0])
+                except Exception as e:
+                    # A bug in one unit fails its unpublished transcripts; the rest of the job carries on
+                    logger.error(f"Batch chat job {job.job_id}: unit of {len(unit)} transcripts failed: {e}", exc_info=True)
+                    published = {result["index"] for result in job.results}
+                    for index, _ in unit:
+                        if index not in published:
+                            job.add({"index": index, "status": "error", "error": str(e)})
+
+        try:
+            await asyncio.gather(*(run_unit(unit) for unit in self.plan(transcripts)))
+        except asyncio.CancelledError:
+            job.finish(CANCELLED)
+            raise
+        except Exception as e:
+            # Never leave a job running: its followers would wait forever
+            logger.error(f"Batch chat job {job.job_id} failed: {e}", exc_info=True)
+            job.finish(FAILED)
+            return
+        job.finish()
+        status = job.status()
+        logger.info(f"Batch chat job {job.job_id} finished: {status['completed']} transcripts "
+                    f"({status['failed']} failed, {status['packed']} packed) in {status['elapsed_s']:.1f}s")
+
+    async def _process_single(self, job: ChatBatchJob, index: int, message: str):
+        with span("batch", "single"):
+            try:
+                result = await process_chat_message(ChatRequest(message=message), persist_session=False)
+            except Exception as e:
+                logger.error(f"Batch chat job {job.job_id}: transcript {index} failed: {e}")
+                job.add({"index": index, "status": "error", "error": str(e)})
+                return
+            await self._publish(job, index, result, packed=False)
+
+    async def _process_pack(self, job: ChatBatchJob, pack: List[Tuple[int, str]]):
+        with span("batch", "pack", transcripts=len(pack)):
+            try:
+                job.packs += 1
+                extracted = await extract_packed([message for _, message in pack])
+            except Exception as e:
+                logger.warning(f"Batch chat job {job.job_id}: packed extraction of {len(pack)} failed ({e}); "
+                               "retrying them one by one")
+                extracted = [None] * len(pack)
+        retry = []
+        for (index, message), extracted_data in zip(pack, extracted):
+            if extracted_data is None:
+                retry.append((index, message))
+                continue
+            job.packed += 1
+            await self._publish(job, index, packed_chat_result(extracted_data), packed=True)
+        for index, message in retry:
+            await self._process_single(job, index, message)
+
+    async def _publish(self, job: ChatBatchJob, index: int, result: Dict[str, Any], packed: bool):
+        result = {"index": index, "status": "ok", "packed": packed, **result}
+        if job.save and self.on_result is not None:
+            try:
+                await self.on_result(result)
+            except Exception as e:
+                logger.error(f"Batch chat job {job.job_id}: saving transcript {index} failed: {e}")
+                result = {"index": index, "status": "error", "error": f"Save failed: {e}"}
+        job.add(result)
+
+    async def aclose(self):
+        """Cancel running jobs (at shutdown); results already published stay readable until exit."""
+        running = [job.task for job in self.jobs.values() if not job.finished and job.task is not None]
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
@@ -0,0 +1,128 @@
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Dict, Any
+
+from langgraph.checkpoint.memory import MemorySaver
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+CHAT_SESSION_BACKEND = os.getenv("CHAT_SESSION_BACKEND", "memory") # "memory" or "sqlite"
+CHAT_SESSION_SQLITE_PATH = os.getenv("CHAT_SESSION_SQLITE_PATH", "./chat_sessions.db")
+CHAT_SESSION_IDLE_TTL_SECONDS = float(os.getenv("CHAT_SESSION_IDLE_TTL_SECONDS", "1800"))
+# Caps the number of sessions, not their memory: the in-memory saver keeps every checkpoint version of a
+# thread (one or more per turn) until the session is evicted, so a long conversation grows until then
+CHAT_SESSION_MAX_SESSIONS = int(os.getenv("CHAT_SESSION_MAX_SESSIONS", "1000"))
+CHAT_SESSION_SWEEP_INTERVAL_SECONDS = 60.0
+
+
+async def open_checkpointer(backend: str = CHAT_SESSION_BACKEND, sqlite_path: str = CHAT_SESSION_SQLITE_PATH):
+    """
+    LangGraph checkpointer that holds each session's conversation state between turns.
+    Must be awaited inside the running event loop: the SQLite saver binds to it on construction.
+    """
+    if backend == "sqlite":
+        # Optional dependency: pip install langgraph-checkpoint-sqlite
+        import aiosqlite
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        saver = AsyncSqliteSaver(await aiosqlite.connect(sqlite_path))
+        await saver.setup()
+        logger.info(f"Chat sessions persisted to SQLite at {sqlite_path}")
+        return saver
+    return MemorySaver()
+
+
+class SessionExpiredError(Exception):
+    """A turn named a session with no checkpoint (evicted, idle or lost in a restart) and sent no history to rebuild it."""
+
+    def __init__(self, session_id: str):
+        super().__init__(f"Chat session {session_id} has expired; resend the conversation history to continue it.")
+        self.session_id = session_id
+
+
+class ChatSessionStore:
+    """
+    Tracks live chat sessions (LangGraph thread ids) and evicts them by idle time and by count.
+    Access times are kept in an OrderedDict in least-recently-used order, so both idle and
+    over-capacity sessions are always a prefix of it. They live in memory: sessions a persistent
+    checkpointer kept across a restart are picked up again by load_persisted_sessions().
+    """
+
+    def __init__(self, checkpointer=None, idle_ttl_seconds: float = CHAT_SESSION_IDLE_TTL_SECONDS,
+                 max_sessions: int = CHAT_SESSION_MAX_SESSIONS):
+        self.checkpointer = checkpointer if checkpointer is not None else MemorySaver()
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self.max_sessions = max_sessions
+        self.evicted = 0
+        self._last_access: "OrderedDict[str, float]" = OrderedDict()
+        self._last_sweep = time.monotonic()
+
+    @staticmethod
+    def new_session_id() -> str:
+        return uuid.uuid4().hex
+
+    @staticmethod
+    def config_for(session_id: str) -> Dict[str, Any]:
+        return {"configurable": {"thread_id": session_id}}
+
+    async def touch(self, session_id: str):
+        """Mark a session as used now, then evict idle sessions and any beyond the cap."""
+        now = time.monotonic()
+        self._last_access[session_id] = now
+        self._last_access.move_to_end(session_id)
+
+        evict_count = max(0, len(self._last_access) - self.max_sessions)
+        if now - self._last_sweep >= CHAT_SESSION_SWEEP_INTERVAL_SECONDS:
+            self._last_sweep = now
+            idle_count = 0
+            for last_access in self._last_access.values():
+                if now - last_access <= self.idle_ttl_seconds:
+                    break
+                idle_count += 1
+            evict_count = max(evict_count, idle_count)
+
+        for _ in range(evict_count):
+            stale_session_id = next(iter(self._last_access))
+            await self.evict(stale_session_id)
+
+    async def has_checkpoint(self, session_id: str) -> bool:
+        return await self.checkpointer.aget_tuple(self.config_for(session_id)) is not None
+
+    async def load_persisted_sessions(self):
+        """
+        Track the sessions the (SQLite) checkpointer kept from before a restart, least recently
+        written first, so they are evicted like live ones. They count as used at startup: idle ones
+        go one idle TTL later, and any beyond the cap go now.
+        """
+        conn = getattr(self.checkpointer, "conn", None) # The in-memory saver starts empty
+        if conn is None:
+            return
+        # checkpoint_id is a time-ordered UUID, so the newest checkpoint of each thread orders them by last write
+        async with conn.execute("SELECT thread_id FROM checkpoints GROUP BY thread_id ORDER BY max(checkpoint_id)") as cursor:
+            thread_ids = [row[0] async for row in cursor]
+        now = time.monotonic()
+        for thread_id in reversed(thread_ids): # Each goes in front of the ones after it
+            if thread_id not in self._last_access:
+                self._last_access[thread_id] = now
+                self._last_access.move_to_end(thread_id, last=False) # Older than any session touched since startup
+        for _ in range(max(0, len(self._last_access) - self.max_sessions)):
+            await self.evict(next(iter(self._last_access)))
+        if thread_ids:
+            logger.info(f"Loaded {len(thread_ids)} persisted chat sessions ({len(self._last_access)} tracked)")
+
+    async def evict(self, session_id: str):
+        self._last_access.pop(session_id, None)
+        await self.checkpointer.adelete_thread(session_id)
+        self.evicted += 1
+        logger.info(f"Evicted chat session {session_id}")
+
+    async def aclose(self):
+        conn = getattr(self.checkpointer, "conn", None) # Only the SQLite saver holds a connection
+        if conn is not None:
+            await conn.close()
+
+    def __len__(self):
+        return len(self._last_access)
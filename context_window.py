@@ -0,0 +1,133 @@
+import logging
+import os
+from dataclasses import dataclass
+from typing import List, Optional, Sequence
+
+from langchain_core.messages import BaseMessage
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "3000")) # Max tokens per agent prompt
+CONTEXT_RECENT_TURNS = int(os.getenv("CONTEXT_RECENT_TURNS", "4")) # Turns (user + AI message) kept verbatim
+CONTEXT_SUMMARY_SHARE = 0.5 # Summary may use at most this share of the space left for context
+
+# --- Token counting ---
+try:
+    import tiktoken # Optional: closer counts than the character heuristic
+    _encoding = tiktoken.get_encoding("cl100k_base")
+except Exception:
+    _encoding = None
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    if _encoding is not None:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return len(text) // 4 + 1 # ~4 characters per token for English prose
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Keep the tail of `text` (the most recent part of a rolling summary) within max_tokens."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    if _encoding is not None:
+        return _encoding.decode(_encoding.encode(text, disallowed_special=())[-max_tokens:])
+    return text[-max_tokens * 4:]
+
+
+def format_messages(messages: Sequence[BaseMessage]) -> str:
+    return "\n".join([f"{msg.type}: {msg.content}" for msg in messages])
+
+
+def messages_to_fold(messages: Sequence[BaseMessage], summarized_count: int,
+                     recent_turns: int = CONTEXT_RECENT_TURNS) -> List[BaseMessage]:
+    """Messages that have left the verbatim window but are not yet part of the rolling summary."""
+    window_start = max(0, len(messages) - 2 * recent_turns)
+    return list(messages[summarized_count:window_start])
+
+
+# --- Window assembly ---
+@dataclass
+class ContextWindow:
+    history_text: str
+    summary_text: str
+    context_tokens: int
+    kept_messages: int
+    dropped_messages: int
+
+
+class ContextWindowStats:
+    """Running counters for prompt sizes, reported in the logs and on the stats endpoint."""
+
+    def __init__(self):
+        self.prompts = 0
+        self.total_prompt_tokens = 0
+        self.max_prompt_tokens = 0
+        self.last_prompt_tokens = 0
+        self.summary_updates = 0
+        self.dropped_messages = 0
+
+    def record_prompt(self, prompt_tokens: int, dropped_messages: int):
+        self.prompts += 1
+        self.total_prompt_tokens += prompt_tokens
+        self.max_prompt_tokens = max(self.max_prompt_tokens, prompt_tokens)
+        self.last_prompt_tokens = prompt_tokens
+        self.dropped_messages += dropped_messages
+
+    def as_dict(self):
+        return {
+            "token_budget": CONTEXT_TOKEN_BUDGET,
+            "recent_turns": CONTEXT_RECENT_TURNS,
+            "prompts": self.prompts,
+            "avg_prompt_tokens": self.total_prompt_tokens / self.prompts if self.prompts else 0.0,
+            "max_prompt_tokens": self.max_prompt_tokens,
+            "last_prompt_tokens": self.last_prompt_tokens,
+            "summary_updates": self.summary_updates,
+            "dropped_messages": self.dropped_messages,
+        }
+
+
+context_stats = ContextWindowStats()
+
+
+def build_context_window(messages: Sequence[BaseMessage], summary: Optional[str], summarized_count: int,
+                         reserved_tokens: int, budget: int = CONTEXT_TOKEN_BUDGET) -> ContextWindow:
+    """
+    Fit the rolling summary plus as many unsummarized messages as possible (newest first) into
+    `budget - reserved_tokens`, where reserved_tokens covers the fixed prompt text and user input.
+    """
+    available = max(0, budget - reserved_tokens)
+    summary_text = truncate_to_tokens(summary or "", int(available * CONTEXT_SUMMARY_SHARE))
+    remaining = available - count_tokens(summary_text)
+
+    candidates = list(messages[summarized_count:])
+    kept: List[str] = []
+    for msg in reversed(candidates):
+        line = f"{msg.type}: {msg.content}"
+        line_tokens = count_tokens(line) + 1 # +1 for the joining newline
+        if line_tokens > remaining:
+            break
+        kept.append(line)
+        remaining -= line_tokens
+    kept.reverse()
+
+    return ContextWindow(
+        history_text="\n".join(kept),
+        summary_text=summary_text,
+        context_tokens=available - remaining,
+        kept_messages=len(kept),
+        dropped_messages=len(candidates) - len(kept),
+    )
+
+
+def record_prompt(node_name: str, prompt: str, window: ContextWindow) -> int:
+    prompt_tokens = count_tokens(prompt)
+    context_stats.record_prompt(prompt_tokens, window.dropped_messages)
+    logger.info(f"[{node_name}] prompt {prompt_tokens} tokens (budget {CONTEXT_TOKEN_BUDGET}): "
+                f"{window.kept_messages} recent messages, summary {count_tokens(window.summary_text)} tokens, "
+                f"{window.dropped_messages} messages over budget")
+    return prompt_tokens
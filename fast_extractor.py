@@ -0,0 +1,307 @@
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() in ("1", "true", "yes")
+FAST_PATH_CONFIDENCE_THRESHOLD = float(os.getenv("FAST_PATH_CONFIDENCE_THRESHOLD", "0.8"))
+FAST_PATH_MAX_WORDS = int(os.getenv("FAST_PATH_MAX_WORDS", "40")) # Longer messages need the LLM to pick key points
+KNOWN_PRODUCTS = [p.strip() for p in os.getenv("KNOWN_PRODUCTS", "").split(",") if p.strip()]
+
+WEEKDAYS = ["monday", "tuesday", "wednesday", "thursday", "friday", "saturday", "sunday"]
+MONTHS = ["january", "february", "march", "april", "may", "june", "july", "august", "september", "october",
+          "november", "december"]
+
+HCP_PATTERN = re.compile(r"\b(?:Dr|Doctor|Prof|Professor)\.?\s+([A-Z][\w'-]+(?:\s+[A-Z][\w'-]+)?)")
+FOLLOW_UP_PATTERN = re.compile(r"\b(?:follow[\s-]?up|send|schedule|next step|remind)\b[^.;\n]*", re.IGNORECASE)
+TOPIC_PATTERN = re.compile(r"\b(?:re|regarding|about|discussed|discussing|on the topic of)\b[:\s]+([^,.;\n]+)", re.IGNORECASE)
+ISO_DATE_PATTERN = re.compile(r"\b(\d{4}-\d{2}-\d{2})\b")
+DAYS_AGO_PATTERN = re.compile(r"\b(\d{1,2})\s+days?\s+ago\b", re.IGNORECASE)
+WEEKDAY_PATTERN = re.compile(r"\b(last|on|this past)?\s*(" + "|".join(WEEKDAYS) + r")\b", re.IGNORECASE)
+# Dates the rules above do not read ("May 3rd", "3/15", "2024-02-30", "last week", "the day before yesterday").
+# Where one appears the interaction date is left to the LLM rather than guessed (or defaulted to today).
+UNRESOLVED_DATE_PATTERN = re.compile(
+    r"\b(?:" + "|".join(month for month in MONTHS if month != "may") + r"|(?-i:May))\b"  # "may" the verb is not a date
+    r"|\b(?:jan|feb|mar|apr|jun|jul|aug|sept?|oct|nov|dec)\.?\s+\d{1,2}\b"
+    r"|\b\d{1,2}(?:st|nd|rd|th)\b"
+    r"|\b\d{4}[-/.]\d{1,2}[-/.]\d{1,2}\b|\b\d{1,2}/\d{1,2}(?:/\d{2,4})?\b|\b\d{1,2}[-.]\d{1,2}[-.]\d{4}\b"
+    r"|\b(?:last|next|past|previous|this past)\s+(?:week|weekend|month|year)\b"
+    r"|\b(?:a|an|one|two|three|few|couple of|\d+)\s+(?:weeks?|months?)\s+ago\b"
+    r"|\b(?:few|couple of)\s+days\s+ago\b|\bbefore yesterday\b|\bthe other day\b|\bearlier this (?:week|month)\b"
+    # Future and forward-looking dates: WEEKDAY_PATTERN would read "next Monday" as the Monday just gone
+    r"|\b(?:next|coming|this|upcoming)\s+(?:" + "|".join(WEEKDAYS) + r")\b|\btomorrow\b|\btonight\b|\blater (?:today|this week)\b"
+    r"|\bin\s+(?:a|an|one|two|three|few|couple of|\d+)\s+(?:days?|weeks?|months?)\b"
+    r"|\b(?:a|an|one|two|three|few|couple of|\d+)\s+(?:days?|weeks?|months?)\s+from now\b",
+    re.IGNORECASE,
+)
+# Any calendar word at all; when one is present but no date was resolved, the date is left to the LLM too
+TEMPORAL_WORD_PATTERN = re.compile(
+    r"\b(?:" + "|".join(WEEKDAYS + [month for month in MONTHS if month != "may"]) + r"|(?-i:May)"
+    r"|days?|weeks?|weekend|months?|years?|ago|tomorrow|tonight|morning|afternoon|evening|noon)\b",
+    re.IGNORECASE,
+)
+
+INTERACTION_TYPE_KEYWORDS = [
+    (re.compile(r"\b(?:met|meeting|visited|visit|lunch|in[\s-]person)\b", re.IGNORECASE), "Meeting"),
+    (re.compile(r"\b(?:called|call|phoned|phone)\b", re.IGNORECASE), "Call"),
+    (re.compile(r"\b(?:emailed|email|e-mail)\b", re.IGNORECASE), "Email"),
+    (re.compile(r"\b(?:detail|detailed|detailing)\b", re.IGNORECASE), "Detail"),
+    (re.compile(r"\b(?:video|zoom|teams|virtual)\b", re.IGNORECASE), "Virtual Meeting"),
+]
+POSITIVE_WORDS = re.compile(r"\b(?:positive|interested|receptive|enthusiastic|liked|happy|keen|impressed)\b", re.IGNORECASE)
+NEGATIVE_WORDS = re.compile(r"\b(?:negative|concerned|skeptical|sceptical|unhappy|refused|hesitant|not interested)\b", re.IGNORECASE)
+NEGATORS = {"not", "never", "no", "hardly", "barely", "nor"}
+NEGATION_WINDOW = 3 # Words before a sentiment word searched for a negator ("wasn't very impressed")
+
+
+# --- Gazetteer ---
+class Gazetteer:
+    """Known HCP and product names, seeded from the interactions table and updated as rows are written."""
+
+    def __init__(self, products: Iterable[str] = KNOWN_PRODUCTS):
+        self.hcp_by_name: Dict[str, str] = {} # lowercased full name (without title) -> canonical name
+        self.hcp_by_surname: Dict[str, Optional[str]] = {} # lowercased surname -> canonical name, None if ambiguous
+        self.products: Dict[str, str] = {} # lowercased -> canonical
+        self._product_pattern: Optional[re.Pattern] = None
+        self.add_products(products)
+
+    @staticmethod
+    def _strip_title(name: str) -> str:
+        return re.sub(r"^(?:Dr|Doctor|Prof|Professor)\.?\s+", "", name.strip(), flags=re.IGNORECASE)
+
+    def add_hcp(self, name: Optional[str]):
+        if not name or not name.strip():
+            return
+        bare = self._strip_title(name).lower()
+        self.hcp_by_name.setdefault(bare, name.strip())
+        surname = bare.split()[-1]
+        existing = self.hcp_by_surname.get(surname, name.strip())
+        self.hcp_by_surname[surname] = name.strip() if existing == name.strip() else None
+
+    def add_products(self, products: Iterable[Optional[str]]):
+        added = False
+        for product in products:
+            if product and product.strip() and product.strip().lower() not in self.products:
+                self.products[product.strip().lower()] = product.strip()
+                added = True
+        if added: # One alternation regex, longest names first so "ProductX XR" wins over "ProductX"
+            names = sorted(self.products, key=len, reverse=True)
+            self._product_pattern = re.compile(r"\b(" + "|".join(re.escape(n) for n in names) + r")\b", re.IGNORECASE)
+
+    def resolve_hcp(self, candidate: str) -> Optional[str]:
+        bare = self._strip_title(candidate).lower()
+        if bare in self.hcp_by_name:
+            return self.hcp_by_name[bare]
+        words = bare.split()
+        canonical = self.hcp_by_surname.get(words[-1])
+        # The surname alone resolves "Dr. Smith", but "Dr. John Smith" is not the known "Dr. Jane Smith"
+        if canonical and len(words) > 1 and self._strip_title(canonical).lower().split()[0] != words[0]:
+            return None
+        return canonical
+
+    def find_products(self, text: str) -> List[str]:
+        if self._product_pattern is None:
+            return []
+        found = []
+        for match in self._product_pattern.finditer(text):
+            canonical = self.products[match.group(1).lower()]
+            if canonical not in found:
+                found.append(canonical)
+        return found
+
+
+gazetteer = Gazetteer()
+
+
+# --- Extraction ---
+@dataclass
+class FastExtraction:
+    fields: Dict[str, object]
+    confidence: float
+    field_confidence: Dict[str, float] = field(default_factory=dict)
+
+
+def _previous_weekday(today: date, weekday: int, allow_today: bool) -> date:
+    days_back = (today.weekday() - weekday) % 7
+    if days_back == 0 and not allow_today:
+        days_back = 7
+    return today - timedelta(days=days_back)
+
+
+def _resolve_interaction_date(text: str, today: date) -> Optional[Tuple[str, float]]:
+    iso = ISO_DATE_PATTERN.search(text)
+    if iso:
+        try:
+            return date.fromisoformat(iso.group(1)).isoformat(), 1.0
+        except ValueError:
+            pass
+    lowered = text.lower()
+    if re.search(r"\btoday\b|\bthis morning\b|\bthis afternoon\b", lowered):
+        return today.isoformat(), 0.95
+    if re.search(r"\byesterday\b", lowered):
+        return (today - timedelta(days=1)).isoformat(), 0.95
+    days_ago = DAYS_AGO_PATTERN.search(text)
+    if days_ago:
+        return (today - timedelta(days=int(days_ago.group(1)))).isoformat(), 0.9
+    weekday = WEEKDAY_PATTERN.search(text)
+    if weekday:
+        qualifier = (weekday.group(1) or "").lower()
+        resolved = _previous_weekday(today, WEEKDAYS.index(weekday.group(2).lower()), allow_today=qualifier != "last")
+        return resolved.isoformat(), 0.85 if qualifier else 0.7
+    return None
+
+
+def _negated(text: str, start: int) -> bool:
+    """Whether a negator ("not", "never", "wasn't") comes shortly before position start, in the same clause."""
+    clause = re.split(r"[,.;:!?\n]", text[:start])[-1].lower().replace("\u2019", "'")
+    return any(word in NEGATORS or word.endswith("n't") for word in re.findall(r"[\w']+", clause)[-NEGATION_WINDOW:])
+
+
+def _sentiment(text: str) -> Optional[str]:
+    """
+    "negative" when a negative word, or a negated positive one ("not happy", "never receptive"), appears;
+    otherwise "positive" for a positive word. A negated negative word ("not concerned") is not read either way.
+    """
+    positives = [match for match in POSITIVE_WORDS.finditer(text) if not _negated(text, match.start())]
+    negatives = [match for match in NEGATIVE_WORDS.finditer(text) if not _negated(text, match.start())]
+    if negatives or len(positives) < len(POSITIVE_WORDS.findall(text)):
+        return "negative"
+    return "positive" if positives else None
+
+
+def _has_unresolved_date(text: str) -> bool:
+    for match in UNRESOLVED_DATE_PATTERN.finditer(text):
+        try:
+            date.fromisoformat(match.group(0)) # A valid ISO date is one _resolve_interaction_date reads
+        except ValueError:
+            return True
+    return False
+
+
+def extract_fast(text: str, today: Optional[date] = None, known: Gazetteer = gazetteer) -> FastExtraction:
+    """
+    Rule/gazetteer extraction for formulaic messages ("Met Dr. Smith today re ProductA, follow up Friday").
+    The overall confidence is high only when a known HCP is identified in a short, declarative message
+    with no date the rules cannot read.
+    """
+    today = today or date.today()
+    fields: Dict[str, object] = {}
+    field_confidence: Dict[str, float] = {}
+
+    # Follow-up clause first, so its dates ("follow up Friday") are not taken as the interaction date
+    follow_up = FOLLOW_UP_PATTERN.search(text)
+    interaction_text = text
+    if follow_up:
+        fields["followUpActions"] = follow_up.group(0).strip(" ,")
+        field_confidence["followUpActions"] = 0.85
+        interaction_text = text[:follow_up.start()] + text[follow_up.end():]
+
+    hcp_confidence = 0.0
+    for match in HCP_PATTERN.finditer(interaction_text):
+        words = match.group(1).split()
+        # "Dr. Smith Friday" / "Dr. Smith ProductA": stop the name at calendar words and product names
+        if len(words) > 1 and (words[1].lower() in WEEKDAYS + MONTHS or known.find_products(words[1])):
+            words = words[:1]
+        candidate = " ".join(words)
+        resolved = known.resolve_hcp(candidate)
+        if resolved:
+            fields["hcpName"], hcp_confidence = resolved, 0.95
+            break
+        fields["hcpName"], hcp_confidence = f"Dr. {candidate}", 0.75 # Well-formed but never seen before
+    if not hcp_confidence: # Known full names mentioned without a title ("met Jane Doe")
+        lowered = interaction_text.lower()
+        for bare, canonical in known.hcp_by_name.items():
+            if " " in bare and re.search(r"\b" + re.escape(bare) + r"\b", lowered):
+                fields["hcpName"], hcp_confidence = canonical, 0.9
+                break
+    if hcp_confidence:
+        field_confidence["hcpName"] = hcp_confidence
+
+    products = known.find_products(text)
+    if products:
+        fields["productsDiscussed"] = products
+        field_confidence["productsDiscussed"] = 0.9
+
+    resolved_date = _resolve_interaction_date(interaction_text, today)
+    if resolved_date:
+        fields["interactionDate"], field_confidence["interactionDate"] = resolved_date
+    # A calendar word the rules did not turn into a date ("tomorrow", "next Monday", "in two weeks")
+    unresolved_date = _has_unresolved_date(interaction_text) or (
+        not resolved_date and bool(TEMPORAL_WORD_PATTERN.search(interaction_text)))
+    if unresolved_date:
+        field_confidence["interactionDate"] = 0.0
+
+    for pattern, interaction_type in INTERACTION_TYPE_KEYWORDS:
+        if pattern.search(interaction_text):
+            fields["interactionType"] = interaction_type
+            field_confidence["interactionType"] = 0.8
+            break
+
+    topic = TOPIC_PATTERN.search(interaction_text)
+    if topic:
+        fields["keyDiscussionPoints"] = topic.group(1).strip()
+        field_confidence["keyDiscussionPoints"] = 0.7
+
+    sentiment = _sentiment(text)
+    if sentiment:
+        fields["sentiment"] = sentiment
+
+    # Overall confidence: anchored on the HCP, discounted when the message looks like more than a formulaic note
+    confidence = hcp_confidence
+    if not (products or "interactionType" in fields):
+        confidence *= 0.7
+    if "?" in text:
+        confidence = min(confidence, 0.3) # Questions need a conversational answer
+    if unresolved_date:
+        confidence = min(confidence, 0.3) # Saved with the wrong date (or today's) otherwise
+    if len(text.split()) > FAST_PATH_MAX_WORDS:
+        confidence = min(confidence, 0.5)
+
+    return FastExtraction(fields=fields, confidence=confidence, field_confidence=field_confidence)
+
+
+# --- Stats ---
+class FastPathStats:
+    """How many extraction turns skipped the LLM, and the latency that saved."""
+
+    def __init__(self):
+        self.fast_path_turns = 0
+        self.llm_turns = 0
+        self.fast_path_ms = 0.0
+        self.llm_ms = 0.0
+
+    def record(self, used_fast_path: bool, elapsed_ms: float):
+        if used_fast_path:
+            self.fast_path_turns += 1
+            self.fast_path_ms += elapsed_ms
+        else:
+            self.llm_turns += 1
+            self.llm_ms += elapsed_ms
+
+    def as_dict(self):
+        turns = self.fast_path_turns + self.llm_turns
+        avg_llm_ms = self.llm_ms / self.llm_turns if self.llm_turns else 0.0
+        avg_fast_ms = self.fast_path_ms / self.fast_path_turns if self.fast_path_turns else 0.0
+        return {
+            "enabled": FAST_PATH_ENABLED,
+            "confidence_threshold": FAST_PATH_CONFIDENCE_THRESHOLD,
+            "turns": turns,
+            "fast_path_turns": self.fast_path_turns,
+            "llm_turns": self.llm_turns,
+            "fast_path_share": self.fast_path_turns / turns if turns else 0.0,
+            "avg_llm_extraction_ms": avg_llm_ms,
+            "avg_fast_path_ms": avg_fast_ms,
+            # Each fast-path turn saved roughly one average LLM extraction
+            "estimated_latency_saved_ms": self.fast_path_turns * max(0.0, avg_llm_ms - avg_fast_ms),
+            "known_hcps": len(gazetteer.hcp_by_name),
+            "known_products": len(gazetteer.products),
+        }
+
+
+fast_path_stats = FastPathStats()
+
@@ -1,6 +1,6 @@
 import React, { useState, useCallback } from 'react';
 import { useDispatch, useSelector } from 'react-redux';
-import { setField, addChatMessage, clearForm, selectInteraction } from './interactionSlice';
+import { setField, addChatMessage, setChatSessionId, clearForm, selectInteraction } from './interactionSlice';
 import { nanoid } from '@reduxjs/toolkit';
 
 // Apply Inter font globally in your main CSS or App.js/index.js
@@ -40,17 +40,30 @@ const LogInteractionScreen = () => {
   dispatch(addChatMessage(userMessage));
 
     try {
-    const response = await fetch('http://localhost:8000/api/chat_interaction', {  // FULL URL here
+    const sendChat = (body) => fetch('http://localhost:8000/api/chat_interaction', {  // FULL URL here
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify({ message: chatInput, history: chat.messages }),
+      body: JSON.stringify(body),
     });
+    // Only the new message is sent; the backend restores the rest of the conversation from the session
+    let response = await sendChat({ message: chatInput, session_id: chat.sessionId });
+    if (response.status === 410) {
+      // The session expired on the server (evicted or lost in a restart): resend with the transcript to rebuild it
+      const expired = await response.json();
+      if (expired.session_expired) {
+        const history = chat.messages.map(({ sender, text }) => ({ sender, text }));
+        response = await sendChat({ message: chatInput, session_id: chat.sessionId, history });
+      }
+    }
 
       if (!response.ok) {
         throw new Error(`API error: ${response.statusText}`);
       }
 
       const aiResponseData = await response.json();
+      if (aiResponseData.session_id) {
+        dispatch(setChatSessionId(aiResponseData.session_id));
+      }
       // The AI response might contain structured data or just a conversational reply
       // For simplicity, we'll assume it's a conversational reply here.
       // The LangGraph agent should ideally parse the conversation and populate
@@ -14,6 +14,7 @@ const initialState = {
         { id: nanoid(), sender: 'ai', text: 'Hi! How can I help you log your HCP interaction today?', timestamp: new Date().toISOString() }
     ],
     isLoading: false,
+    sessionId: null, // Server-side conversation session; the backend keeps the history
   },
   // You might want to store a list of saved interactions here as well
   // savedInteractions: [],
@@ -36,6 +37,9 @@ const interactionSlice = createSlice({
     setChatLoading: (state, action) => {
       state.chat.isLoading = action.payload;
     },
+    setChatSessionId: (state, action) => {
+      state.chat.sessionId = action.payload;
+    },
     // Example: if AI directly provides full form data after chat
     setFormFromChat: (state, action) => {
         state.form = { ...state.form, ...action.payload };
@@ -44,7 +48,7 @@ const interactionSlice = createSlice({
   },
 });
 
-export const { setField, clearForm, addChatMessage, setChatLoading, setFormFromChat } = interactionSlice.actions;
+export const { setField, clearForm, addChatMessage, setChatLoading, setChatSessionId, setFormFromChat } = interactionSlice.actions;
 
 export const selectInteraction = (state) => state.interaction;
 export const selectForm = (state) => state.interaction.form;
@@ -0,0 +1,134 @@
+import logging
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+# BM25 is computed for at most this many matches (the newest), so a query for a word in half the
+# table costs the same as a rare one. Queries with fewer matches are ranked exactly.
+SEARCH_MAX_CANDIDATES = int(os.getenv("SEARCH_MAX_CANDIDATES", "1000"))
+
+# --- FTS5 index ---
+FTS_TABLE = "interactions_fts"
+FTS_COLUMNS = ["hcpName", "productsDiscussed", "keyDiscussionPoints", "followUpActions"]
+# bm25 column weights, in FTS_COLUMNS order: a product or HCP hit says more than a word in free text
+FTS_RANK = "bm25(2.0, 3.0, 1.0, 1.0)"
+SNIPPET_TOKENS = 12
+
+_columns = ", ".join(FTS_COLUMNS)
+_new_values = ", ".join(f"new.{c}" for c in FTS_COLUMNS)
+_old_values = ", ".join(f"old.{c}" for c in FTS_COLUMNS)
+
+# External-content table: the index stores only the inverted lists, the text stays in `interactions`.
+# Triggers keep it in sync on every write path (ORM, bulk executemany, raw SQL). The update trigger
+# fires only for indexed columns, so backfilling other columns does not re-index every row; it is
+# dropped and recreated on startup so databases with an older definition pick that up.
+FTS_DDL = [
+    f"DROP TRIGGER IF EXISTS {FTS_TABLE}_au",
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({_columns}, content='interactions', "
+    f"content_rowid='id', tokenize='unicode61 remove_diacritics 2', prefix='2 3')",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON interactions BEGIN "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values}); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON interactions BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values}); END",
+    f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {_columns} ON interactions BEGIN "
+    f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {_columns}) VALUES ('delete', old.id, {_old_values}); "
+    f"INSERT INTO {FTS_TABLE}(rowid, {_columns}) VALUES (new.id, {_new_values}); END",
+]
+
+
+def create_search_index(sync_conn) -> bool:
+    """Create the FTS table and its triggers if missing; returns True when the table is new and needs a rebuild."""
+    if sync_conn.dialect.name != "sqlite":
+        return False
+    existed = sync_conn.exec_driver_sql(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (FTS_TABLE,)).first() is not None
+    for statement in FTS_DDL:
+        sync_conn.exec_driver_sql(statement)
+    sync_conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rank) VALUES ('rank', '{FTS_RANK}')")
+    return not existed
+
+
+def rebuild_search_index(sync_conn):
+    """Re-index every row from the content table, then merge the index b-trees for faster queries."""
+    sync_conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+    sync_conn.exec_driver_sql(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')")
+
+
+def build_fts_query(text: str) -> Optional[str]:
+    """
+    Free text to an FTS5 query: every word must match (implicit AND); "dos*" is a prefix search.
+    Words are quoted, so FTS5 operators in user input stay literal. Prefixes are opt-in because
+    FTS5 must merge every matching term's doclist before it can seek or rank them.
+    """
+    words = re.findall(r"(\w+)(\*?)", text)
+    if not words:
+        return None
+    return " ".join(f'"{word}"{star}' for word, star in words)
+
+
+def add_column_filters(fts_query: str, column_values: Dict[str, List[str]]) -> str:
+    """
+    Narrow a query inside the index, e.g. hcpName : ("jane doe" OR "j doe"), so equality filters
+    intersect posting lists instead of checking rows one by one. Phrases match tokens, not whole values,
+    so callers still apply the exact filter in SQL. Titles are left out: "dr" is in almost every row.
+    """
+    clauses = [fts_query]
+    for column, values in column_values.items():
+        phrases = [" ".join(re.findall(r"\w+", _strip_title(value))) for value in values if value]
+        phrases = [f'"{phrase}"' for phrase in phrases if phrase]
+        if phrases:
+            clauses.append(f"{column} : ({' OR '.join(phrases)})")
+    return " AND ".join(f"({clause})" for clause in clauses)
+
+
+# --- Fuzzy HCP names ---
+def _strip_title(name: str) -> str:
+    return re.sub(r"^(?:Dr|Doctor|Prof|Professor)\.?\s+", "", name.strip(), flags=re.IGNORECASE)
+
+
+def _normalize_name(name: str) -> str:
+    return re.sub(r"[^\w\s]", "", _strip_title(name)).lower()
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramNameIndex:
+    """
+    Typo-tolerant lookup over distinct HCP names ("Dr. Smyth" -> "Dr. Smith"): candidates share at
+    least one character trigram with the query and are ranked by Dice similarity of trigram sets.
+    """
+
+    def __init__(self):
+        self._postings: Dict[str, Set[str]] = defaultdict(set) # trigram -> names containing it
+        self._sizes: Dict[str, int] = {} # name -> number of distinct trigrams
+
+    def add(self, name: Optional[str]):
+        if not name or name in self._sizes:
+            return
+        grams = _trigrams(_normalize_name(name))
+        self._sizes[name] = len(grams)
+        for gram in grams:
+            self._postings[gram].add(name)
+
+    def match(self, query: str, limit: int = 5, min_similarity: float = 0.45) -> List[Tuple[str, float]]:
+        grams = _trigrams(_normalize_name(query))
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._postings.get(gram, ()))
+        scored = [(name, 2 * count / (len(grams) + self._sizes[name])) for name, count in shared.items()]
+        scored = [(name, score) for name, score in scored if score >= min_similarity]
+        scored.sort(key=lambda item: (-item[1], item[0]))
+        return scored[:limit]
+
+    def __len__(self):
+        return len(self._sizes)
+
+
+hcp_name_index = TrigramNameIndex()
@@ -0,0 +1,187 @@
+import asyncio
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Dict
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "1024"))
+LLM_CACHE_TTL_SECONDS = float(os.getenv("LLM_CACHE_TTL_SECONDS", "3600"))
+LLM_CACHE_SQLITE_PATH = os.getenv("LLM_CACHE_SQLITE_PATH") # Unset = in-memory tier only
+LLM_CACHE_SQLITE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_SQLITE_MAX_ENTRIES", "100000")) # Oldest rows go first beyond this
+LLM_CACHE_PURGE_INTERVAL_SECONDS = 60.0 # Expired and over-cap rows are deleted by the first set() after this long
+
+
+def make_cache_key(prompt: str, model: str, temperature: float) -> str:
+    """
+    Hash of the normalized prompt plus the model settings that affect the output.
+    Normalization collapses whitespace, so re-sent messages that only differ in
+    indentation or trailing spaces share an entry.
+    """
+    normalized_prompt = re.sub(r"\s+", " ", prompt).strip()
+    raw_key = f"{model}\x1f{temperature}\x1f{normalized_prompt}"
+    return hashlib.sha256(raw_key.encode("utf-8")).hexdigest()
+
+
+# --- Cache tiers ---
+class InMemoryLRUCache:
+    """Bounded LRU map with a per-entry time-to-live."""
+
+    def __init__(self, max_entries: int = LLM_CACHE_MAX_ENTRIES, ttl_seconds: float = LLM_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict() # key -> (expires_at, value)
+
+    def get(self, key: str) -> Optional[str]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: str):
+        self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteCache:
+    """
+    Persistent tier that survives restarts. Calls are blocking; TieredLLMCache runs them off the event loop.
+    get() drops the expired row it reads; set() also purges every expired row, and the oldest ones beyond
+    max_entries, once per LLM_CACHE_PURGE_INTERVAL_SECONDS, so keys that are never read again do not pile up.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = LLM_CACHE_TTL_SECONDS, max_entries: int = LLM_CACHE_SQLITE_MAX_ENTRIES):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.purged = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS ix_llm_cache_created_at ON llm_cache (created_at)")
+            self._purge(time.time()) # Whatever expired while the app was down
+        self._last_purge = time.monotonic()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute("SELECT value, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if created_at + self.ttl_seconds < time.time():
+                with self._conn:
+                    self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            return value
+
+    def set(self, key: str, value: str):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, created_at) VALUES (?, ?, ?)", (key, value, time.time())
+            )
+            if time.monotonic() - self._last_purge >= LLM_CACHE_PURGE_INTERVAL_SECONDS:
+                self._last_purge = time.monotonic()
+                self._purge(time.time())
+
+    def _purge(self, now: float):
+        # Caller holds the lock and the transaction
+        purged = self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (now - self.ttl_seconds,)).rowcount
+        purged += self._conn.execute(
+            "DELETE FROM llm_cache WHERE key IN (SELECT key FROM llm_cache ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_entries,),
+        ).rowcount
+        if purged:
+            self.purged += purged
+            logger.info(f"Purged {purged} expired or excess rows from the persistent LLM cache")
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT count(*) FROM llm_cache").fetchone()[0]
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM llm_cache")
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class TieredLLMCache:
+    """
+    In-memory LRU in front of an optional persistent tier.
+    Values are strings (raw completion text or serialized structured output).
+    """
+
+    def __init__(self, memory: Optional[InMemoryLRUCache] = None, persistent: Optional[SQLiteCache] = None):
+        self.memory = memory if memory is not None else InMemoryLRUCache()
+        self.persistent = persistent
+        self.hits = 0
+        self.misses = 0
+        self.persistent_hits = 0
+
+    async def aget(self, key: str) -> Optional[str]:
+        value = self.memory.get(key)
+        if value is None and self.persistent is not None:
+            value = await asyncio.to_thread(self.persistent.get, key)
+            if value is not None:
+                self.persistent_hits += 1
+                self.memory.set(key, value) # Promote so the next hit skips the disk tier
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    async def aset(self, key: str, value: str):
+        self.memory.set(key, value)
+        if self.persistent is not None:
+            await asyncio.to_thread(self.persistent.set, key, value)
+
+    def clear(self):
+        self.memory.clear()
+        if self.persistent is not None:
+            self.persistent.clear()
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "persistent_hits": self.persistent_hits,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "persistent_purged": self.persistent.purged if self.persistent is not None else 0,
+        }
+
+
+def build_default_cache() -> Optional[TieredLLMCache]:
+    if not LLM_CACHE_ENABLED:
+        return None
+    persistent = SQLiteCache(LLM_CACHE_SQLITE_PATH) if LLM_CACHE_SQLITE_PATH else None
+    logger.info(f"LLM response cache enabled (max {LLM_CACHE_MAX_ENTRIES} entries, ttl {LLM_CACHE_TTL_SECONDS}s, "
+                f"persistent tier: {LLM_CACHE_SQLITE_PATH or 'off'})")
+    return TieredLLMCache(InMemoryLRUCache(), persistent)
@@ -0,0 +1,127 @@
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.runnables import RunnableLambda
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "groq") # "groq" or "stub" (offline, canned responses)
+GROQ_API_KEY = os.getenv("GROQ_API_KEY", "YOUR_GROQ_API_KEY_PLACEHOLDER")
+STUB_LLM_LATENCY_MS = float(os.getenv("STUB_LLM_LATENCY_MS", "300")) # Per call, before the first token
+STUB_LLM_JITTER_MS = float(os.getenv("STUB_LLM_JITTER_MS", "50")) # Uniform +/- around the latency
+STUB_LLM_TOKEN_MS = float(os.getenv("STUB_LLM_TOKEN_MS", "0")) # Per streamed token
+STUB_LLM_REPLY_TOKENS = int(os.getenv("STUB_LLM_REPLY_TOKENS", "20"))
+STUB_LLM_RATE_LIMIT_RATE = float(os.getenv("STUB_LLM_RATE_LIMIT_RATE", "0")) # Share of calls answered with a 429
+
+# What the stub "extracts" from every message; None makes structured calls fail like a model returning no tool call
+STUB_EXTRACTION: Optional[Dict[str, Any]] = {
+    "hcpName": "Dr. Stub",
+    "interactionType": "Meeting",
+    "productsDiscussed": ["ProductA"],
+    "keyDiscussionPoints": "Canned stub extraction",
+}
+
+
+# --- Stub backend ---
+class StubRateLimitError(Exception):
+    """Shaped like the Groq client's RateLimitError for the scheduler's retry logic."""
+    status_code = 429
+
+
+class StubChatModel(BaseChatModel):
+    """
+    Offline stand-in for ChatGroq: waits latency +/- jitter, then returns (or streams word by word)
+    a fixed reply. with_structured_output returns `structured_output` parsed into the requested schema,
+    or whatever the schema's `stub_response(structured_output, prompt)` builds when it defines one.
+    Structured answers also take token_latency_s per output token (~4 characters of JSON).
+    """
+    model_name: str = "stub"
+    temperature: float = 0
+    latency_s: float = STUB_LLM_LATENCY_MS / 1000
+    jitter_s: float = STUB_LLM_JITTER_MS / 1000
+    token_latency_s: float = STUB_LLM_TOKEN_MS / 1000
+    reply_tokens: int = STUB_LLM_REPLY_TOKENS
+    structured_output: Optional[Dict[str, Any]] = STUB_EXTRACTION
+    rate_limit_rate: float = STUB_LLM_RATE_LIMIT_RATE
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _delay(self) -> float:
+        if random.random() < self.rate_limit_rate:
+            raise StubRateLimitError("stub: 429 Too Many Requests")
+        return max(0.0, self.latency_s + random.uniform(-self.jitter_s, self.jitter_s))
+
+    def _words(self) -> List[str]:
+        return [f"word{i} " for i in range(self.reply_tokens)]
+
+    def _result(self) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self._words())))])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self._delay() + self.token_latency_s * self.reply_tokens)
+        return self._result()
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self._delay() + self.token_latency_s * self.reply_tokens)
+        return self._result()
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs: Any):
+        await asyncio.sleep(self._delay())
+        for word in self._words():
+            if self.token_latency_s:
+                await asyncio.sleep(self.token_latency_s)
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=word))
+            if run_manager:
+                await run_manager.on_llm_new_token(word, chunk=chunk)
+            yield chunk
+
+    def with_structured_output(self, schema, **kwargs: Any):
+        async def extract(prompt):
+            await asyncio.sleep(self._delay())
+            if self.structured_output is None:
+                raise ValueError("stub: no tool call returned") # What the real model does on small talk
+            build = getattr(schema, "stub_response", None)
+            result = build(self.structured_output, str(prompt)) if build else schema(**self.structured_output)
+            if self.token_latency_s:
+                await asyncio.sleep(self.token_latency_s * len(result.model_dump_json()) / 4)
+            return result
+        return RunnableLambda(extract)
+
+
+# --- Providers ---
+def make_groq_llm(model: str, temperature: float) -> BaseChatModel:
+    from langchain_groq import ChatGroq # Imported here so the stub provider works without the Groq client
+    # No client-side retries: llm_scheduler owns back-off, so a 429 pauses every caller of the model
+    return ChatGroq(temperature=temperature, model=model, api_key=GROQ_API_KEY, max_retries=0)
+
+
+def make_stub_llm(model: str, temperature: float) -> BaseChatModel:
+    return StubChatModel(model_name=f"stub-{model}", temperature=temperature)
+
+
+LLM_PROVIDERS: Dict[str, Callable[[str, float], BaseChatModel]] = {
+    "groq": make_groq_llm,
+    "stub": make_stub_llm,
+}
+LOCAL_LLM_PROVIDERS = {"stub"} # Run in-process: no remote rate limit applies to them
+
+
+def make_llm(model: str, temperature: float, provider: str = LLM_PROVIDER) -> BaseChatModel:
+    """Chat model for `model` from the configured provider. Register others in LLM_PROVIDERS."""
+    try:
+        factory = LLM_PROVIDERS[provider]
+    except KeyError:
+        raise ValueError(f"Unknown LLM_PROVIDER '{provider}', expected one of {sorted(LLM_PROVIDERS)}")
+    if provider != "groq":
+        logger.info(f"Using '{provider}' LLM provider for {model}")
+    return factory(model, temperature)
@@ -0,0 +1,236 @@
+import asyncio
+import contextvars
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+from llm_providers import LLM_PROVIDER, LOCAL_LLM_PROVIDERS
+from loop_monitor import percentile
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4")) # In-flight calls per model
+# Requests per minute per model (Groq free tier). Off by default for in-process providers (the stub): no quota to stay under
+LLM_RATE_LIMIT_RPM = float(os.getenv("LLM_RATE_LIMIT_RPM", "0" if LLM_PROVIDER in LOCAL_LLM_PROVIDERS else "30"))
+LLM_RATE_LIMIT_BURST = int(os.getenv("LLM_RATE_LIMIT_BURST", str(LLM_MAX_CONCURRENCY)))
+LLM_RETRY_MAX_ATTEMPTS = int(os.getenv("LLM_RETRY_MAX_ATTEMPTS", "4"))
+LLM_RETRY_BASE_DELAY_S = float(os.getenv("LLM_RETRY_BASE_DELAY_S", "0.5"))
+LLM_RETRY_MAX_DELAY_S = float(os.getenv("LLM_RETRY_MAX_DELAY_S", "20"))
+# Per-model overrides, e.g. '{"llama3-70b-8192": {"max_concurrency": 2, "rpm": 15}}'
+LLM_MODEL_LIMITS: Dict[str, Dict[str, float]] = json.loads(os.getenv("LLM_MODEL_LIMITS", "{}"))
+# Interactive callers fail fast instead of queueing without limit: LLMOverloadedError after this long waiting
+# for a slot (0 waits forever), or at once when this many callers are already queued on the model (0: no cap)
+LLM_QUEUE_TIMEOUT_S = float(os.getenv("LLM_QUEUE_TIMEOUT_S", "30"))
+LLM_MAX_QUEUE_DEPTH = int(os.getenv("LLM_MAX_QUEUE_DEPTH", "64"))
+WAIT_SAMPLES = 1000 # Recent queue waits kept per model for percentiles
+
+
+# Background work (batch jobs) sets this to False in its own task: it queues as long as it takes instead
+queue_limits_apply: contextvars.ContextVar[bool] = contextvars.ContextVar("llm_queue_limits_apply", default=True)
+
+
+class LLMOverloadedError(Exception):
+    """A call gave up waiting for its model's lane (queue full or LLM_QUEUE_TIMEOUT_S passed); answered as a 503."""
+
+    def __init__(self, model: str, reason: str, retry_after_s: float):
+        super().__init__(f"LLM {model} is overloaded ({reason}); retry in {retry_after_s:.0f}s")
+        self.model = model
+        self.retry_after_s = retry_after_s
+
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    status_code = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    return status_code == 429 or "RateLimit" in type(exc).__name__
+
+
+def is_retryable_error(exc: BaseException) -> bool:
+    """Rate limits, provider-side 5xx and connection/timeout failures; anything else fails immediately."""
+    status_code = getattr(exc, "status_code", None) or getattr(getattr(exc, "response", None), "status_code", None)
+    if is_rate_limit_error(exc) or (isinstance(status_code, int) and status_code >= 500):
+        return True
+    return isinstance(exc, (asyncio.TimeoutError, ConnectionError)) or type(exc).__name__ in (
+        "APIConnectionError", "APITimeoutError")
+
+
+def retry_after_seconds(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+# --- Rate limiting ---
+class TokenBucket:
+    """`rate` requests per second on average, with bursts of up to `capacity`. Waiters are served FIFO."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self.tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class ModelLane:
+    """Concurrency cap, rate limit, shared back-off and metrics for one model."""
+
+    def __init__(self, model: str, max_concurrency: int, rpm: float, burst: int):
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.rpm = rpm
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.bucket = TokenBucket(rpm / 60, burst) if rpm > 0 else None
+        self.paused_until = 0.0 # After a 429 every caller of this model waits, not just the one that hit it
+        self.queued = 0
+        self.in_flight = 0
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self.coalesced = 0
+        self.rejected = 0
+        self.waits_ms: "deque[float]" = deque(maxlen=WAIT_SAMPLES)
+
+    async def _wait_for_slot(self):
+        await self.semaphore.acquire()
+        try:
+            pause = self.paused_until - time.monotonic()
+            if pause > 0:
+                await asyncio.sleep(pause)
+            if self.bucket is not None:
+                await self.bucket.acquire()
+        except BaseException:
+            self.semaphore.release()
+            raise
+
+    def retry_after_s(self) -> float:
+        """Rough time for the queue to drain: any 429 pause, then one rate-limit interval per queued call."""
+        pause = max(0.0, self.paused_until - time.monotonic())
+        return max(1.0, pause + (self.queued * 60 / self.rpm if self.rpm > 0 else 0.0))
+
+    async def _wait_in_queue(self):
+        if not queue_limits_apply.get():
+            await self._wait_for_slot()
+            return
+        if LLM_MAX_QUEUE_DEPTH and self.queued > LLM_MAX_QUEUE_DEPTH: # self.queued already counts this caller
+            self.rejected += 1
+            raise LLMOverloadedError(self.model, f"{LLM_MAX_QUEUE_DEPTH} calls queued", self.retry_after_s())
+        try:
+            await asyncio.wait_for(self._wait_for_slot(), LLM_QUEUE_TIMEOUT_S or None)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise LLMOverloadedError(self.model, f"no slot within {LLM_QUEUE_TIMEOUT_S:.0f}s", self.retry_after_s()) from None
+
+    async def call(self, make_call: Callable[[], Awaitable[Any]]):
+        for attempt in range(LLM_RETRY_MAX_ATTEMPTS):
+            queued_at = time.perf_counter()
+            self.queued += 1
+            try:
+                await self._wait_in_queue()
+            finally:
+                self.queued -= 1
+            self.waits_ms.append((time.perf_counter() - queued_at) * 1000)
+            self.in_flight += 1
+            self.calls += 1
+            try:
+                return await make_call()
+            except Exception as e:
+                if not is_retryable_error(e) or attempt == LLM_RETRY_MAX_ATTEMPTS - 1:
+                    self.failures += 1
+                    raise
+                # Exponential back-off with full jitter, or the provider's Retry-After when it sends one
+                delay = retry_after_seconds(e) or random.uniform(0, min(LLM_RETRY_MAX_DELAY_S, LLM_RETRY_BASE_DELAY_S * 2 ** attempt))
+                self.retries += 1
+                if is_rate_limit_error(e):
+                    self.rate_limited += 1
+                    self.paused_until = max(self.paused_until, time.monotonic() + delay)
+                logger.warning(f"LLM call to {self.model} failed ({type(e).__name__}), "
+                               f"retry {attempt + 1}/{LLM_RETRY_MAX_ATTEMPTS - 1} in {delay:.2f}s")
+            finally:
+                self.in_flight -= 1
+                self.semaphore.release()
+            await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, float]:
+        waits = sorted(self.waits_ms)
+        return {
+            "max_concurrency": self.max_concurrency,
+            "rate_limit_rpm": self.rpm,
+            "queue_depth": self.queued,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "rate_limited": self.rate_limited,
+            "coalesced": self.coalesced,
+            "rejected": self.rejected,
+            "wait_p50_ms": percentile(waits, 50),
+            "wait_p95_ms": percentile(waits, 95),
+            "wait_max_ms": waits[-1] if waits else 0.0,
+        }
+
+
+# --- Scheduler ---
+class LLMScheduler:
+    """
+    Every LLM call goes through run(): identical in-flight prompts (same key) share one call, and
+    the rest queue on their model's lane for a concurrency slot and a rate-limit token.
+    """
+
+    def __init__(self):
+        self.lanes: Dict[str, ModelLane] = {}
+        self._in_flight: Dict[str, asyncio.Task] = {}
+
+    def lane(self, model: str) -> ModelLane:
+        if model not in self.lanes:
+            limits = LLM_MODEL_LIMITS.get(model, {})
+            self.lanes[model] = ModelLane(
+                model,
+                max_concurrency=int(limits.get("max_concurrency", LLM_MAX_CONCURRENCY)),
+                rpm=float(limits.get("rpm", LLM_RATE_LIMIT_RPM)),
+                burst=int(limits.get("burst", LLM_RATE_LIMIT_BURST)),
+            )
+        return self.lanes[model]
+
+    async def run(self, model: str, make_call: Callable[[], Awaitable[Any]], key: Optional[str] = None):
+        lane = self.lane(model)
+        if key is None:
+            return await lane.call(make_call)
+        task = self._in_flight.get(key)
+        if task is not None:
+            lane.coalesced += 1
+            logger.info(f"Coalesced identical in-flight prompt for {model}")
+        else:
+            task = asyncio.create_task(lane.call(make_call))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        # Shielded: a caller that disconnects must not cancel the call other callers are waiting on
+        return await asyncio.shield(task)
+
+    def _forget(self, key: str, task: asyncio.Task):
+        self._in_flight.pop(key, None)
+        if not task.cancelled():
+            task.exception() # Mark retrieved: if every caller went away, nobody else will
+
+    def stats(self) -> Dict[str, Any]:
+        return {model: lane.stats() for model, lane in self.lanes.items()}
+
+
+llm_scheduler = LLMScheduler()
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+import os
+from collections import deque
+from typing import Dict, Optional, Sequence
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+EVENT_LOOP_SAMPLE_INTERVAL_MS = float(os.getenv("EVENT_LOOP_SAMPLE_INTERVAL_MS", "50"))
+EVENT_LOOP_MAX_SAMPLES = 10000 # ~8 minutes of history at the default interval
+
+
+def percentile(sorted_values: Sequence[float], q: float) -> float:
+    """Nearest-rank percentile of an already sorted sequence (q in 0..100)."""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(q / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+class EventLoopLagMonitor:
+    """
+    Measures how late the event loop wakes a task that sleeps for a fixed interval.
+    Sustained lag means something is blocking the loop (sync I/O, CPU-heavy parsing) and every
+    in-flight request is stalled by that much.
+    """
+
+    def __init__(self, interval_ms: float = EVENT_LOOP_SAMPLE_INTERVAL_MS, max_samples: int = EVENT_LOOP_MAX_SAMPLES):
+        self.interval_s = interval_ms / 1000
+        self.samples: "deque[float]" = deque(maxlen=max_samples) # Lag per wake-up, in ms
+        self._task: Optional[asyncio.Task] = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            start = loop.time()
+            await asyncio.sleep(self.interval_s)
+            self.samples.append(max(0.0, loop.time() - start - self.interval_s) * 1000)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def reset(self):
+        self.samples.clear()
+
+    def stats(self) -> Dict[str, float]:
+        ordered = sorted(self.samples)
+        return {
+            "interval_ms": self.interval_s * 1000,
+            "samples": len(ordered),
+            "p50_lag_ms": percentile(ordered, 50),
+            "p99_lag_ms": percentile(ordered, 99),
+            "max_lag_ms": ordered[-1] if ordered else 0.0,
+        }
+
+
+loop_monitor = EventLoopLagMonitor()
@@ -1,31 +1,79 @@
-from fastapi import FastAPI, HTTPException, Depends, Body
+from dotenv import load_dotenv
+
+# Load environment variables from .env before the project modules below: they read their settings
+# (DATABASE_URL, LLM_PROVIDER, rate limits, cache sizes...) from the environment when imported
+load_dotenv()
+
+from fastapi import FastAPI, HTTPException, Depends, Body, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel, Field
-from ai_agent import process_chat_message, ChatRequest # Assuming ChatRequest is also in ai_agent.py or defined in main.py
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from fast_extractor import gazetteer, fast_path_stats
+from llm_providers import LLM_PROVIDER
+from loop_monitor import loop_monitor
+from write_behind import CHAT_WRITE_BEHIND_ENABLED, WriteBehindQueue
+from chat_batch import BATCH_CHAT_MAX_TRANSCRIPTS, ChatBatchRunner
+from llm_scheduler import LLMOverloadedError, llm_scheduler
+from database import (DATABASE_READ_URL, DATABASE_URL, create_reader_engine, create_sync_engine, create_writer_engine, describe)
+from tracing import (TracingMiddleware, instrument_engine, log_payload, mark_request_parsed, render_gauges, render_metrics,
+                     setup_opentelemetry, shutdown_opentelemetry, span)
+from interaction_search import (FTS_DDL, FTS_TABLE, SEARCH_MAX_CANDIDATES, SNIPPET_TOKENS, add_column_filters, build_fts_query,
+                                create_search_index, hcp_name_index, rebuild_search_index)
+from similarity_index import SIMILARITY_ENABLED, IndexEntry, SimilarityIndex, filter_keys, interaction_text
+from analytics import (apply_rollup_increments, check_rollups, create_rollup_tables, rebuild_rollups, rollup_increments,
+                       rollup_metadata, series_stmt, top_keys_stmt)
+from ai_agent import (AGENT_WARM_UP, ChatRequest, check_chat_session, configure_similar_interactions, context_stats, llm_cache,
+                      process_chat_message, session_store, setup_chat_sessions, stream_chat_message,
+                      wait_for_context_summaries, warm_up)
+from chat_sessions import SessionExpiredError
 from typing import List, Optional, Dict, Any
 from datetime import date
+import asyncio
+import base64
+import csv
+import hashlib
+import io
+import json
 import logging
 import os
-from dotenv import load_dotenv
+import time
 
 # SQLAlchemy specific imports
-from sqlalchemy import create_engine, Column, Integer, String, Date, Enum as SQLAEnum
+from sqlalchemy import (insert, select, update, exists, inspect, tuple_, func, literal_column, table, column, Column, Integer,
+                        String, Date, Enum as SQLAEnum, ForeignKey, Index, Table)
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlalchemy.ext.asyncio import async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 import enum # For Python enum to be used with SQLAlchemy Enum
 
-# LangGraph and Groq related imports will go into the agent file.
-from ai_agent import process_chat_message, ChatRequest # Ensure this import works
+# --- Database Setup (SQLAlchemy; SQLite by default, DATABASE_URL selects e.g. PostgreSQL) ---
+# Synchronous engine for scripts and tooling outside the request path
+engine = create_sync_engine()
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+instrument_engine(engine)
 
-load_dotenv() # Load environment variables from .env
+# Async engines used by the request handlers so DB I/O never blocks the event loop.
+# aiosqlite runs each connection on its own worker thread and hands results back to asyncio.
+# Writes go through async_engine (a single connection on SQLite); listing, search, export and analytics
+# reads go through read_engine's pool, so in WAL mode they never queue behind a commit.
+def configure_database(url: str = DATABASE_URL, read_url: Optional[str] = None):
+    """(Re)create the writer and reader engines and their session factories, e.g. to point benchmarks at a scratch database."""
+    global async_engine, read_engine, AsyncSessionLocal, ReadSessionLocal
+    async_engine = create_writer_engine(url)
+    read_engine = create_reader_engine(read_url or (DATABASE_READ_URL if url == DATABASE_URL else url))
+    # expire_on_commit=False keeps attributes loaded after commit, so serializing a row never triggers lazy I/O
+    AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+    ReadSessionLocal = async_sessionmaker(bind=read_engine, autoflush=False, expire_on_commit=False)
+    # Per-statement "db" spans and metrics
+    instrument_engine(async_engine.sync_engine)
+    instrument_engine(read_engine.sync_engine)
 
-# --- Database Setup (SQLite with SQLAlchemy) ---
-SQLALCHEMY_DATABASE_URL = "sqlite:///./sql_app.db"  # This will create a file named sql_app.db in the backend directory
+configure_database()
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False} # check_same_thread is needed only for SQLite
-)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# SQLite allows one writer at a time. Serializing commits in-process keeps concurrent writers
+# queued on the event loop instead of spinning in SQLite's busy handler while holding a connection.
+db_write_lock = asyncio.Lock()
 
 Base = declarative_base()
 
@@ -38,6 +86,16 @@ class InteractionSourceEnum(str, enum.Enum):
     STRUCTURED = "structured"
     CHAT_AI = "chat_ai"
 
+class ExportFormatEnum(str, enum.Enum):
+    NDJSON = "ndjson"
+    CSV = "csv"
+
+class SimilarityScopeEnum(str, enum.Enum):
+    HCP_OR_PRODUCT = "hcp_or_product"
+    HCP = "hcp"
+    PRODUCT = "product"
+    ALL = "all"
+
 class InteractionBase(BaseModel):
     hcpName: str = Field(..., example="Dr. Jane Doe")
     interactionDate: date = Field(..., example="2024-12-01")
@@ -46,6 +104,13 @@ class InteractionBase(BaseModel):
     keyDiscussionPoints: Optional[str] = Field(None, example="Discussed efficacy of ProductX for condition Z.")
     followUpActions: Optional[str] = Field(None, example="Send ProductX brochure by EOW.")
     source: InteractionSourceEnum = Field(default=InteractionSourceEnum.STRUCTURED, example="structured")
+    sentiment: Optional[str] = Field(None, example="positive")
+
+    @field_validator("sentiment")
+    @classmethod
+    def normalize_sentiment(cls, value: Optional[str]) -> Optional[str]:
+        # One spelling per label, so "Positive" and "positive " land in the same analytics bucket
+        return (value.strip().lower() or None) if value else None
 
 class InteractionCreate(InteractionBase):
     pass
@@ -56,7 +121,100 @@ class InteractionDB(InteractionBase):
     class Config:
         orm_mode = True # Pydantic V1 way, or from_attributes = True for Pydantic V2
 
+class InteractionPage(BaseModel):
+    items: List[InteractionDB]
+    next_cursor: Optional[str] = Field(None, description="Opaque token for the next page; null on the last page.")
+
+class BulkInteractionResult(BaseModel):
+    index: int # Position of the record in the uploaded array / NDJSON stream
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkInteractionResponse(BaseModel):
+    inserted: int
+    failed: int
+    results: List[BulkInteractionResult]
+
+class InteractionSearchHit(InteractionDB):
+    score: Optional[float] = Field(None, description="BM25 relevance, higher is better; null for HCP-only searches.")
+    snippet: Optional[str] = Field(None, description="Best-matching fragment with [matched] terms highlighted.")
+
+class InteractionSearchResponse(BaseModel):
+    items: List[InteractionSearchHit]
+    hcp_matches: List[str] = Field(default_factory=list, description="HCP names the fuzzy `hcp` parameter resolved to.")
+
+class SimilarInteraction(InteractionDB):
+    score: Optional[float] = Field(None, description="Cosine similarity of key points and follow-ups; 1.0 for the same wording.")
+
+class SaveTicketStatus(BaseModel):
+    ticket: str
+    status: str = Field(..., description="queued, saved or failed")
+    interaction_id: Optional[int] = None
+    error: Optional[str] = None
+
+class ChatBatchRequest(BaseModel):
+    transcripts: List[str] = Field(..., min_length=1, max_length=BATCH_CHAT_MAX_TRANSCRIPTS,
+                                   description="Independent dictated notes; each is processed as its own one-turn chat.")
+    save: bool = Field(True, description="Log each extracted interaction, as /api/chat_interaction does.")
+
+class ChatBatchJobStatus(BaseModel):
+    job_id: str
+    state: str = Field(..., description="running, done, cancelled or failed")
+    total: int
+    completed: int
+    failed: int
+    packed: int = Field(..., description="Transcripts extracted several to a prompt.")
+    packs: int
+    elapsed_s: float
+    transcripts_per_minute: float
+
+class AnalyticsTotal(BaseModel):
+    name: str
+    interactions: int
+
+class AnalyticsPoint(BaseModel):
+    period: str # Month (YYYY-MM), or the Monday of the week (YYYY-MM-DD) for weekly series
+    key: str
+    interactions: int
+
+class InteractionFilters(BaseModel):
+    hcpName: Optional[str] = None
+    interactionType: Optional[str] = None
+    source: Optional[InteractionSourceEnum] = None
+    dateFrom: Optional[date] = None
+    dateTo: Optional[date] = None
+
 # --- SQLAlchemy Model (Database Table Schema) ---
+# HCPs and products as dimension tables. The free-text hcpName/productsDiscussed columns stay on
+# interactions as entered (the API returns them unchanged); the ids are what aggregation joins on.
+class HCP(Base):
+    __tablename__ = "hcps"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)
+
+class Product(Base):
+    __tablename__ = "products"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, nullable=False, unique=True)
+
+interaction_products = Table(
+    "interaction_products",
+    Base.metadata,
+    Column("interaction_id", Integer, ForeignKey("interactions.id"), primary_key=True),
+    Column("product_id", Integer, ForeignKey("products.id"), primary_key=True),
+    # Copied from the interaction (never updated): "interactions per product per month" is then a
+    # range scan of the index below, with no lookup into interactions at all
+    Column("interactionDate", Date),
+    Index("ix_interaction_products_product_date", "product_id", "interactionDate"),
+)
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    name = Column(String, primary_key=True)
+
 class Interaction(Base):
     __tablename__ = "interactions"
 
@@ -68,15 +226,253 @@ class Interaction(Base):
     keyDiscussionPoints = Column(String, nullable=True)
     followUpActions = Column(String, nullable=True)
     source = Column(SQLAEnum(InteractionSourceEnum), default=InteractionSourceEnum.STRUCTURED)
+    hcp_id = Column(Integer, ForeignKey("hcps.id"), nullable=True)
+    sentiment = Column(String, nullable=True)
+
+    # Composite indexes backing keyset pagination on (interactionDate, id), alone or behind an equality filter
+    __table_args__ = (
+        Index("ix_interactions_date_id", "interactionDate", "id"),
+        Index("ix_interactions_hcp_date_id", "hcpName", "interactionDate", "id"),
+        Index("ix_interactions_type_date_id", "interactionType", "interactionDate", "id"),
+        Index("ix_interactions_source_date_id", "source", "interactionDate", "id"),
+        Index("ix_interactions_hcpid_date_id", "hcp_id", "interactionDate", "id"),
+    )
 
 
 # Create database tables
 # This function should ideally be called once at startup or managed by a migration tool like Alembic for production.
-def create_db_and_tables():
+def schema_fingerprint() -> str:
+    """Hash of every table, index, search trigger and data migration this version of the app sets up."""
+    parts = list(FTS_DDL) + [DIMENSIONS_MIGRATION]
+    for metadata in (Base.metadata, rollup_metadata):
+        for model_table in metadata.sorted_tables:
+            parts.append(str(CreateTable(model_table).compile(dialect=async_engine.dialect)))
+            parts += sorted(str(CreateIndex(index).compile(dialect=async_engine.dialect)) for index in model_table.indexes)
+    return "schema:" + hashlib.sha1("\n".join(parts).encode()).hexdigest()[:16]
+
+def schema_is_current(sync_conn, fingerprint: str) -> bool:
+    if not sync_conn.dialect.has_table(sync_conn, SchemaMigration.__tablename__):
+        return False
+    return sync_conn.execute(select(SchemaMigration.name).where(SchemaMigration.name == fingerprint)).first() is not None
+
+async def create_db_and_tables():
+    # A database already set up by this version of the app is recognized by one lookup, instead of
+    # re-inspecting every table, column, index and trigger on each worker start
+    fingerprint = schema_fingerprint()
+    async with async_engine.connect() as conn:
+        if await conn.run_sync(schema_is_current, fingerprint):
+            logger.info("Database schema is up to date.")
+            return
     logger.info("Creating database tables...")
-    Base.metadata.create_all(bind=engine)
+    async with async_engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        # Full-text index over the free-text columns; populated from existing rows the first time it is created
+        if await conn.run_sync(create_search_index):
+            await conn.run_sync(rebuild_search_index)
+            logger.info("Full-text search index built from existing interactions.")
+        # create_all skips new columns and indexes on tables that already exist, so add those explicitly
+        await conn.run_sync(add_missing_columns, Interaction.__table__)
+        # After the search triggers are (re)created: backfilling hcp_id must not fire a re-index of every row
+        await conn.run_sync(migrate_dimensions)
+        await conn.run_sync(lambda sync_conn: [index.create(sync_conn, checkfirst=True) for index in Interaction.__table__.indexes])
+        # Dashboard rollups; computed from existing rows (and their product links) the first time
+        if await conn.run_sync(create_rollup_tables):
+            rollup_rows = await conn.run_sync(rebuild_rollups)
+            logger.info(f"Analytics rollups built from existing interactions ({rollup_rows} rows).")
+        await conn.execute(SchemaMigration.__table__.delete().where(SchemaMigration.name.like("schema:%")))
+        await conn.execute(insert(SchemaMigration).values(name=fingerprint))
     logger.info("Database tables created (if they didn't exist).")
 
+def add_missing_columns(sync_conn, model_table: Table):
+    existing = {c["name"] for c in inspect(sync_conn).get_columns(model_table.name)}
+    for model_column in model_table.columns:
+        if model_column.name not in existing:
+            column_type = model_column.type.compile(dialect=sync_conn.dialect)
+            sync_conn.exec_driver_sql(f'ALTER TABLE {model_table.name} ADD COLUMN "{model_column.name}" {column_type}')
+            logger.info(f"Added column {model_table.name}.{model_column.name}.")
+
+# --- HCP/product dimensions ---
+DIMENSIONS_MIGRATION = "dimensions_v1"
+MIGRATION_BATCH_SIZE = 10000 # Interactions read per batch while backfilling product links
+
+def split_products(products_discussed: Optional[str]) -> List[str]:
+    # The chat path stores the extracted list as ", ".join(...), and the form is typed the same way
+    if not products_discussed:
+        return []
+    return list(dict.fromkeys(product.strip() for product in products_discussed.split(",") if product.strip()))
+
+def migrate_dimensions(sync_conn):
+    """
+    Backfill hcps, products and interaction_products from the free-text columns of existing rows.
+    Idempotent: every step skips rows that are already linked, and a finished run is recorded in schema_migrations.
+    """
+    if sync_conn.execute(select(SchemaMigration.name).where(SchemaMigration.name == DIMENSIONS_MIGRATION)).first():
+        return
+    start = time.perf_counter()
+
+    hcp_for_row = select(HCP.id).where(HCP.name == Interaction.hcpName)
+    sync_conn.execute(insert(HCP).from_select(
+        ["name"], select(Interaction.hcpName).distinct().where(Interaction.hcpName.is_not(None), Interaction.hcpName != "",
+                                                                ~exists(hcp_for_row))))
+    sync_conn.execute(update(Interaction).where(Interaction.hcp_id.is_(None), Interaction.hcpName.is_not(None),
+                                                Interaction.hcpName != "")
+                      .values(hcp_id=hcp_for_row.scalar_subquery()))
+
+    product_ids = dict(sync_conn.execute(select(Product.name, Product.id)).all())
+    unlinked = select(Interaction.id, Interaction.interactionDate, Interaction.productsDiscussed).where(
+        Interaction.productsDiscussed.is_not(None), ~exists().where(interaction_products.c.interaction_id == Interaction.id))
+    last_id, links_added = 0, 0
+    while True:
+        batch = sync_conn.execute(unlinked.where(Interaction.id > last_id).order_by(Interaction.id).limit(MIGRATION_BATCH_SIZE)).all()
+        if not batch:
+            break
+        last_id = batch[-1].id
+        row_products = [(row, split_products(row.productsDiscussed)) for row in batch]
+        new_names = {product for _, products in row_products for product in products} - product_ids.keys()
+        if new_names:
+            product_ids.update(sync_conn.execute(insert(Product).returning(Product.name, Product.id),
+                                                 [{"name": name} for name in new_names]).all())
+        links = [{"interaction_id": row.id, "product_id": product_ids[product], "interactionDate": row.interactionDate}
+                 for row, products in row_products for product in products]
+        if links:
+            sync_conn.execute(insert(interaction_products), links)
+            links_added += len(links)
+
+    sync_conn.execute(insert(SchemaMigration).values(name=DIMENSIONS_MIGRATION))
+    logger.info(f"Migrated interactions to HCP/product dimensions ({links_added} product links) in "
+                f"{time.perf_counter() - start:.1f}s.")
+
+class NameIdCache:
+    """
+    name -> id for one dimension table, so writes resolve known names without a query.
+    Unknown names are inserted in the writer's transaction and only cached once it commits;
+    callers hold db_write_lock from resolve() to commit()/rollback().
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.ids: Dict[str, int] = {}
+        self._pending: Dict[str, int] = {}
+
+    async def load(self, db: AsyncSession):
+        self.ids = dict((await db.execute(select(self.model.name, self.model.id))).all())
+
+    async def resolve(self, db: AsyncSession, names) -> Dict[str, int]:
+        names = {name for name in names if name}
+        missing = [name for name in names if name not in self.ids and name not in self._pending]
+        if missing:
+            # Rows written by another process (or before the cache was loaded) are found, not duplicated
+            stmt = select(self.model.name, self.model.id).where(self.model.name.in_(missing))
+            found = dict((await db.execute(stmt)).all())
+            new_names = [name for name in missing if name not in found]
+            if new_names:
+                result = await db.execute(insert(self.model).returning(self.model.name, self.model.id),
+                                          [{"name": name} for name in new_names])
+                found.update(result.all())
+            self._pending.update(found)
+        return {name: self.ids[name] if name in self.ids else self._pending[name] for name in names}
+
+    def commit(self):
+        self.ids.update(self._pending)
+        self._pending.clear()
+
+    def rollback(self):
+        self._pending.clear()
+
+hcp_id_cache = NameIdCache(HCP)
+product_id_cache = NameIdCache(Product)
+
+async def write_interactions(db: AsyncSession, rows: List[Dict[str, Any]]) -> List[int]:
+    """
+    Insert interactions with their HCP id, product links and analytics rollup counts in one transaction;
+    returns the new ids in row order.
+    The caller holds db_write_lock.
+    """
+    with span("db", "write_interactions", rows=len(rows)):
+        return await _write_interactions(db, rows)
+
+async def _write_interactions(db: AsyncSession, rows: List[Dict[str, Any]]) -> List[int]:
+    try:
+        hcp_ids = await hcp_id_cache.resolve(db, (row["hcpName"] for row in rows))
+        row_products = [split_products(row.get("productsDiscussed")) for row in rows]
+        product_ids = await product_id_cache.resolve(db, (product for products in row_products for product in products))
+        # One executemany INSERT ... RETURNING. Rows in a single writer-locked statement get
+        # ascending ids in parameter order, so sorting the returned ids lines them up with the rows
+        # (much cheaper than sort_by_parameter_order, which makes SQLAlchemy add sentinel handling).
+        result = await db.execute(insert(Interaction).returning(Interaction.id),
+                                  [{**row, "hcp_id": hcp_ids.get(row["hcpName"])} for row in rows])
+        new_ids = sorted(result.scalars().all())
+        links = [{"interaction_id": new_id, "product_id": product_ids[product], "interactionDate": row["interactionDate"]}
+                 for new_id, row, products in zip(new_ids, rows, row_products) for product in products]
+        if links:
+            await db.execute(insert(interaction_products), links)
+        await apply_rollup_increments(db, rollup_increments(rows, row_products))
+        await db.commit()
+    except Exception:
+        await db.rollback()
+        hcp_id_cache.rollback()
+        product_id_cache.rollback()
+        raise
+    hcp_id_cache.commit()
+    product_id_cache.commit()
+    # Embedded in the background; searchable as similar interactions a few milliseconds from now
+    similarity_index.add([similarity_entry(new_id, row, products) for new_id, row, products in zip(new_ids, rows, row_products)])
+    return new_ids
+
+# --- Known HCP/product names (fast-path gazetteer, fuzzy HCP search) ---
+def remember_names(hcp_name: Optional[str], products_discussed: Optional[str]):
+    # Newly written HCP/product names become recognizable by the fast-path extractor and HCP search right away
+    gazetteer.add_hcp(hcp_name)
+    hcp_name_index.add(hcp_name)
+    if products_discussed:
+        gazetteer.add_products(products_discussed.split(","))
+
+async def load_gazetteer():
+    # The dimension tables hold every distinct name, so this also warms the name -> id caches
+    async with ReadSessionLocal() as db:
+        await hcp_id_cache.load(db)
+        await product_id_cache.load(db)
+    for hcp_name in hcp_id_cache.ids:
+        gazetteer.add_hcp(hcp_name)
+        hcp_name_index.add(hcp_name)
+    gazetteer.add_products(product_id_cache.ids)
+    logger.info(f"Fast-path gazetteer loaded: {len(gazetteer.hcp_by_name)} HCPs, {len(gazetteer.products)} products.")
+
+# --- Listing helpers (keyset pagination and filters) ---
+def encode_cursor(interaction_date: date, interaction_id: int) -> str:
+    payload = json.dumps({"d": interaction_date.isoformat(), "i": interaction_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return date.fromisoformat(payload["d"]), int(payload["i"])
+    except (ValueError, KeyError, TypeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid cursor: {e}")
+
+def get_interaction_filters(
+    hcpName: Optional[str] = None,
+    interactionType: Optional[str] = None,
+    source: Optional[InteractionSourceEnum] = None,
+    dateFrom: Optional[date] = Query(None, description="Inclusive lower bound on interactionDate."),
+    dateTo: Optional[date] = Query(None, description="Inclusive upper bound on interactionDate."),
+) -> InteractionFilters:
+    return InteractionFilters(hcpName=hcpName, interactionType=interactionType, source=source, dateFrom=dateFrom, dateTo=dateTo)
+
+def apply_interaction_filters(stmt, filters: InteractionFilters):
+    if filters.hcpName:
+        stmt = stmt.where(Interaction.hcpName == filters.hcpName)
+    if filters.interactionType:
+        stmt = stmt.where(Interaction.interactionType == filters.interactionType)
+    if filters.source:
+        stmt = stmt.where(Interaction.source == filters.source)
+    if filters.dateFrom:
+        stmt = stmt.where(Interaction.interactionDate >= filters.dateFrom)
+    if filters.dateTo:
+        stmt = stmt.where(Interaction.interactionDate <= filters.dateTo)
+    return stmt
+
 # --- FastAPI Application ---
 app = FastAPI(
     title="AI-First CRM Backend",
@@ -96,8 +492,10 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so request spans include CORS handling and the Server-Timing header reaches every response
+app.add_middleware(TracingMiddleware)
 
-# Dependency to get DB session
+# Dependency to get DB session (synchronous, for scripts and tooling outside the request path)
 def get_db():
     db = SessionLocal()
     try:
@@ -105,94 +503,786 @@ def get_db():
     finally:
         db.close()
 
+# Dependency to get an async DB session for the API endpoints
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
+# Dependency for read-only endpoints: a session on the read pool (or replica)
+async def get_read_db():
+    async with ReadSessionLocal() as db:
+        yield db
+
 # --- API Endpoints ---
 
 # Call this on application startup to ensure tables are created
 @app.on_event("startup")
 async def on_startup():
-    create_db_and_tables()
+    setup_opentelemetry()
+    logger.info(f"Database: {describe(async_engine.url)}" + (
+        f", reads from {describe(read_engine.url)}" if read_engine.url != async_engine.url else ", reads on a separate pool"))
+    await setup_chat_sessions()
+    # Build the LLM clients and compile the agent graph in a worker thread while the database is set up
+    agent_warm_up = asyncio.create_task(asyncio.to_thread(warm_up)) if AGENT_WARM_UP else None
+    await create_db_and_tables()
+    await load_gazetteer()
+    if SIMILARITY_ENABLED:
+        similarity_index.start(fetch_similarity_entries, similarity_source_token) # Loads or builds the index in the background
+    if agent_warm_up is not None:
+        await agent_warm_up
+    loop_monitor.start()
+    if CHAT_WRITE_BEHIND_ENABLED:
+        chat_save_queue.start()
     # You can also initialize other things here, e.g., check Groq API key
-    if not os.getenv("GROQ_API_KEY") or os.getenv("GROQ_API_KEY") == "YOUR_GROQ_API_KEY_PLACEHOLDER":
+    if LLM_PROVIDER == "groq" and (not os.getenv("GROQ_API_KEY") or os.getenv("GROQ_API_KEY") == "YOUR_GROQ_API_KEY_PLACEHOLDER"):
         logger.warning("GROQ_API_KEY is not set or is a placeholder. AI features might not work.")
 
+@app.on_event("shutdown")
+async def on_shutdown():
+    await loop_monitor.stop()
+    await chat_batch_runner.aclose() # Before the drain, so no batch result is still being saved
+    await chat_save_queue.drain() # Commit every accepted chat save before the engine goes away
+    await similarity_index.aclose() # Saved for the next start; its catch-up reads through the engine
+    # Close pooled aiosqlite connections (and their worker threads) cleanly
+    await async_engine.dispose()
+    await read_engine.dispose()
+    await wait_for_context_summaries() # They write to the session checkpoints
+    await session_store.aclose()
+    shutdown_opentelemetry()
+
 
 @app.post("/api/interactions", response_model=InteractionDB, status_code=201)
 async def create_interaction_endpoint(
-    interaction: InteractionCreate, db: Session = Depends(get_db)
+    interaction: InteractionCreate, db: AsyncSession = Depends(get_async_db)
 ):
     """
     Log a new HCP interaction (typically from the structured form or processed by AI).
     """
-    logger.info(f"Received interaction log request: {interaction.model_dump_json()}")
-    db_interaction = Interaction(**interaction.model_dump())
-    db.add(db_interaction)
-    db.commit()
-    db.refresh(db_interaction)
-    logger.info(f"Interaction logged with ID: {db_interaction.id}")
-    return db_interaction
+    mark_request_parsed()
+    log_payload(logger, "Received interaction log request", interaction.model_dump_json)
+    row = interaction.model_dump()
+    async with db_write_lock:
+        [new_id] = await write_interactions(db, [row])
+    # No read-back needed: the stored row is exactly what was sent plus its id
+    remember_names(row["hcpName"], row["productsDiscussed"])
+    logger.info(f"Interaction logged with ID: {new_id}")
+    return {"id": new_id, **row}
 
-@app.get("/api/interactions", response_model=List[InteractionDB])
-async def get_interactions_endpoint(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+@app.get("/api/interactions", response_model=List[InteractionDB], deprecated=True)
+async def get_interactions_endpoint(response: Response, skip: int = 0, limit: int = 100,
+                                    filters: InteractionFilters = Depends(get_interaction_filters),
+                                    db: AsyncSession = Depends(get_read_db)):
     """
-    Retrieve logged HCP interactions.
+    Retrieve logged HCP interactions as a plain list, paged with skip/limit.
+    Deprecated: deep pages get slower (OFFSET scans every skipped row); use /api/v2/interactions and its cursors.
     """
-    interactions = db.query(Interaction).offset(skip).limit(limit).all()
-    logger.info(f"Retrieving {len(interactions)} interactions.")
+    response.headers["Deprecation"] = "true"
+    response.headers["Link"] = '</api/v2/interactions>; rel="successor-version"'
+    stmt = apply_interaction_filters(select(Interaction), filters).order_by(Interaction.id).offset(skip).limit(limit)
+    interactions = (await db.execute(stmt)).scalars().all()
+    logger.info(f"Retrieving {len(interactions)} interactions (deprecated skip/limit listing).")
     return interactions
 
+@app.get("/api/v2/interactions", response_model=InteractionPage)
+async def get_interactions_page_endpoint(
+    limit: int = Query(100, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    filters: InteractionFilters = Depends(get_interaction_filters),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Retrieve logged HCP interactions, newest first.
+    Pass the returned `next_cursor` back as `cursor` to fetch the following page.
+    """
+    stmt = apply_interaction_filters(select(Interaction), filters)
+    if cursor:
+        # Keyset seek: continue strictly after the last (interactionDate, id) of the previous page
+        cursor_date, cursor_id = decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Interaction.interactionDate, Interaction.id) < tuple_(cursor_date, cursor_id))
+    stmt = stmt.order_by(Interaction.interactionDate.desc(), Interaction.id.desc()).limit(limit + 1)
+
+    result = await db.execute(stmt)
+    interactions = result.scalars().all()
+    next_cursor = None
+    if len(interactions) > limit: # Fetched one extra row to know whether another page exists
+        interactions = interactions[:limit]
+        next_cursor = encode_cursor(interactions[-1].interactionDate, interactions[-1].id)
+    logger.info(f"Retrieving {len(interactions)} interactions.")
+    return {"items": interactions, "next_cursor": next_cursor}
+
+# --- Search ---
+fts_table = table(FTS_TABLE, column("rowid"), column("rank"))
+fts_match_column = literal_column(FTS_TABLE)
+
+async def fetch_snippets(db: AsyncSession, fts_query: str, ids: List[int]) -> Dict[int, str]:
+    # Only for the returned page, and against the user's words alone so filter phrases are never highlighted
+    if not ids:
+        return {}
+    stmt = (
+        select(fts_table.c.rowid, func.snippet(fts_match_column, -1, "[", "]", "…", SNIPPET_TOKENS))
+        .where(fts_match_column.op("MATCH")(fts_query))
+        .where(fts_table.c.rowid.in_(ids))
+    )
+    return {rowid: snippet for rowid, snippet in (await db.execute(stmt)).all()}
+
+@app.get("/api/interactions/search", response_model=InteractionSearchResponse)
+async def search_interactions_endpoint(
+    q: Optional[str] = Query(None, description="Words to find in HCP name, products, key points and follow-ups; \"dos*\" matches a prefix."),
+    hcp: Optional[str] = Query(None, description="HCP name, typo-tolerant (\"Dr. Smyth\" finds \"Dr. Smith\")."),
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0, le=1000),
+    filters: InteractionFilters = Depends(get_interaction_filters),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Full-text search ranked by BM25, with highlighted snippets. Without `q`, returns the matched HCPs' interactions newest first.
+    """
+    if read_engine.dialect.name != "sqlite":
+        raise HTTPException(status_code=501, detail="Full-text search uses SQLite FTS5 and is not available on this database.")
+    user_query = build_fts_query(q) if q else None
+    if user_query is None and not hcp:
+        raise HTTPException(status_code=400, detail="Provide search words in `q` and/or an HCP name in `hcp`.")
+
+    hcp_matches = [name for name, _ in hcp_name_index.match(hcp)] if hcp else []
+    if hcp and not hcp_matches:
+        return {"items": [], "hcp_matches": []}
+
+    start = time.perf_counter()
+    if user_query:
+        # The (selective) HCP filter is also a column filter inside the FTS query, so the index does the intersecting
+        hcp_names = hcp_matches or ([filters.hcpName] if filters.hcpName else [])
+        fts_query = add_column_filters(user_query, {"hcpName": hcp_names})
+        # Newest SEARCH_MAX_CANDIDATES matches (rowid order needs no scoring), then BM25 over just those
+        candidates = select(fts_table.c.rowid, fts_table.c.rank).where(fts_match_column.op("MATCH")(fts_query))
+        row_filters = filters.model_copy(update={"hcpName": None})
+        if row_filters != InteractionFilters(): # Type/source/date are not in the index; checked while collecting candidates
+            candidates = apply_interaction_filters(candidates.join(Interaction, Interaction.id == fts_table.c.rowid), row_filters)
+        candidates = candidates.order_by(fts_table.c.rowid.desc()).limit(SEARCH_MAX_CANDIDATES).subquery()
+        stmt = select(Interaction, candidates.c.rank).join(candidates, candidates.c.rowid == Interaction.id)
+        if hcp_matches:
+            stmt = stmt.where(Interaction.hcpName.in_(hcp_matches))
+        # Exact equality filters: the index phrases above match tokens, not whole values
+        stmt = apply_interaction_filters(stmt, filters).order_by(candidates.c.rank).limit(limit).offset(offset) # Lower rank = more relevant
+    else:
+        # Page of ids first: sorting several HCPs' rows together is done on ix_interactions_hcp_date_id alone
+        page_ids = (apply_interaction_filters(select(Interaction.id).where(Interaction.hcpName.in_(hcp_matches)), filters)
+                    .order_by(Interaction.interactionDate.desc(), Interaction.id.desc()).limit(limit).offset(offset))
+        stmt = (select(Interaction).where(Interaction.id.in_(page_ids.scalar_subquery()))
+                .order_by(Interaction.interactionDate.desc(), Interaction.id.desc()))
+
+    rows = (await db.execute(stmt)).all()
+    snippets = await fetch_snippets(db, user_query, [row[0].id for row in rows]) if user_query else {}
+    items = []
+    for row in rows:
+        hit = InteractionSearchHit.model_validate(row[0], from_attributes=True)
+        if user_query:
+            hit.score, hit.snippet = -row.rank, snippets.get(hit.id)
+        items.append(hit)
+    logger.info(f"Search q={q!r} hcp={hcp!r}: {len(items)} hits in {(time.perf_counter() - start) * 1000:.1f} ms")
+    return {"items": items, "hcp_matches": hcp_matches}
+
+@app.post("/api/interactions/search/rebuild")
+async def rebuild_search_index_endpoint():
+    """
+    Rebuild the full-text index from the interactions table (e.g. after restoring a backup or editing rows outside the app).
+    """
+    if async_engine.dialect.name != "sqlite":
+        raise HTTPException(status_code=501, detail="Full-text search uses SQLite FTS5 and is not available on this database.")
+    start = time.perf_counter()
+    async with db_write_lock:
+        async with async_engine.begin() as conn:
+            await conn.run_sync(rebuild_search_index)
+    await load_gazetteer()
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logger.info(f"Full-text search index rebuilt in {elapsed_ms:.0f} ms")
+    return {"rebuilt": True, "elapsed_ms": elapsed_ms, "known_hcps": len(hcp_name_index)}
+
+# --- Similar interactions (embedding index over key points and follow-ups) ---
+similarity_index = SimilarityIndex()
+
+def similarity_entry(interaction_id: int, row, products: Optional[List[str]] = None) -> IndexEntry:
+    # What the index embeds (key points + follow-ups) and what it filters on (HCP, products)
+    if products is None:
+        products = split_products(row.get("productsDiscussed"))
+    return (interaction_id, interaction_text(row.get("keyDiscussionPoints"), row.get("followUpActions")),
+            filter_keys(row.get("hcpName"), products))
+
+async def fetch_similarity_entries(after_id: int, limit: int) -> List[IndexEntry]:
+    # Interactions the index has not seen yet (first start, or inserted while the app was down), by ascending id
+    stmt = (select(Interaction.id, Interaction.hcpName, Interaction.productsDiscussed, Interaction.keyDiscussionPoints,
+                   Interaction.followUpActions)
+            .where(Interaction.id > after_id).order_by(Interaction.id).limit(limit))
+    async with ReadSessionLocal() as db:
+        rows = (await db.execute(stmt)).all()
+    return [similarity_entry(row.id, row._mapping) for row in rows]
+
+async def similarity_source_token(max_id: int) -> str:
+    # Ties a saved index to its database: the URL, the number of interactions up to the highest indexed id
+    # and that row's text. A database replaced or restored at the same URL changes (at least) the last two;
+    # one that only gained rows since keeps them, and the catch-up embeds the new rows
+    async with ReadSessionLocal() as db:
+        count = (await db.execute(select(func.count()).select_from(Interaction).where(Interaction.id <= max_id))).scalar()
+        last = (await db.execute(select(Interaction.keyDiscussionPoints, Interaction.followUpActions)
+                                 .where(Interaction.id == max_id))).first()
+    digest = hashlib.sha1(f"{count}\n{interaction_text(*last) if last else ''}".encode()).hexdigest()[:16]
+    return f"{async_engine.url.render_as_string(hide_password=True)}#{digest}"
+
+async def find_similar_interactions(db: AsyncSession, text: str, k: int, keys: Optional[List[str]] = None,
+                                    exclude_id: Optional[int] = None) -> List[SimilarInteraction]:
+    hits = await similarity_index.search(text, k, keys, exclude_id)
+    if not hits:
+        return []
+    rows = {row.id: row for row in (await db.execute(select(Interaction).where(Interaction.id.in_([i for i, _ in hits])))).scalars()}
+    items = []
+    for interaction_id, score in hits:
+        if interaction_id in rows:
+            item = SimilarInteraction.model_validate(rows[interaction_id], from_attributes=True)
+            item.score = score
+            items.append(item)
+    return items
+
+async def similar_interactions_for_chat(text: str, hcp_name: Optional[str], products: List[str], k: int) -> List[Dict[str, Any]]:
+    # The agent's similarInteractions node: past interactions with the HCP or products the rep's note mentions
+    keys = filter_keys(hcp_name, products)
+    if not keys:
+        return []
+    async with ReadSessionLocal() as db:
+        items = await find_similar_interactions(db, text, k, keys)
+    return [item.model_dump(mode="json") for item in items]
+
+configure_similar_interactions(similar_interactions_for_chat)
+
+@app.get("/api/interactions/{interaction_id}/similar", response_model=List[SimilarInteraction])
+async def similar_interactions_endpoint(
+    interaction_id: int,
+    k: int = Query(5, ge=1, le=50),
+    scope: SimilarityScopeEnum = Query(SimilarityScopeEnum.HCP_OR_PRODUCT, description=(
+        "Candidates: the same HCP or any shared product (default), the same HCP, a shared product, or every interaction.")),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Other interactions whose key points and follow-ups read most like this one's, most similar first.
+    """
+    if not similarity_index.running:
+        raise HTTPException(status_code=503, detail="The similarity index is disabled (SIMILARITY_ENABLED=false).")
+    interaction = await db.get(Interaction, interaction_id)
+    if interaction is None:
+        raise HTTPException(status_code=404, detail="Interaction not found")
+    products = split_products(interaction.productsDiscussed)
+    keys = {
+        SimilarityScopeEnum.HCP_OR_PRODUCT: filter_keys(interaction.hcpName, products),
+        SimilarityScopeEnum.HCP: filter_keys(interaction.hcpName),
+        SimilarityScopeEnum.PRODUCT: filter_keys(None, products),
+        SimilarityScopeEnum.ALL: None,
+    }[scope]
+    start = time.perf_counter()
+    items = await find_similar_interactions(db, interaction_text(interaction.keyDiscussionPoints, interaction.followUpActions),
+                                            k, keys, exclude_id=interaction_id)
+    logger.info(f"Similar to interaction {interaction_id} ({scope.value}): {len(items)} hits in "
+                f"{(time.perf_counter() - start) * 1000:.1f} ms")
+    return items
+
+# --- Bulk ingestion ---
+BULK_CHUNK_SIZE = 500 # Rows per INSERT transaction; keeps each write-lock hold short
+
+async def iter_bulk_records(request: Request):
+    """
+    Yield (index, raw_record) from either a JSON array body or an NDJSON stream.
+    NDJSON is parsed incrementally so large uploads are never held in memory as a whole.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        index = 0
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield index, line
+                    index += 1
+        if buffer.strip():
+            yield index, buffer
+    else:
+        try:
+            records = json.loads(await request.body())
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Request body is not valid JSON: {e}")
+        if not isinstance(records, list):
+            raise HTTPException(status_code=400, detail="Expected a JSON array of interactions or an NDJSON stream.")
+        for index, record in enumerate(records):
+            yield index, record
+
+async def insert_interaction_chunk(db: AsyncSession, chunk: List[tuple], results: List[BulkInteractionResult]):
+    # One transaction (and one executemany INSERT per table) per chunk
+    try:
+        async with db_write_lock:
+            new_ids = await write_interactions(db, [row for _, row in chunk])
+        for (index, row), new_id in zip(chunk, new_ids):
+            results.append(BulkInteractionResult(index=index, id=new_id))
+            remember_names(row["hcpName"], row["productsDiscussed"])
+    except Exception as e:
+        logger.error(f"Bulk insert of {len(chunk)} interactions failed: {e}", exc_info=True)
+        results.extend(BulkInteractionResult(index=index, error=f"Database error: {e}") for index, _ in chunk)
+
+@app.post("/api/interactions/bulk", response_model=BulkInteractionResponse)
+async def bulk_create_interactions_endpoint(request: Request, db: AsyncSession = Depends(get_async_db)):
+    """
+    Log many interactions at once (e.g. an offline sync from a field rep's device).
+    Accepts a JSON array of InteractionCreate records, or NDJSON with Content-Type: application/x-ndjson.
+    Invalid records are reported per index and do not block the valid ones.
+    """
+    results: List[BulkInteractionResult] = []
+    pending: List[tuple] = []
+    async for index, raw_record in iter_bulk_records(request):
+        try:
+            if isinstance(raw_record, bytes):
+                record = InteractionCreate.model_validate_json(raw_record)
+            else:
+                record = InteractionCreate.model_validate(raw_record)
+        except ValidationError as e:
+            error = "; ".join(f"{'.'.join(str(part) for part in err['loc']) or 'record'}: {err['msg']}" for err in e.errors())
+            results.append(BulkInteractionResult(index=index, error=error))
+            continue
+        pending.append((index, record.model_dump()))
+        if len(pending) >= BULK_CHUNK_SIZE:
+            await insert_interaction_chunk(db, pending, results)
+            pending = []
+    if pending:
+        await insert_interaction_chunk(db, pending, results)
+
+    results.sort(key=lambda r: r.index)
+    inserted = sum(1 for r in results if r.id is not None)
+    logger.info(f"Bulk ingestion: {inserted} inserted, {len(results) - inserted} failed.")
+    return BulkInteractionResponse(inserted=inserted, failed=len(results) - inserted, results=results)
+
+# --- LLM cache observability ---
+@app.get("/api/llm_cache/stats")
+async def llm_cache_stats_endpoint():
+    """
+    Hit/miss counters for the LLM response cache.
+    """
+    if llm_cache is None:
+        return {"enabled": False}
+    return {"enabled": True, **llm_cache.stats()}
+
+@app.get("/api/llm_scheduler/stats")
+async def llm_scheduler_stats_endpoint():
+    """
+    Per-model queue depth, in-flight calls, queue wait percentiles, retries, 429s and coalesced prompts.
+    """
+    return llm_scheduler.stats()
+
+@app.get("/api/write_behind/stats")
+async def write_behind_stats_endpoint():
+    """
+    Chat-save queue depth, batch sizes, saved/failed counts and how often enqueuers hit the size limit.
+    """
+    if not chat_save_queue.running:
+        return {"enabled": False}
+    return chat_save_queue.stats()
+
+@app.get("/api/similarity/stats")
+async def similarity_stats_endpoint():
+    """
+    Similar-interactions index: vectors indexed, rows waiting to be embedded, IVF lists, embedding and query times.
+    """
+    return similarity_index.stats()
+
+@app.get("/api/fast_path/stats")
+async def fast_path_stats_endpoint():
+    """
+    Share of extraction turns served by the local fast-path extractor, and the LLM latency that saved.
+    """
+    return fast_path_stats.as_dict()
+
+@app.get("/api/context_window/stats")
+async def context_window_stats_endpoint():
+    """
+    Prompt sizes against the context token budget, and rolling-summary update counts.
+    """
+    return context_stats.as_dict()
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """
+    Prometheus text exposition: span durations (HTTP, graph nodes, LLM calls, DB statements), request counts,
+    LLM token counts, and the numeric fields of the /api/*/stats endpoints as gauges.
+    """
+    extra = render_gauges("event_loop", loop_monitor.stats()) + render_gauges("context_window", context_stats.as_dict())
+    extra += render_gauges("fast_path", fast_path_stats.as_dict()) + render_gauges("similarity", similarity_index.stats())
+    for model, lane_stats in llm_scheduler.stats().items():
+        extra += render_gauges("llm_scheduler", lane_stats, model=model)
+    if llm_cache is not None:
+        extra += render_gauges("llm_cache", llm_cache.stats())
+    if chat_save_queue.running:
+        extra += render_gauges("write_behind", chat_save_queue.stats())
+    return PlainTextResponse(render_metrics(extra), media_type="text/plain; version=0.0.4")
+
+@app.get("/api/event_loop/stats")
+async def event_loop_stats_endpoint():
+    """
+    Event-loop lag percentiles since the last reset: how long ready tasks waited for the loop.
+    """
+    return loop_monitor.stats()
+
+@app.post("/api/event_loop/stats/reset", status_code=204)
+async def event_loop_stats_reset_endpoint():
+    """
+    Clear the lag samples, e.g. between load-test stages.
+    """
+    loop_monitor.reset()
+
+# --- Analytics (precomputed rollups) ---
+# Every read below is served from analytics_rollups alone; nothing scans interactions.
+MONTH_PATTERN = r"^\d{4}-\d{2}$"
+DAY_PATTERN = r"^\d{4}-\d{2}-\d{2}$"
+
+async def read_top_keys(db: AsyncSession, metric: str, month_from: Optional[str], month_to: Optional[str], limit: int):
+    rows = (await db.execute(top_keys_stmt(metric, month_from, month_to, limit))).all()
+    return [AnalyticsTotal(name=key, interactions=interactions) for key, interactions in rows]
+
+async def read_series(db: AsyncSession, metric: str, period_from: Optional[str], period_to: Optional[str]):
+    rows = (await db.execute(series_stmt(metric, period_from, period_to))).all()
+    return [AnalyticsPoint(period=period, key=key, interactions=interactions) for period, key, interactions in rows]
+
+@app.get("/api/analytics/hcps", response_model=List[AnalyticsTotal])
+async def analytics_hcps_endpoint(
+    month_from: Optional[str] = Query(None, pattern=MONTH_PATTERN, description="First month (YYYY-MM), inclusive."),
+    month_to: Optional[str] = Query(None, pattern=MONTH_PATTERN, description="Last month (YYYY-MM), inclusive."),
+    limit: int = Query(20, ge=1, le=1000),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    HCPs with the most interactions over a month range.
+    """
+    return await read_top_keys(db, "hcp", month_from, month_to, limit)
+
+@app.get("/api/analytics/products", response_model=List[AnalyticsTotal])
+async def analytics_products_endpoint(
+    month_from: Optional[str] = Query(None, pattern=MONTH_PATTERN, description="First month (YYYY-MM), inclusive."),
+    month_to: Optional[str] = Query(None, pattern=MONTH_PATTERN, description="Last month (YYYY-MM), inclusive."),
+    limit: int = Query(20, ge=1, le=1000),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Products discussed in the most interactions over a month range.
+    """
+    return await read_top_keys(db, "product", month_from, month_to, limit)
+
+@app.get("/api/analytics/products/monthly", response_model=List[AnalyticsPoint])
+async def analytics_products_monthly_endpoint(
+    month_from: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    month_to: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Interactions per product per month.
+    """
+    return await read_series(db, "product", month_from, month_to)
+
+@app.get("/api/analytics/weekly", response_model=List[AnalyticsPoint])
+async def analytics_weekly_endpoint(
+    week_from: Optional[str] = Query(None, pattern=DAY_PATTERN, description="Weeks starting on or after this date."),
+    week_to: Optional[str] = Query(None, pattern=DAY_PATTERN, description="Weeks starting on or before this date."),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Interactions per week (keyed by the Monday it starts on), split by source: structured form vs chat.
+    """
+    points = await read_series(db, "week", week_from, week_to)
+    for point in points:
+        point.key = InteractionSourceEnum[point.key].value # Stored by enum name, as in interactions.source
+    return points
+
+@app.get("/api/analytics/sentiment", response_model=List[AnalyticsPoint])
+async def analytics_sentiment_endpoint(
+    month_from: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    month_to: Optional[str] = Query(None, pattern=MONTH_PATTERN),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """
+    Sentiment mix per month, as extracted from chat ("unknown" when none was recorded).
+    """
+    return await read_series(db, "sentiment", month_from, month_to)
+
+@app.post("/api/analytics/rebuild")
+async def analytics_rebuild_endpoint():
+    """
+    Recompute every rollup from the raw interactions (also available as `python analytics.py rebuild`).
+    """
+    start = time.perf_counter()
+    async with db_write_lock:
+        async with async_engine.begin() as conn:
+            rollup_rows = await conn.run_sync(rebuild_rollups)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    logger.info(f"Analytics rollups rebuilt in {elapsed_ms:.0f} ms ({rollup_rows} rows)")
+    return {"rebuilt": True, "rollup_rows": rollup_rows, "elapsed_ms": elapsed_ms}
+
+@app.get("/api/analytics/consistency")
+async def analytics_consistency_endpoint():
+    """
+    Compare the rollups with a fresh aggregation of the raw interactions. Scans the whole table; for maintenance, not dashboards.
+    """
+    async with db_write_lock: # No insert may land between reading the raw counts and the rollups
+        async with async_engine.connect() as conn:
+            report = await conn.run_sync(check_rollups)
+    if not report["consistent"]:
+        logger.warning(f"Analytics rollups differ from raw data in {report['mismatched']} rows")
+    return report
+
+# --- Streaming export ---
+EXPORT_BATCH_SIZE = 1000 # Rows fetched per server-side cursor round-trip and written per response chunk
+EXPORT_COLUMNS = ["id", "hcpName", "interactionDate", "interactionType", "productsDiscussed",
+                  "keyDiscussionPoints", "followUpActions", "source", "sentiment"]
+
+def export_row_values(row) -> List[Any]:
+    return [row.id, row.hcpName, row.interactionDate.isoformat() if row.interactionDate else None, row.interactionType,
+            row.productsDiscussed, row.keyDiscussionPoints, row.followUpActions, row.source.value if row.source else None,
+            row.sentiment]
+
+async def stream_interactions_export(export_format: ExportFormatEnum, filters: InteractionFilters):
+    # The session is opened inside the generator rather than taken from get_async_db, because the
+    # response body is produced after the endpoint returns and must outlive the request dependencies.
+    # Plain column rows instead of ORM entities: nothing to track in the identity map
+    stmt = apply_interaction_filters(select(*Interaction.__table__.columns), filters)
+    stmt = stmt.order_by(Interaction.interactionDate.desc(), Interaction.id.desc())
+    async with ReadSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=EXPORT_BATCH_SIZE))
+        if export_format == ExportFormatEnum.CSV:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(EXPORT_COLUMNS)
+            yield buffer.getvalue()
+        async for partition in result.partitions():
+            if export_format == ExportFormatEnum.CSV:
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerows(export_row_values(row) for row in partition)
+                yield buffer.getvalue()
+            else:
+                yield "".join(json.dumps(dict(zip(EXPORT_COLUMNS, export_row_values(row)))) + "\n" for row in partition)
+
+@app.get("/api/interactions/export")
+async def export_interactions_endpoint(
+    format: ExportFormatEnum = ExportFormatEnum.NDJSON,
+    filters: InteractionFilters = Depends(get_interaction_filters),
+):
+    """
+    Stream all interactions matching the listing filters as NDJSON or CSV.
+    Rows are read through a server-side cursor, so memory use does not grow with the table.
+    """
+    logger.info(f"Exporting interactions as {format.value} with filters {filters.model_dump(exclude_none=True)}")
+    media_type = "text/csv" if format == ExportFormatEnum.CSV else "application/x-ndjson"
+    return StreamingResponse(
+        stream_interactions_export(format, filters),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="interactions.{format.value}"'},
+    )
+
 # Chat interaction endpoint (integrates with LangGraph agent)
 # Ensure ChatRequest Pydantic model is defined either here or imported from ai_agent.py
 # (As defined in previous instructions, it's fine if it's in ai_agent.py and imported)
 
-@app.post("/api/chat_interaction")
-async def chat_handler(request: ChatRequest, db: Session = Depends(get_db)): # Added db session
-    logger.info(f"Received chat request: {request.message}")
+def chat_interaction_row(extracted_data: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """
+    Validate AI-extracted fields into an interaction row. Returns None (nothing to save) when no hcpName was extracted.
+    """
+    log_payload(logger, "AI extracted data, attempting to log interaction", lambda: extracted_data)
+    products = extracted_data.get("productsDiscussed")
+    if isinstance(products, list): # process_chat_message already joins the list; accept both shapes
+        products = ", ".join(products)
+
+    # Map extracted_data to InteractionCreate Pydantic model
+    # Ensure field names match or handle discrepancies
+    interaction_data_to_save = {
+        "hcpName": extracted_data.get("hcpName"),
+        "interactionDate": extracted_data.get("interactionDate") or date.today().isoformat(),
+        "interactionType": extracted_data.get("interactionType") or "chat_derived",
+        "productsDiscussed": products or None,
+        "keyDiscussionPoints": extracted_data.get("keyDiscussionPoints"),
+        "followUpActions": extracted_data.get("followUpActions"),
+        "sentiment": extracted_data.get("sentiment"),
+        "source": InteractionSourceEnum.CHAT_AI # Mark as sourced from AI
+    }
+
+    # Filter out None values for fields that are optional in Pydantic model but might be required by DB if not nullable
+    interaction_data_to_save_cleaned = {k: v for k, v in interaction_data_to_save.items() if v is not None}
+
+    if not interaction_data_to_save_cleaned.get("hcpName"): # Require at least HCP name to save from chat
+        logger.info("Skipping database log from chat AI as hcpName was not extracted.")
+        return None
+
+    interaction_to_create = InteractionCreate(**interaction_data_to_save_cleaned)
+    return interaction_to_create.model_dump()
+
+# --- Chat saves (write-behind) ---
+async def flush_chat_saves(rows: List[Dict[str, Any]]) -> List[int]:
+    # One transaction for the whole batch: one write-lock hold and one commit instead of one per chat turn
+    async with AsyncSessionLocal() as db:
+        async with db_write_lock:
+            return await write_interactions(db, rows)
+
+def on_chat_save(row: Dict[str, Any], interaction_id: int):
+    remember_names(row["hcpName"], row["productsDiscussed"])
+    logger.info(f"Interaction logged from chat AI with ID: {interaction_id}")
+
+chat_save_queue = WriteBehindQueue(flush_chat_saves, on_saved=on_chat_save)
+
+async def attach_saved_interaction(db: AsyncSession, agent_response: Dict[str, Any]):
+    # If the agent extracted data, save it as an interaction and note the outcome in the reply
+    if not agent_response.get("extracted_data"):
+        return
     try:
-        agent_response = await process_chat_message(request) # process_chat_message is from ai_agent.py
-        
-        # If the agent extracted data, save it as an interaction
-        if agent_response.get("extracted_data"):
-            extracted_data = agent_response["extracted_data"]
-            logger.info(f"AI extracted data, attempting to log interaction: {extracted_data}")
-            
-            # Map extracted_data to InteractionCreate Pydantic model
-            # Ensure field names match or handle discrepancies
-            interaction_data_to_save = {
-                "hcpName": extracted_data.get("hcpName"),
-                "interactionDate": extracted_data.get("interactionDate") or date.today().isoformat(),
-                "interactionType": extracted_data.get("interactionType", "chat_derived"),
-                "productsDiscussed": ", ".join(extracted_data.get("productsDiscussed", [])) if extracted_data.get("productsDiscussed") else None,
-                "keyDiscussionPoints": extracted_data.get("keyDiscussionPoints"),
-                "followUpActions": extracted_data.get("followUpActions"),
-                "source": InteractionSourceEnum.CHAT_AI # Mark as sourced from AI
-            }
-            
-            # Filter out None values for fields that are optional in Pydantic model but might be required by DB if not nullable
-            interaction_data_to_save_cleaned = {k: v for k, v in interaction_data_to_save.items() if v is not None}
-
-            if interaction_data_to_save_cleaned.get("hcpName"): # Require at least HCP name to save from chat
-                try:
-                    interaction_to_create = InteractionCreate(**interaction_data_to_save_cleaned)
-                    db_interaction = Interaction(**interaction_to_create.model_dump())
-                    db.add(db_interaction)
-                    db.commit()
-                    db.refresh(db_interaction)
-                    logger.info(f"Interaction logged from chat AI with ID: {db_interaction.id}")
-                    # Optionally, add confirmation of saving to the agent's reply
-                    agent_response["reply"] += f" (Interaction details for {db_interaction.hcpName} logged with ID: {db_interaction.id})"
-                    agent_response["saved_interaction_id"] = db_interaction.id # Send back the ID
-                except Exception as e:
-                    logger.error(f"Failed to save interaction from AI chat: {e}", exc_info=True)
-                    agent_response["reply"] += " (There was an issue saving this interaction to the database.)"
-            else:
-                logger.info("Skipping database log from chat AI as hcpName was not extracted.")
+        row = chat_interaction_row(agent_response["extracted_data"])
+        if row is None:
+            return
+        if chat_save_queue.running:
+            # Reply now; the save is committed in the background. Poll /api/chat_interaction/saves/{save_ticket} for the id
+            ticket = await chat_save_queue.enqueue(row)
+            agent_response["reply"] += f" (Interaction details for {row['hcpName']} are being logged.)"
+            agent_response["save_ticket"] = ticket.ticket
+            return
+        async with db_write_lock:
+            [new_id] = await write_interactions(db, [row])
+        on_chat_save(row, new_id)
+        # Optionally, add confirmation of saving to the agent's reply
+        agent_response["reply"] += f" (Interaction details for {row['hcpName']} logged with ID: {new_id})"
+        agent_response["saved_interaction_id"] = new_id # Send back the ID
+    except Exception as e:
+        await db.rollback()
+        logger.error(f"Failed to save interaction from AI chat: {e}", exc_info=True)
+        agent_response["reply"] += " (There was an issue saving this interaction to the database.)"
+
+@app.get("/api/chat_interaction/saves/{ticket}", response_model=SaveTicketStatus)
+async def chat_save_status_endpoint(ticket: str):
+    """
+    Whether a chat-derived interaction (by the `save_ticket` from the chat reply) has been persisted, and its id.
+    """
+    save = chat_save_queue.status(ticket)
+    if save is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired save ticket.")
+    return SaveTicketStatus(ticket=save.ticket, status=save.status, interaction_id=save.interaction_id, error=save.error)
 
+@app.exception_handler(SessionExpiredError)
+async def session_expired_handler(request: Request, exc: SessionExpiredError):
+    # The client resends the turn with its transcript in `history` (and the same session_id) to continue
+    logger.info(f"Chat turn for expired session {exc.session_id}")
+    return JSONResponse(status_code=410, content={"detail": str(exc), "session_expired": True, "session_id": exc.session_id})
 
+@app.exception_handler(LLMOverloadedError)
+async def llm_overloaded_handler(request: Request, exc: LLMOverloadedError):
+    logger.warning(f"Rejected {request.url.path}: {exc}")
+    return JSONResponse(status_code=503, content={"detail": str(exc), "retry_after_s": exc.retry_after_s},
+                        headers={"Retry-After": str(int(exc.retry_after_s + 0.999))})
+
+@app.post("/api/chat_interaction")
+async def chat_handler(request: ChatRequest, db: AsyncSession = Depends(get_async_db)): # Added db session
+    mark_request_parsed()
+    log_payload(logger, "Received chat request", lambda: request.message)
+    try:
+        agent_response = await process_chat_message(request) # process_chat_message is from ai_agent.py
+        await attach_saved_interaction(db, agent_response)
         return agent_response # This now includes the AI's chat reply and potentially extracted data
+    except (SessionExpiredError, LLMOverloadedError):
+        raise
     except Exception as e:
         logger.error(f"Error in chat_handler: {e}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
+# --- Streaming chat (Server-Sent Events) ---
+def format_sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, default=str)}\n\n"
+
+async def chat_event_stream(request: ChatRequest):
+    """
+    SSE body for a chat turn: graph progress and reply tokens as they happen, then a
+    "done" event carrying the same payload as /api/chat_interaction: a `save_ticket` for the
+    write-behind save (or `saved_interaction_id` when CHAT_WRITE_BEHIND_ENABLED is off).
+    """
+    try:
+        agent_response = None
+        async for event, data in stream_chat_message(request):
+            if event == "result":
+                agent_response = data
+            else:
+                yield format_sse(event, data)
+        # Opened here rather than via get_async_db: the body outlives the request dependencies
+        async with AsyncSessionLocal() as db:
+            await attach_saved_interaction(db, agent_response)
+        yield format_sse("done", agent_response)
+    except SessionExpiredError as e: # Evicted between the handler's check and the turn
+        yield format_sse("error", {"detail": str(e), "session_expired": True, "session_id": e.session_id})
+    except LLMOverloadedError as e:
+        logger.warning(f"Rejected streaming chat turn: {e}")
+        yield format_sse("error", {"detail": str(e), "overloaded": True, "retry_after_s": e.retry_after_s})
+    except Exception as e:
+        logger.error(f"Error in chat stream: {e}", exc_info=True)
+        yield format_sse("error", {"detail": str(e)})
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"} # Stop proxies from buffering the stream
+
+@app.post("/api/chat_interaction/stream")
+async def chat_stream_handler(request: ChatRequest):
+    """
+    Streaming variant of /api/chat_interaction (text/event-stream).
+    """
+    mark_request_parsed()
+    log_payload(logger, "Received streaming chat request", lambda: request.message)
+    await check_chat_session(request) # An expired session is a 410 before the stream starts
+    return StreamingResponse(chat_event_stream(request), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@app.get("/api/chat_interaction/stream")
+async def chat_stream_get_handler(message: str, session_id: Optional[str] = None):
+    """
+    GET form of the streaming endpoint, for browser EventSource clients.
+    """
+    return await chat_stream_handler(ChatRequest(message=message, session_id=session_id))
+
+
+# --- Batch chat jobs (offline transcript backlogs) ---
+async def save_batch_result(result: Dict[str, Any]):
+    # A session per result: jobs outlive the request that submitted them
+    async with AsyncSessionLocal() as db:
+        await attach_saved_interaction(db, result)
+
+chat_batch_runner = ChatBatchRunner(on_result=save_batch_result)
+
+def get_batch_job(job_id: str):
+    job = chat_batch_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown or expired batch job.")
+    return job
+
+@app.post("/api/chat_interaction/batch", response_model=ChatBatchJobStatus, status_code=202)
+async def chat_batch_handler(request: ChatBatchRequest):
+    """
+    Start a job that runs every transcript through the chat agent. Returns immediately;
+    follow /api/chat_interaction/batch/{job_id}/results for the results as they finish.
+    """
+    mark_request_parsed()
+    return chat_batch_runner.submit(request.transcripts, save=request.save).status()
+
+@app.get("/api/chat_interaction/batch/{job_id}", response_model=ChatBatchJobStatus)
+async def chat_batch_status_endpoint(job_id: str):
+    """
+    Progress of a batch job.
+    """
+    return get_batch_job(job_id).status()
+
+async def stream_batch_results(job):
+    async for result in job.follow():
+        yield json.dumps(result, default=str) + "\n"
+
+@app.get("/api/chat_interaction/batch/{job_id}/results")
+async def chat_batch_results_endpoint(job_id: str):
+    """
+    Results of a batch job as NDJSON, one line per transcript in completion order (`index` is its
+    position in the request). Lines already available are sent at once; the stream ends with the job.
+    """
+    job = get_batch_job(job_id)
+    return StreamingResponse(stream_batch_results(job), media_type="application/x-ndjson", headers=SSE_HEADERS)
+
 
 #if __name__ == "__main__":
     #import uvicorn
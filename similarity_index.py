@@ -0,0 +1,622 @@
+import array
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import shutil
+import time
+import zlib
+from collections import Counter
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+SIMILARITY_ENABLED = os.getenv("SIMILARITY_ENABLED", "true").lower() == "true"
+# How key points / follow-ups become vectors:
+#   hashing                 feature-hashed words and word pairs; no model, no extra dependency, microseconds per note
+#   sentence-transformers   a local CPU model (SIMILARITY_MODEL) that also matches paraphrases;
+#                           needs `pip install sentence-transformers` and a one-off model download
+SIMILARITY_EMBEDDER = os.getenv("SIMILARITY_EMBEDDER", "hashing")
+SIMILARITY_MODEL = os.getenv("SIMILARITY_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
+SIMILARITY_HASHING_DIM = int(os.getenv("SIMILARITY_HASHING_DIM", "256")) # 1 KB of float32 per interaction
+# Saved at shutdown and memory-mapped at the next start, so only newer rows are embedded again; "" keeps it in memory only
+SIMILARITY_INDEX_PATH = os.getenv("SIMILARITY_INDEX_PATH", "./similarity_index")
+SIMILARITY_IVF_MIN_VECTORS = int(os.getenv("SIMILARITY_IVF_MIN_VECTORS", "50000")) # Below this every query is an exact scan
+SIMILARITY_IVF_PROBES = int(os.getenv("SIMILARITY_IVF_PROBES", "16")) # Clusters scanned per query; more = better recall, slower
+SIMILARITY_MIN_SCORE = float(os.getenv("SIMILARITY_MIN_SCORE", "0.1")) # Weaker matches (barely a shared word) are not returned
+SIMILARITY_EXACT_MAX_ROWS = int(os.getenv("SIMILARITY_EXACT_MAX_ROWS", "20000")) # Larger HCP/product row sets go through IVF too
+SIMILARITY_EMBED_BATCH_SIZE = 1000 # Interactions embedded per worker-thread call
+IVF_RETRAIN_GROWTH = 4 # Re-cluster once the index has grown this many times past the size it was clustered at
+
+# (interaction id, text to embed, filter keys); see interaction_text / filter_keys
+IndexEntry = Tuple[int, str, List[str]]
+RETIRED_ID = -1 # Id of a row replaced by a later add() of the same interaction; never returned by search()
+
+
+def interaction_text(key_points: Optional[str], follow_ups: Optional[str]) -> str:
+    return "\n".join(part for part in (key_points, follow_ups) if part and part.strip())
+
+
+def filter_keys(hcp_name: Optional[str] = None, products: Iterable[str] = ()) -> List[str]:
+    # Case-insensitive, so "productA" typed in chat finds rows logged as "ProductA"
+    keys = [f"hcp:{hcp_name.strip().lower()}"] if hcp_name and hcp_name.strip() else []
+    return keys + [f"product:{product.strip().lower()}" for product in products if product and product.strip()]
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0 # An empty text stays the zero vector (similar to nothing)
+    return (vectors / norms).astype(np.float32, copy=False)
+
+
+# --- Embedders ---
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+STOPWORDS = frozenset(
+    "a an and are as at be been but by for from had has have he her his i in is it its of on or our she that the their "
+    "them they this to was we were will with you".split()
+)
+
+
+class HashingEmbedder:
+    """
+    A hashing vectorizer: every word and adjacent word pair is hashed to one of `dim` buckets with a
+    hash-derived sign, weighted 1 + log(count), and the vector L2-normalized, so the inner product of two
+    vectors is their cosine similarity. crc32 (not hash()) keeps buckets identical across processes and
+    restarts, which is what lets a saved index be reused.
+    """
+
+    def __init__(self, dim: int = SIMILARITY_HASHING_DIM):
+        self.dim = dim
+        self.name = f"hashing-{dim}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        rows, columns, weights = [], [], []
+        for row, text in enumerate(texts):
+            words = [word for word in TOKEN_PATTERN.findall(text.lower()) if word not in STOPWORDS]
+            for feature, count in Counter(words + [f"{a} {b}" for a, b in zip(words, words[1:])]).items():
+                bucket = zlib.crc32(feature.encode())
+                rows.append(row)
+                columns.append(bucket % self.dim)
+                weights.append((1.0 + math.log(count)) * (1.0 if bucket & 0x80000000 else -1.0))
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        np.add.at(vectors, (rows, columns), weights)
+        return normalize(vectors)
+
+
+class SentenceTransformerEmbedder:
+    """A local sentence-embedding model, run on the CPU."""
+
+    def __init__(self, model_name: str = SIMILARITY_MODEL):
+        from sentence_transformers import SentenceTransformer # Optional dependency, imported only when configured
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.name = f"sentence-transformers:{model_name}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = self.model.encode(texts, batch_size=64, convert_to_numpy=True, normalize_embeddings=True)
+        return vectors.astype(np.float32, copy=False)
+
+
+def make_embedder(kind: str = SIMILARITY_EMBEDDER):
+    if kind == "hashing":
+        return HashingEmbedder()
+    if kind == "sentence-transformers":
+        return SentenceTransformerEmbedder()
+    raise ValueError(f"Unknown SIMILARITY_EMBEDDER {kind!r} (expected 'hashing' or 'sentence-transformers')")
+
+
+# --- Vector index ---
+def _grow(buffer: np.ndarray, used: int, needed: int) -> np.ndarray:
+    if len(buffer) >= needed:
+        return buffer
+    grown = np.zeros((max(needed, 2 * len(buffer)),) + buffer.shape[1:], dtype=buffer.dtype)
+    grown[:used] = buffer[:used]
+    return grown
+
+
+def _int_array(values: np.ndarray) -> array.array:
+    rows = array.array("i")
+    rows.frombytes(np.ascontiguousarray(values, dtype=np.int32).tobytes())
+    return rows
+
+
+def _to_csr(lists: List[array.array]) -> Tuple[np.ndarray, np.ndarray]:
+    # Copied on the event loop: numpy must not hold a buffer of an array.array that add() may append to
+    offsets = np.zeros(len(lists) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(rows) for rows in lists])
+    values = np.concatenate([np.array(rows, dtype=np.int32) for rows in lists]) if lists else np.zeros(0, np.int32)
+    return offsets, values
+
+
+def _from_csr(offsets: np.ndarray, values: np.ndarray) -> List[array.array]:
+    return [_int_array(values[offsets[i]:offsets[i + 1]]) for i in range(len(offsets) - 1)]
+
+
+def nearest_centroids(vectors: np.ndarray, centroids: np.ndarray, chunk_size: int = 16384) -> np.ndarray:
+    return np.concatenate([np.argmax(vectors[start:start + chunk_size] @ centroids.T, axis=1)
+                           for start in range(0, len(vectors), chunk_size)]) if len(vectors) else np.zeros(0, np.int64)
+
+
+def train_centroids(sample: np.ndarray, nlist: int, iterations: int = 8, seed: int = 0) -> np.ndarray:
+    """Spherical k-means: centroids are unit vectors, rows join the centroid with the highest inner product."""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assignment = nearest_centroids(sample, centroids)
+        order = np.argsort(assignment, kind="stable")
+        counts = np.bincount(assignment, minlength=nlist)
+        starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        sums = np.zeros_like(centroids)
+        filled = counts > 0
+        sums[filled] = np.add.reduceat(sample[order], starts[filled], axis=0)
+        # An empty cluster restarts from a random sample row instead of staying dead
+        sums[~filled] = sample[rng.choice(len(sample), int((~filled).sum()), replace=False)]
+        centroids = normalize(sums)
+    return centroids
+
+
+class VectorIndex:
+    """
+    Unit vectors of interactions, searched by inner product (= cosine similarity).
+
+    Rows live in a read-only base segment and an in-memory tail that add() appends to; after a load the
+    base is memory-mapped from the saved file, so a large index costs page cache rather than heap and opens
+    instantly. Each row also carries filter keys ("hcp:<name>", "product:<name>") with a list of rows per
+    key, so "same HCP or product" queries score only those rows.
+
+    Once clustered, unfiltered queries (and filters matching more than SIMILARITY_EXACT_MAX_ROWS rows) use
+    an IVF layout: rows are grouped under the nearest of ~sqrt(n) k-means centroids and a query scores only
+    the rows of its `probes` nearest centroids. This is approximate; the exact scan it replaces reads every
+    vector (1 GB at 1M rows of 256 dims). Clustering renumbers the rows list by list, so a probe reads each
+    list as one contiguous slice of the base instead of gathering scattered rows; rows added afterwards are
+    kept per list until the next clustering.
+
+    An id added again replaces its earlier row, which is retired (its id set to RETIRED_ID) rather than removed.
+
+    Not thread-safe: add(), search() and use_clusters() run on the event loop. read_rows() and cluster()
+    may run in a worker thread meanwhile, since rows below `size` only change in use_clusters().
+    """
+
+    def __init__(self, dim: int):
+        self.dim = dim
+        self.base = np.zeros((0, dim), dtype=np.float32)
+        self.tail = np.zeros((1024, dim), dtype=np.float32)
+        self._ids = np.zeros(1024, dtype=np.int64)
+        self.size = 0
+        self.max_id = 0
+        self.retired = 0
+        self.key_codes: Dict[str, int] = {}
+        self.key_rows: List[array.array] = []
+        self.centroids: Optional[np.ndarray] = None
+        self.list_bounds: Optional[np.ndarray] = None # List i holds base rows list_bounds[i]:list_bounds[i + 1] ...
+        self.list_rows: List[array.array] = [] # ... plus these, assigned after the clustering
+        self.clustered_size = 0 # Rows when the centroids were trained
+
+    def __len__(self) -> int:
+        return self.size
+
+    @property
+    def ids(self) -> np.ndarray:
+        return self._ids[:self.size]
+
+    def add(self, ids: List[int], vectors: np.ndarray, keys: List[List[str]]):
+        count, first_row = len(ids), self.size
+        if count and min(ids) <= self.max_id: # Ids normally only grow; a scan only when one may have been seen
+            seen = np.isin(self.ids, ids)
+            if seen.any():
+                self._ids[:self.size][seen] = RETIRED_ID
+                self.retired += int(seen.sum())
+        tail_used = self.size - len(self.base)
+        self._ids = _grow(self._ids, self.size, self.size + count)
+        self.tail = _grow(self.tail, tail_used, tail_used + count)
+        self._ids[first_row:first_row + count] = ids
+        self.tail[tail_used:tail_used + count] = vectors
+        for row, row_keys in enumerate(keys, start=first_row):
+            for key in row_keys:
+                code = self.key_codes.get(key)
+                if code is None:
+                    code = self.key_codes[key] = len(self.key_rows)
+                    self.key_rows.append(array.array("i"))
+                self.key_rows[code].append(row)
+        if self.centroids is not None:
+            self._assign(first_row, vectors)
+        self.size += count
+        self.max_id = max(self.max_id, max(ids))
+
+    def read_rows(self, start: int, stop: int) -> np.ndarray:
+        base_size = len(self.base)
+        parts = []
+        if start < base_size:
+            parts.append(self.base[start:min(stop, base_size)])
+        if stop > base_size:
+            parts.append(self.tail[max(start, base_size) - base_size:stop - base_size])
+        return parts[0] if len(parts) == 1 else np.concatenate(parts)
+
+    def cluster(self, size: int, seed: int = 0) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Train IVF centroids on (a sample of) the first `size` rows and lay those rows out list by list:
+        returns (centroids, list bounds, new row order, the rows' vectors in that order) for use_clusters().
+        Seconds at 1M rows; run it in a worker thread.
+        """
+        nlist = max(1, int(math.sqrt(size)))
+        rng = np.random.default_rng(seed)
+        centroids = train_centroids(self._gather(rng.choice(size, min(size, nlist * 32), replace=False)), nlist, seed=seed)
+        chunk_size = 65536
+        assignment = np.concatenate([nearest_centroids(self.read_rows(start, min(size, start + chunk_size)), centroids)
+                                     for start in range(0, size, chunk_size)])
+        order = np.argsort(assignment, kind="stable")
+        bounds = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        vectors = np.empty((size, self.dim), dtype=np.float32)
+        for start in range(0, size, chunk_size):
+            vectors[start:start + chunk_size] = self._gather(order[start:start + chunk_size])
+        return centroids, bounds, order, vectors
+
+    def use_clusters(self, centroids: np.ndarray, bounds: np.ndarray, order: np.ndarray, vectors: np.ndarray):
+        """Install the result of cluster(): its rows are renumbered in list order, rows added meanwhile are assigned."""
+        clustered = len(order)
+        new_row = np.empty(clustered, dtype=np.int64)
+        new_row[order] = np.arange(clustered)
+        later = self.read_rows(clustered, self.size).copy()
+        self._ids[:clustered] = self._ids[:clustered][order]
+        self.base = vectors
+        self.tail = _grow(np.zeros((1024, self.dim), dtype=np.float32), 0, len(later))
+        self.tail[:len(later)] = later
+        key_offsets, key_rows = _to_csr(self.key_rows)
+        renumbered = key_rows < clustered
+        key_rows[renumbered] = new_row[key_rows[renumbered]]
+        self.key_rows = _from_csr(key_offsets, key_rows)
+        self.centroids, self.list_bounds, self.clustered_size = centroids, bounds, clustered
+        self.list_rows = [array.array("i") for _ in range(len(centroids))]
+        if len(later):
+            self._assign(clustered, later)
+
+    def _assign(self, first_row: int, vectors: np.ndarray):
+        for row, list_number in enumerate(nearest_centroids(vectors, self.centroids), start=first_row):
+            self.list_rows[list_number].append(row)
+
+    def _rows_with_keys(self, keys: List[str]) -> np.ndarray:
+        lists = [np.array(self.key_rows[self.key_codes[key]], dtype=np.int32) for key in keys if key in self.key_codes]
+        if not lists:
+            return np.zeros(0, dtype=np.int32)
+        return lists[0] if len(lists) == 1 else np.unique(np.concatenate(lists))
+
+    def _nearest_lists(self, query: np.ndarray, probes: int) -> np.ndarray:
+        centroid_scores = self.centroids @ query
+        if probes >= len(centroid_scores):
+            return np.arange(len(centroid_scores))
+        return np.argpartition(-centroid_scores, probes - 1)[:probes]
+
+    def _list_rows(self, lists: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Rows of the lists: the contiguous blocks, and the rows added since the clustering."""
+        bounds = self.list_bounds
+        blocks = np.concatenate([np.arange(bounds[i], bounds[i + 1]) for i in lists])
+        added = np.concatenate([np.array(self.list_rows[i], dtype=np.int64) for i in lists])
+        return blocks, added
+
+    def _gather(self, rows: np.ndarray) -> np.ndarray:
+        base_size = len(self.base)
+        in_base = rows < base_size
+        if in_base.all():
+            return self.base[rows]
+        if not in_base.any():
+            return self.tail[rows - base_size]
+        vectors = np.empty((len(rows), self.dim), dtype=np.float32)
+        vectors[in_base] = self.base[rows[in_base]]
+        vectors[~in_base] = self.tail[rows[~in_base] - base_size]
+        return vectors
+
+    def search(self, query: np.ndarray, k: int, keys: Optional[List[str]] = None, exclude_id: Optional[int] = None,
+               probes: int = SIMILARITY_IVF_PROBES) -> List[Tuple[int, float]]:
+        """
+        Top `k` (id, cosine similarity) pairs, best first. With `keys`, only rows having at least one of
+        them (e.g. the same HCP or any of the products) are candidates.
+        """
+        if self.size == 0:
+            return []
+        wanted = k + (exclude_id is not None) + self.retired
+        if keys is not None:
+            rows = self._rows_with_keys(keys)
+            if len(rows) > SIMILARITY_EXACT_MAX_ROWS and self.centroids is not None:
+                # A popular product: only its rows in the query's nearest lists (if that leaves enough of them)
+                member = np.zeros(self.size, dtype=bool)
+                member[rows] = True
+                probed = np.concatenate(self._list_rows(self._nearest_lists(query, probes)))
+                probed = probed[member[probed]]
+                if len(probed) >= wanted:
+                    rows = probed
+            scores = self._gather(rows) @ query
+        elif self.centroids is not None:
+            lists = self._nearest_lists(query, probes)
+            blocks, added = self._list_rows(lists)
+            rows = np.concatenate([blocks, added])
+            scores = np.concatenate([self.base[self.list_bounds[i]:self.list_bounds[i + 1]] @ query for i in lists]
+                                    + [self._gather(added) @ query])
+        else: # Exact scan, in row order
+            rows = None
+            scores = np.concatenate([self.base @ query, self.tail[:self.size - len(self.base)] @ query])
+        if len(scores) > wanted:
+            top = np.argpartition(-scores, wanted - 1)[:wanted]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top], kind="stable")]
+        ids = self._ids[top if rows is None else rows[top]]
+        hits = [(int(interaction_id), float(score)) for interaction_id, score in zip(ids, scores[top])
+                if interaction_id != exclude_id and interaction_id != RETIRED_ID]
+        return hits[:k]
+
+    # --- Persistence ---
+    def snapshot(self) -> Dict[str, Any]:
+        """Everything save() writes except the vectors; taken on the event loop, so add() cannot interleave."""
+        key_offsets, key_rows = _to_csr(self.key_rows)
+        state = {"size": self.size, "max_id": self.max_id, "ids": self.ids.copy(), "keys": list(self.key_codes),
+                 "key_offsets": key_offsets, "key_rows": key_rows, "clustered_size": self.clustered_size}
+        if self.centroids is not None:
+            state["centroids"], state["list_bounds"] = self.centroids, self.list_bounds
+            state["list_offsets"], state["list_rows"] = _to_csr(self.list_rows)
+        return state
+
+    def save(self, path: str, snapshot: Dict[str, Any], meta: Dict[str, Any]):
+        """Write a snapshot and its rows to `path` (replaced as a whole); run in a worker thread."""
+        staging, retired = f"{path}.tmp", f"{path}.old"
+        shutil.rmtree(staging, ignore_errors=True)
+        os.makedirs(staging)
+        size = snapshot["size"]
+        vectors = np.lib.format.open_memmap(os.path.join(staging, "vectors.npy"), mode="w+", dtype=np.float32,
+                                            shape=(size, self.dim))
+        for start in range(0, size, 65536):
+            stop = min(size, start + 65536)
+            vectors[start:stop] = self.read_rows(start, stop)
+        vectors.flush()
+        del vectors
+        for name in ("ids", "key_offsets", "key_rows", "centroids", "list_bounds", "list_offsets", "list_rows"):
+            if name in snapshot:
+                np.save(os.path.join(staging, f"{name}.npy"), snapshot[name])
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump({**meta, "dim": self.dim, "size": size, "max_id": snapshot["max_id"], "keys": snapshot["keys"],
+                       "clustered_size": snapshot["clustered_size"]}, f)
+        # The open memory map of the previous save stays readable after its files are unlinked
+        shutil.rmtree(retired, ignore_errors=True)
+        if os.path.exists(path):
+            os.rename(path, retired)
+        os.rename(staging, path)
+        shutil.rmtree(retired, ignore_errors=True)
+
+    @classmethod
+    def load(cls, path: str) -> Tuple["VectorIndex", Dict[str, Any]]:
+        with open(os.path.join(path, "meta.json")) as f:
+            meta = json.load(f)
+
+        def part(name: str) -> np.ndarray:
+            return np.load(os.path.join(path, f"{name}.npy"))
+
+        index = cls(meta["dim"])
+        index.base = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        ids = part("ids")
+        index._ids = _grow(ids, len(ids), len(ids) + 1024)
+        index.size, index.max_id = meta["size"], meta["max_id"]
+        index.retired = int((ids[:index.size] == RETIRED_ID).sum())
+        index.key_codes = {key: code for code, key in enumerate(meta["keys"])}
+        index.key_rows = _from_csr(part("key_offsets"), part("key_rows"))
+        if os.path.exists(os.path.join(path, "centroids.npy")):
+            index.centroids, index.list_bounds = part("centroids"), part("list_bounds")
+            index.list_rows = _from_csr(part("list_offsets"), part("list_rows"))
+            index.clustered_size = meta["clustered_size"]
+        return index, meta
+
+
+# --- Keeping the index in step with the interactions table ---
+class SimilarityIndex:
+    """
+    Owns the embedder and the VectorIndex. A single background worker loads the saved index (or starts
+    empty), embeds the interactions it is missing via `fetch` (id > the highest indexed id, in batches),
+    then embeds whatever add() queued as rows are inserted. Embedding runs in a worker thread, so
+    neither inserts nor the event loop wait for it; a row becomes searchable a few milliseconds after
+    its insert commits. Rows inserted by other processes are picked up at the next start.
+
+    A saved index records `source(max_id)`, a token for the database it was built from (see
+    main.similarity_source_token), and is only reused while the database still gives the same token:
+    a replaced or restored database is re-embedded instead of serving another database's vectors.
+    """
+
+    def __init__(self, path: str = SIMILARITY_INDEX_PATH, embedder_factory: Callable[[], Any] = make_embedder):
+        self.path = path
+        self.embedder_factory = embedder_factory
+        self.embedder = None
+        self.index: Optional[VectorIndex] = None
+        self.ready = False # Every interaction that existed at start is indexed
+        self.fetch: Optional[Callable[[int, int], Awaitable[List[IndexEntry]]]] = None
+        self.source: Optional[Callable[[int], Awaitable[str]]] = None
+        self._pending: List[IndexEntry] = []
+        self._queued_ids: set = set() # Queued by add() while the start-up catch-up may still fetch them
+        self._wakeup: Optional[asyncio.Event] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._clustering: Optional[asyncio.Task] = None
+        self._save_lock = asyncio.Lock()
+        self._dirty = False
+        self.embedded = 0
+        self.embed_ms = 0.0
+        self.failed = 0
+        self.queries = 0
+        self.query_ms = 0.0
+
+    def start(self, fetch: Callable[[int, int], Awaitable[List[IndexEntry]]],
+              source: Optional[Callable[[int], Awaitable[str]]] = None):
+        """
+        `fetch(after_id, limit)` returns the next interactions by ascending id, for the catch-up;
+        `source(max_id)` identifies the database as of interaction id `max_id`.
+        """
+        if self._worker is None:
+            self.fetch, self.source = fetch, source
+            self._wakeup = asyncio.Event()
+            self._worker = asyncio.create_task(self._run())
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None
+
+    def add(self, entries: List[IndexEntry]):
+        """Queue newly committed interactions for embedding; returns at once."""
+        if self._worker is None:
+            return
+        self._pending.extend(entries)
+        if not self.ready:
+            self._queued_ids.update(entry[0] for entry in entries)
+        self._wakeup.set()
+
+    async def search(self, text: str, k: int, keys: Optional[List[str]] = None,
+                     exclude_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        """Indexed interactions most similar to `text` (at least SIMILARITY_MIN_SCORE); empty until the embedder is loaded."""
+        if self.index is None or not text:
+            return []
+        start = time.perf_counter()
+        [query] = await asyncio.to_thread(self.embedder.embed, [text])
+        hits = [hit for hit in self.index.search(query, k, keys, exclude_id) if hit[1] >= SIMILARITY_MIN_SCORE]
+        self.queries += 1
+        self.query_ms += (time.perf_counter() - start) * 1000
+        return hits
+
+    async def _run(self):
+        try:
+            await self._open()
+            await self._catch_up()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Similarity index could not be built: {e}", exc_info=True)
+            return
+        self.ready = True
+        self._queued_ids.clear()
+        while True:
+            while self._pending:
+                batch = self._pending[:SIMILARITY_EMBED_BATCH_SIZE]
+                del self._pending[:SIMILARITY_EMBED_BATCH_SIZE]
+                await self._embed_and_add(batch)
+            self._wakeup.clear()
+            await self._wakeup.wait()
+
+    async def _open(self):
+        self.embedder = await asyncio.to_thread(self.embedder_factory) # A model load can take seconds
+        if self.path and os.path.exists(os.path.join(self.path, "meta.json")):
+            try:
+                index, meta = await asyncio.to_thread(VectorIndex.load, self.path)
+                if meta.get("embedder") != self.embedder.name or index.dim != self.embedder.dim:
+                    logger.info(f"Similarity index at {self.path} was built by {meta.get('embedder')}; re-embedding "
+                                f"with {self.embedder.name}")
+                elif meta.get("source") != await self._source_token(index.max_id):
+                    logger.info(f"Similarity index at {self.path} was built from another database (or an earlier "
+                                f"state of it); re-embedding")
+                else:
+                    self.index = index
+                    logger.info(f"Similarity index loaded from {self.path}: {len(index)} vectors up to id {index.max_id}")
+                    return
+            except Exception as e:
+                logger.warning(f"Similarity index at {self.path} could not be loaded or checked ({e}); re-embedding")
+        self.index = VectorIndex(self.embedder.dim)
+
+    async def _catch_up(self):
+        start, after_id, before = time.perf_counter(), self.index.max_id, len(self.index)
+        while True:
+            entries = await self.fetch(after_id, SIMILARITY_EMBED_BATCH_SIZE)
+            if not entries:
+                break
+            after_id = entries[-1][0]
+            await self._embed_and_add([entry for entry in entries if entry[0] not in self._queued_ids])
+        if len(self.index) > before:
+            logger.info(f"Similarity index caught up: {len(self.index) - before} interactions embedded in "
+                        f"{time.perf_counter() - start:.1f}s ({len(self.index)} total)")
+            await self.save()
+
+    async def _embed_and_add(self, entries: List[IndexEntry]):
+        entries = [entry for entry in entries if entry[1]] # Nothing to compare without key points or follow-ups
+        if not entries:
+            return
+        start = time.perf_counter()
+        try:
+            vectors = await asyncio.to_thread(self.embedder.embed, [text for _, text, _ in entries])
+        except Exception as e:
+            self.failed += len(entries)
+            logger.error(f"Embedding {len(entries)} interactions failed: {e}")
+            return
+        self.index.add([entry[0] for entry in entries], vectors, [entry[2] for entry in entries])
+        self.embedded += len(entries)
+        self.embed_ms += (time.perf_counter() - start) * 1000
+        self._dirty = True
+        self._maybe_cluster()
+
+    def _maybe_cluster(self):
+        index = self.index
+        due = (index.centroids is None and len(index) >= SIMILARITY_IVF_MIN_VECTORS) or \
+              (index.centroids is not None and len(index) >= IVF_RETRAIN_GROWTH * index.clustered_size)
+        if due and self._clustering is None:
+            self._clustering = asyncio.create_task(self._cluster())
+
+    async def _cluster(self):
+        index, size = self.index, len(self.index)
+        start = time.perf_counter()
+        try:
+            clusters = await asyncio.to_thread(index.cluster, size)
+            async with self._save_lock: # A save in progress reads rows by their current numbers
+                index.use_clusters(*clusters)
+            self._dirty = True
+            logger.info(f"Similarity index clustered: {len(clusters[0])} lists over {size} vectors in "
+                        f"{time.perf_counter() - start:.1f}s")
+        except Exception as e:
+            logger.error(f"Clustering the similarity index failed: {e}", exc_info=True)
+        finally:
+            self._clustering = None
+
+    async def _source_token(self, max_id: int) -> Optional[str]:
+        return await self.source(max_id) if self.source is not None else None
+
+    async def save(self):
+        if not self.path or self.index is None or not self._dirty:
+            return
+        start = time.perf_counter()
+        async with self._save_lock:
+            self._dirty = False
+            snapshot = self.index.snapshot()
+            try:
+                # Rows up to snapshot["max_id"] are committed and never change, whatever add() does meanwhile
+                source = await self._source_token(snapshot["max_id"])
+            except Exception as e:
+                self._dirty = True
+                logger.warning(f"Similarity index not saved: its database could not be identified ({e})")
+                return
+            await asyncio.to_thread(self.index.save, self.path, snapshot, {"embedder": self.embedder.name, "source": source})
+        logger.info(f"Similarity index saved to {self.path}: {snapshot['size']} vectors in "
+                    f"{(time.perf_counter() - start) * 1000:.0f} ms")
+
+    async def aclose(self):
+        """Stop the worker and save. Rows still queued are re-read from the database at the next start."""
+        for task in (self._worker, self._clustering):
+            if task is not None:
+                task.cancel()
+        await asyncio.gather(*(task for task in (self._worker, self._clustering) if task is not None),
+                             return_exceptions=True)
+        self._worker = self._clustering = None
+        try:
+            await self.save()
+        except Exception as e:
+            logger.error(f"Saving the similarity index failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        index = self.index
+        return {
+            "enabled": self.running,
+            "ready": self.ready,
+            "embedder": self.embedder.name if self.embedder is not None else None,
+            "vectors": len(index) if index is not None else 0,
+            "base_vectors": len(index.base) if index is not None else 0, # Saved (memory-mapped after a load) or clustered
+            "pending": len(self._pending),
+            "ivf_lists": len(index.centroids) if index is not None and index.centroids is not None else 0,
+            "embedded": self.embedded,
+            "failed": self.failed,
+            "embed_ms_per_interaction": self.embed_ms / self.embedded if self.embedded else 0.0,
+            "queries": self.queries,
+            "query_ms_avg": self.query_ms / self.queries if self.queries else 0.0,
+        }
@@ -0,0 +1,366 @@
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import time
+import uuid
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "true").lower() == "true"
+TRACE_SLOW_REQUEST_MS = float(os.getenv("TRACE_SLOW_REQUEST_MS", "1000")) # Slower requests log their spans (0 = all)
+PAYLOAD_LOG_SAMPLE_RATE = float(os.getenv("PAYLOAD_LOG_SAMPLE_RATE", "0")) # Share of requests whose payloads are logged
+OTEL_TRACING_ENABLED = os.getenv("OTEL_TRACING_ENABLED", "false").lower() == "true"
+OTEL_SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "hcp-crm-backend")
+METRICS_PREFIX = "hcp_crm"
+DURATION_BUCKETS_S = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+# --- Prometheus-style metrics ---
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _label_text(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{_escape(value)}"' for key, value in labels) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name, self.help_text = name, help_text
+        self.values: Dict[Tuple, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str):
+        key = tuple(sorted(labels.items()))
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        lines += [f"{self.name}{_label_text(key)} {value:g}" for key, value in sorted(self.values.items())]
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Sequence[float] = DURATION_BUCKETS_S):
+        self.name, self.help_text, self.buckets = name, help_text, tuple(buckets)
+        self.series: Dict[Tuple, List[float]] = {} # labels -> per-bucket counts (non-cumulative) + [sum, count]
+
+    def observe(self, value: float, **labels: str):
+        key = tuple(sorted(labels.items()))
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0.0] * (len(self.buckets) + 3)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                series[i] += 1
+                break
+        else:
+            series[len(self.buckets)] += 1 # +Inf
+        series[-2] += value
+        series[-1] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for key, series in sorted(self.series.items()):
+            cumulative = 0.0
+            for bound, count in zip(self.buckets + (float("inf"),), series):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                lines.append(f"{self.name}_bucket{_label_text(key + (('le', le),))} {cumulative:g}")
+            lines.append(f"{self.name}_sum{_label_text(key)} {series[-2]:.6f}")
+            lines.append(f"{self.name}_count{_label_text(key)} {series[-1]:g}")
+        return lines
+
+
+span_duration = Histogram(f"{METRICS_PREFIX}_span_duration_seconds",
+                          "Duration of traced operations (HTTP requests, graph nodes, LLM calls, DB statements).")
+http_requests = Counter(f"{METRICS_PREFIX}_http_requests_total", "HTTP requests by route and status.")
+llm_tokens = Counter(f"{METRICS_PREFIX}_llm_tokens_total",
+                     "LLM tokens by model and direction (estimated when the provider reports no usage).")
+
+
+def render_gauges(name: str, stats: Dict[str, Any], **labels: str) -> List[str]:
+    """Numeric fields of an existing stats dict (e.g. llm_scheduler.stats()) as gauges named {name}_{field}."""
+    lines = []
+    for field, value in stats.items():
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            continue
+        metric = f"{METRICS_PREFIX}_{name}_{field}"
+        lines += [f"# TYPE {metric} gauge", f"{metric}{_label_text(tuple(sorted(labels.items())))} {value:g}"]
+    return lines
+
+
+def render_metrics(extra_lines: Sequence[str] = ()) -> str:
+    lines = span_duration.render() + http_requests.render() + llm_tokens.render() + list(extra_lines)
+    return "\n".join(lines) + "\n"
+
+
+# --- Optional OpenTelemetry export ---
+_otel_tracer = None
+_otel_provider = None
+
+
+def setup_opentelemetry() -> bool:
+    """With OTEL_TRACING_ENABLED, also export every span over OTLP (endpoint from OTEL_EXPORTER_OTLP_ENDPOINT)."""
+    global _otel_tracer, _otel_provider
+    if not OTEL_TRACING_ENABLED or _otel_tracer is not None:
+        return _otel_tracer is not None
+    try:
+        # Optional dependency: pip install opentelemetry-sdk opentelemetry-exporter-otlp-proto-http
+        from opentelemetry import trace as otel_trace
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+    except ImportError as e:
+        logger.warning(f"OTEL_TRACING_ENABLED is set but OpenTelemetry is not installed ({e}); spans stay local.")
+        return False
+    _otel_provider = TracerProvider(resource=Resource.create({"service.name": OTEL_SERVICE_NAME}))
+    _otel_provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    otel_trace.set_tracer_provider(_otel_provider)
+    _otel_tracer = otel_trace.get_tracer(__name__)
+    logger.info(f"OpenTelemetry span export enabled (service {OTEL_SERVICE_NAME}).")
+    return True
+
+
+def shutdown_opentelemetry():
+    global _otel_tracer, _otel_provider
+    if _otel_provider is not None:
+        _otel_provider.shutdown() # Flushes spans still in the batch processor
+    _otel_tracer = _otel_provider = None
+
+
+# --- Spans and traces ---
+class Trace:
+    """The spans of one HTTP request, kept for its slow-request log line and Server-Timing header."""
+
+    def __init__(self, method: str, path: str):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.method, self.path, self.route = method, path, path
+        self.started = time.perf_counter()
+        self.spans: List["Span"] = []
+        self.log_payloads = PAYLOAD_LOG_SAMPLE_RATE > 0 and random.random() < PAYLOAD_LOG_SAMPLE_RATE
+
+    def as_dict(self, status: int, duration_ms: float) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id, "method": self.method, "route": self.route, "status": status,
+            "duration_ms": round(duration_ms, 2),
+            "spans": [{"span": f"{span.kind}:{span.name}", "start_ms": round((span.started - self.started) * 1000, 2),
+                       "duration_ms": round(span.duration_ms, 2), **span.attributes} for span in self.spans],
+        }
+
+    def server_timing(self) -> str:
+        # Total time per span kind; durations of nested spans overlap their parent's
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            totals[span.kind] = totals.get(span.kind, 0.0) + span.duration_ms
+        return ", ".join(f"{kind};dur={duration_ms:.1f}" for kind, duration_ms in totals.items())
+
+
+_current_trace: contextvars.ContextVar[Optional[Trace]] = contextvars.ContextVar("current_trace", default=None)
+_current_span: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """One timed operation. `kind` is its family (http, node, llm, db) and `name` the operation within it."""
+
+    def __init__(self, kind: str, name: str, **attributes: Any):
+        self.kind, self.name, self.attributes = kind, name, attributes
+        self.trace = _current_trace.get()
+        self.started = time.perf_counter()
+        self.duration_ms = 0.0
+        self._otel_span = _otel_tracer.start_span(f"{kind} {name}", attributes=attributes) if _otel_tracer else None
+
+    def set(self, **attributes: Any):
+        self.attributes.update(attributes)
+        if self._otel_span is not None:
+            self._otel_span.set_attributes(attributes)
+
+    def rename(self, name: str):
+        self.name = name
+        if self._otel_span is not None:
+            self._otel_span.update_name(f"{self.kind} {name}")
+
+    def end(self, error: Optional[BaseException] = None):
+        self.duration_ms = (time.perf_counter() - self.started) * 1000
+        if error is not None:
+            self.set(error=type(error).__name__)
+        span_duration.observe(self.duration_ms / 1000, kind=self.kind, name=self.name)
+        if self.trace is not None:
+            self.trace.spans.append(self)
+        if self._otel_span is not None:
+            self._otel_span.end()
+
+
+class _NoopSpan:
+    def set(self, **attributes: Any):
+        pass
+
+    def rename(self, name: str):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+@contextmanager
+def span(kind: str, name: str, **attributes: Any):
+    """Time the enclosed block; spans opened inside it (e.g. LLM calls in a graph node) are its children."""
+    if not TRACING_ENABLED:
+        yield NOOP_SPAN
+        return
+    current = Span(kind, name, **attributes)
+    otel_context = None
+    if current._otel_span is not None:
+        from opentelemetry import trace as otel_trace
+        otel_context = otel_trace.use_span(current._otel_span, end_on_exit=False)
+        otel_context.__enter__()
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.end(error=e)
+        raise
+    else:
+        current.end()
+    finally:
+        _current_span.reset(token)
+        if otel_context is not None:
+            otel_context.__exit__(None, None, None)
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def traced_node(name: str, node: Callable):
+    """Wrap an async LangGraph node so each run is a "node" span."""
+    async def run(state):
+        with span("node", name):
+            return await node(state)
+    run.__name__ = getattr(node, "__name__", name)
+    return run
+
+
+def detach_trace():
+    """Stop attributing spans to the current request (for background tasks spawned by it)."""
+    _current_trace.set(None)
+    _current_span.set(None)
+
+
+def mark_request_parsed():
+    """Record the time from request arrival until the handler runs (body read, validation, dependencies)."""
+    trace = _current_trace.get()
+    if not TRACING_ENABLED or trace is None:
+        return
+    parsed = Span("http", "parse")
+    parsed.started = trace.started
+    parsed.end()
+
+
+def record_llm_usage(model: str, prompt_tokens: int, completion_tokens: int):
+    llm_tokens.inc(prompt_tokens, model=model, direction="prompt")
+    llm_tokens.inc(completion_tokens, model=model, direction="completion")
+    current_span().set(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+
+
+# --- Sampled, lazy payload logging ---
+def log_payload(target_logger: logging.Logger, message: str, payload: Callable[[], Any]):
+    """
+    Log `message: payload()` for a sampled share of requests (PAYLOAD_LOG_SAMPLE_RATE).
+    `payload` is only called when the line is actually written, so serializing bodies costs nothing otherwise.
+    """
+    if PAYLOAD_LOG_SAMPLE_RATE <= 0 or not target_logger.isEnabledFor(logging.INFO):
+        return
+    trace = _current_trace.get()
+    sampled = trace.log_payloads if trace is not None else random.random() < PAYLOAD_LOG_SAMPLE_RATE
+    if sampled:
+        target_logger.info(f"{message}: {payload()}")
+
+
+# --- DB statements ---
+_SQL_TABLE = re.compile(r'\b(?:INTO|FROM|UPDATE)\s+"?(\w+)', re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def sql_span_name(statement: str) -> str:
+    """"INSERT interactions", "SELECT analytics_rollups", ...: low-cardinality names for metrics labels."""
+    words = statement.split(None, 1)
+    verb = words[0].upper() if words else "SQL"
+    if verb not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH"):
+        return verb # DDL and PRAGMAs: the verb is enough
+    table = _SQL_TABLE.search(statement)
+    return f"{verb} {table.group(1)}" if table else verb
+
+
+def instrument_engine(sync_engine):
+    """Time every statement run on this engine (pass async_engine.sync_engine for an async engine)."""
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if TRACING_ENABLED:
+            conn.info.setdefault("trace_spans", []).append(Span("db", sql_span_name(statement), executemany=executemany))
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if conn.info.get("trace_spans"):
+            conn.info["trace_spans"].pop().end()
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("trace_spans"):
+            conn.info["trace_spans"].pop().end(error=exception_context.original_exception)
+
+
+# --- ASGI middleware ---
+class TracingMiddleware:
+    """
+    Opens a Trace per HTTP request, records it as an "http" span labelled with the route template,
+    adds a Server-Timing header and logs the span breakdown of requests slower than TRACE_SLOW_REQUEST_MS.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+        trace = Trace(scope["method"], scope["path"])
+        trace_token = _current_trace.set(trace)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                timing = trace.server_timing()
+                if timing:
+                    message["headers"] = list(message.get("headers", [])) + [(b"server-timing", timing.encode())]
+            await send(message)
+
+        try:
+            with span("http", "request") as request_span:
+                try:
+                    await self.app(scope, receive, send_with_timing)
+                finally:
+                    # Route template rather than the raw path, to keep metric label cardinality bounded
+                    trace.route = getattr(scope.get("route"), "path", None) or "unmatched"
+                    request_span.rename(f"{trace.method} {trace.route}")
+                    request_span.set(status=status)
+        finally:
+            _current_trace.reset(trace_token)
+        http_requests.inc(method=trace.method, route=trace.route, status=str(status))
+        duration_ms = (time.perf_counter() - trace.started) * 1000
+        if duration_ms >= TRACE_SLOW_REQUEST_MS:
+            logger.warning(f"Slow request trace: {json.dumps(trace.as_dict(status, duration_ms), default=str)}")
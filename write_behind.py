@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# --- Configuration ---
+CHAT_WRITE_BEHIND_ENABLED = os.getenv("CHAT_WRITE_BEHIND_ENABLED", "true").lower() == "true"
+WRITE_BEHIND_MAX_QUEUE = int(os.getenv("WRITE_BEHIND_MAX_QUEUE", "1000")) # Enqueuers wait (backpressure) beyond this
+WRITE_BEHIND_BATCH_SIZE = int(os.getenv("WRITE_BEHIND_BATCH_SIZE", "100")) # Saves committed per transaction
+WRITE_BEHIND_LINGER_MS = float(os.getenv("WRITE_BEHIND_LINGER_MS", "10")) # How long a batch waits to fill up
+WRITE_BEHIND_TICKETS_KEPT = 10000 # Finished tickets remembered for status lookups, oldest dropped first
+
+QUEUED, SAVED, FAILED = "queued", "saved", "failed"
+
+
+@dataclass
+class SaveTicket:
+    ticket: str
+    status: str = QUEUED
+    interaction_id: Optional[int] = None
+    error: Optional[str] = None
+    queued_at: float = 0.0
+    saved_at: Optional[float] = None
+
+
+class WriteBehindQueue:
+    """
+    Accepts rows to persist and returns a ticket immediately; a single worker drains the queue and
+    hands up to `batch_size` rows at a time to `flush`, which writes them in one transaction and
+    returns their ids. If a batch fails, its rows are retried one by one so a bad row only fails itself.
+    """
+
+    def __init__(self, flush: Callable[[List[Dict[str, Any]]], Awaitable[List[int]]],
+                 on_saved: Optional[Callable[[Dict[str, Any], int], None]] = None,
+                 max_queue: int = WRITE_BEHIND_MAX_QUEUE, batch_size: int = WRITE_BEHIND_BATCH_SIZE,
+                 linger_ms: float = WRITE_BEHIND_LINGER_MS):
+        self.flush = flush
+        self.on_saved = on_saved
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.linger_s = linger_ms / 1000
+        self.tickets: "OrderedDict[str, SaveTicket]" = OrderedDict()
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self.saved = 0
+        self.failed = 0
+        self.batches = 0
+        self.backpressure_waits = 0
+
+    def start(self):
+        if self._worker is None:
+            # Created here, not in __init__, so it binds to the running event loop
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._worker = asyncio.create_task(self._run())
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None
+
+    async def enqueue(self, row: Dict[str, Any]) -> SaveTicket:
+        ticket = SaveTicket(ticket=uuid.uuid4().hex, queued_at=time.time())
+        self._remember(ticket)
+        if self._queue.full():
+            self.backpressure_waits += 1
+        await self._queue.put((ticket, row)) # Waits while the queue is full
+        return ticket
+
+    def status(self, ticket: str) -> Optional[SaveTicket]:
+        return self.tickets.get(ticket)
+
+    def _remember(self, ticket: SaveTicket):
+        self.tickets[ticket.ticket] = ticket
+        while len(self.tickets) > WRITE_BEHIND_TICKETS_KEPT:
+            oldest = next(iter(self.tickets.values()))
+            if oldest.status == QUEUED:
+                break # Never forget a save that has not finished yet
+            self.tickets.popitem(last=False)
+
+    async def _next_batch(self) -> List[tuple]:
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.linger_s
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._next_batch()
+            try:
+                await self._write(batch)
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+    async def _write(self, batch: List[tuple]):
+        self.batches += 1
+        try:
+            ids = await self.flush([row for _, row in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                self._mark_failed(batch[0][0], e)
+                return
+            logger.warning(f"Write-behind batch of {len(batch)} failed ({e}); retrying rows one by one")
+            for item in batch:
+                await self._write([item])
+            return
+        for (ticket, row), interaction_id in zip(batch, ids):
+            self._mark_saved(ticket, row, interaction_id)
+
+    def _mark_saved(self, ticket: SaveTicket, row: Dict[str, Any], interaction_id: int):
+        ticket.status, ticket.interaction_id, ticket.saved_at = SAVED, interaction_id, time.time()
+        self.saved += 1
+        if self.on_saved is not None:
+            self.on_saved(row, interaction_id)
+
+    def _mark_failed(self, ticket: SaveTicket, error: Exception):
+        ticket.status, ticket.error = FAILED, str(error)
+        self.failed += 1
+        logger.error(f"Write-behind save {ticket.ticket} failed: {error}")
+
+    async def drain(self):
+        """Wait for every queued save to be written, then stop the worker."""
+        if self._worker is None:
+            return
+        pending = self._queue.qsize()
+        await self._queue.join()
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+        logger.info(f"Write-behind queue drained ({pending} saves were pending at shutdown).")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": True,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue": self.max_queue,
+            "batch_size": self.batch_size,
+            "saved": self.saved,
+            "failed": self.failed,
+            "batches": self.batches,
+            "avg_batch_size": (self.saved + self.failed) / self.batches if self.batches else 0.0,
+            "backpressure_waits": self.backpressure_waits,
+        }